@@ -0,0 +1,122 @@
+#!/bin/bash
+
+# Launches a parameter server and several synchronous training workers on
+# localhost. Worker 0 is the chief, it writes summaries and checkpoints.
+
+export GPUID=0
+export NET="squeezeDet"
+export TRAIN_DIR="/tmp/bichen/logs/SqueezeDet/"
+export NUM_WORKERS=2
+export PORT=2222
+
+if [ $# -eq 0 ]
+then
+  echo "Usage: ./scripts/train_distributed.sh [options]"
+  echo " "
+  echo "options:"
+  echo "-h, --help                show brief help"
+  echo "-net                      (squeezeDet|squeezeDet+|vgg16|resnet50)"
+  echo "-gpu                      gpu id used by all workers"
+  echo "-train_dir                directory for training logs"
+  echo "-num_workers              number of worker processes"
+  echo "-port                     first local port, the ps uses it"
+  exit 0
+fi
+
+while test $# -gt 0; do
+  case "$1" in
+    -h|--help)
+      echo "Usage: ./scripts/train_distributed.sh [options]"
+      echo " "
+      echo "options:"
+      echo "-h, --help                show brief help"
+      echo "-net                      (squeezeDet|squeezeDet+|vgg16|resnet50)"
+      echo "-gpu                      gpu id used by all workers"
+      echo "-train_dir                directory for training logs"
+      echo "-num_workers              number of worker processes"
+      echo "-port                     first local port, the ps uses it"
+      exit 0
+      ;;
+    -net)
+      export NET="$2"
+      shift
+      shift
+      ;;
+    -gpu)
+      export GPUID="$2"
+      shift
+      shift
+      ;;
+    -train_dir)
+      export TRAIN_DIR="$2"
+      shift
+      shift
+      ;;
+    -num_workers)
+      export NUM_WORKERS="$2"
+      shift
+      shift
+      ;;
+    -port)
+      export PORT="$2"
+      shift
+      shift
+      ;;
+    *)
+      break
+      ;;
+  esac
+done
+
+case "$NET" in
+  "squeezeDet")
+    export PRETRAINED_MODEL_PATH="./data/SqueezeNet/squeezenet_v1.1.pkl"
+    ;;
+  "squeezeDet+")
+    export PRETRAINED_MODEL_PATH="./data/SqueezeNet/squeezenet_v1.0_SR_0.750.pkl"
+    ;;
+  "resnet50")
+    export PRETRAINED_MODEL_PATH="./data/ResNet/ResNet-50-weights.pkl"
+    ;;
+  "vgg16")
+    export PRETRAINED_MODEL_PATH="./data/VGG16/VGG_ILSVRC_16_layers_weights.pkl"
+    ;;
+  *)
+    echo "net architecture not supported."
+    exit 0
+    ;;
+esac
+
+export PS_HOSTS="localhost:$PORT"
+export WORKER_HOSTS="localhost:$((PORT+1))"
+for i in $(seq 1 $((NUM_WORKERS-1))); do
+  export WORKER_HOSTS="$WORKER_HOSTS,localhost:$((PORT+1+i))"
+done
+
+train() {
+  python ./src/train.py \
+    --dataset=KITTI \
+    --pretrained_model_path=$PRETRAINED_MODEL_PATH \
+    --data_path=./data/KITTI \
+    --image_set=train \
+    --train_dir="$TRAIN_DIR/train" \
+    --net=$NET \
+    --summary_step=100 \
+    --checkpoint_step=500 \
+    --ps_hosts=$PS_HOSTS \
+    --worker_hosts=$WORKER_HOSTS \
+    "$@"
+}
+
+# the parameter server does not need a gpu
+train --job_name=ps --task_index=0 --gpu= &
+PS_PID=$!
+
+WORKER_PIDS=""
+for i in $(seq 0 $((NUM_WORKERS-1))); do
+  train --job_name=worker --task_index=$i --gpu=$GPUID &
+  WORKER_PIDS="$WORKER_PIDS $!"
+done
+
+wait $WORKER_PIDS
+kill $PS_PID
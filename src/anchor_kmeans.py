@@ -0,0 +1,259 @@
+"""Cluster the ground truth box sizes of a dataset into anchor shapes.
+
+Replaces analysis/CustomAnchorComputation.ipynb. The box sizes are read with
+the annotation loader of the dataset, scaled to the input resolution of the
+net and clustered with k-means, seeded with k-means++ and restarted several
+times in parallel processes. Three distances are supported:
+
+  iou:    1 - IOU of a box and an anchor of the same center.
+  linear: euclidean distance of [width, height], like the linear anchors.
+  log:    euclidean distance of [log(width), log(height)], like the log
+          anchors, which matches the log encoding of the box sizes.
+
+The resulting shapes are printed as an entry of ANCHOR_SHAPES in
+utils/anchors.py, together with the mean IOU of every box with its best
+anchor for the new shapes and the current ones, e.g.
+
+  python ./src/anchor_kmeans.py --dataset=CITYSCAPE --data_path=$DATA \\
+      --mode=log --num_anchors=9
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import multiprocessing
+import time
+
+import numpy as np
+import tensorflow as tf
+
+from config import *
+from dataset import kitti, cityscape
+from utils.anchors import ANCHOR_SHAPES
+
+FLAGS = tf.app.flags.FLAGS
+
+tf.app.flags.DEFINE_string('dataset', 'CITYSCAPE',
+                           """Currently only support KITTI and CITYSCAPE datasets.""")
+tf.app.flags.DEFINE_string('data_path', '', """Root directory of data""")
+tf.app.flags.DEFINE_string('image_set', 'train',
+                           """ Can be train, trainval, val, or test""")
+tf.app.flags.DEFINE_string('mode', 'iou',
+                           """Clustering distance, iou, linear or log.""")
+tf.app.flags.DEFINE_integer('num_anchors', 9, """Number of anchor shapes.""")
+tf.app.flags.DEFINE_integer('num_restarts', 8,
+                            """Number of differently seeded runs, the one """
+                            """with the lowest cost is kept.""")
+tf.app.flags.DEFINE_integer('num_processes', 0,
+                            """Number of processes for the restarts, 0 uses """
+                            """all cpus.""")
+tf.app.flags.DEFINE_integer('max_iter', 300,
+                            """Maximum number of k-means iterations.""")
+tf.app.flags.DEFINE_integer('seed', 0, """Seed of the first restart.""")
+tf.app.flags.DEFINE_float('min_size', 10.0,
+                          """Ignore boxes narrower or lower than this, in """
+                          """pixels of the original images.""")
+tf.app.flags.DEFINE_integer('original_width', 0,
+                            """Width of the original images, 0 uses the one """
+                            """of the dataset.""")
+tf.app.flags.DEFINE_integer('original_height', 0,
+                            """Height of the original images, 0 uses the one """
+                            """of the dataset.""")
+tf.app.flags.DEFINE_string('baseline_shapes', '',
+                           """Name of the shapes in ANCHOR_SHAPES to compare """
+                           """with, empty uses the ones of the dataset.""")
+tf.app.flags.DEFINE_string('name', '',
+                           """Name of the printed ANCHOR_SHAPES entry.""")
+
+# size of the original images, the anchors are in pixels of the resized ones
+ORIGINAL_SIZE = {'KITTI': (1242, 375), 'CITYSCAPE': (2048, 1024)}
+
+def shape_iou(boxes, anchors):
+  """IOU of boxes and anchors that share the same center.
+
+  Args:
+    boxes: [N, 2] array of [width, height].
+    anchors: [K, 2] array of [width, height].
+  Returns:
+    [N, K] array of IOUs.
+  """
+  inter = np.minimum(boxes[:, None, 0], anchors[None, :, 0]) \
+      * np.minimum(boxes[:, None, 1], anchors[None, :, 1])
+  union = (boxes[:, 0]*boxes[:, 1])[:, None] \
+      + (anchors[:, 0]*anchors[:, 1])[None, :] - inter
+  return inter/union
+
+def _to_points(sizes, mode):
+  return np.log(sizes) if mode == 'log' else sizes
+
+def _to_sizes(points, mode):
+  return np.exp(points) if mode == 'log' else points
+
+def _distances(points, centroids, mode):
+  """[N, K] distances of points to centroids, both in the clustering space."""
+  if mode == 'iou':
+    return 1.0 - shape_iou(points, centroids)
+  # |p - c|^2 expanded into a matrix product
+  dist = np.sum(points**2, axis=1)[:, None] - 2*np.dot(points, centroids.T) \
+      + np.sum(centroids**2, axis=1)[None, :]
+  return np.maximum(dist, 0)
+
+def _seed_centroids(points, counts, k, mode, rng):
+  """k-means++: every further centroid is drawn with a probability
+  proportional to the squared distance of a point to its closest centroid."""
+  centroids = points[rng.choice(len(points), p=counts/counts.sum())][None, :]
+  min_dist = _distances(points, centroids, mode)[:, 0]
+  for _ in range(1, k):
+    weights = counts*(min_dist**2 if mode == 'iou' else min_dist)
+    if weights.sum() > 0:
+      i = rng.choice(len(points), p=weights/weights.sum())
+    else:
+      i = rng.randint(len(points))
+    centroids = np.vstack([centroids, points[i]])
+    min_dist = np.minimum(
+        min_dist, _distances(points, points[i][None, :], mode)[:, 0])
+  return centroids
+
+def _kmeans(args):
+  """One seeded k-means run.
+
+  Args:
+    args: (points, counts, k, mode, seed, max_iter), a tuple to run in a
+        process pool. points are the distinct points in the clustering space
+        and counts the number of boxes of every point.
+  Returns:
+    centroids: [k, 2] centroids in the clustering space.
+    cost: sum of the distances of all boxes to their centroid.
+  """
+  points, counts, k, mode, seed, max_iter = args
+  rng = np.random.RandomState(seed)
+  centroids = _seed_centroids(points, counts, k, mode, rng)
+  assignment = None
+  for _ in range(max_iter):
+    dist = _distances(points, centroids, mode)
+    new_assignment = np.argmin(dist, axis=1)
+    if assignment is not None and np.array_equal(new_assignment, assignment):
+      break
+    assignment = new_assignment
+    cluster_counts = np.bincount(assignment, weights=counts, minlength=k)
+    sums = np.stack([np.bincount(assignment, weights=counts*points[:, i],
+                                 minlength=k) for i in range(2)], axis=1)
+    empty = np.nonzero(cluster_counts == 0)[0]
+    if len(empty) > 0:
+      # move the empty clusters to the worst represented points
+      point_dist = dist[np.arange(len(points)), assignment]
+      worst = np.argsort(-point_dist)[:len(empty)]
+      sums[empty], cluster_counts[empty] = points[worst], 1
+    centroids = sums/cluster_counts[:, None]
+
+  dist = _distances(points, centroids, mode)
+  return centroids, np.sum(counts*np.min(dist, axis=1))
+
+def cluster(sizes, k, mode, num_restarts, num_processes=0, seed=0,
+            max_iter=300):
+  """Cluster box sizes into anchor shapes.
+
+  Args:
+    sizes: [N, 2] array of box [width, height].
+    k: number of anchor shapes.
+    mode: clustering distance, iou, linear or log.
+    num_restarts: number of differently seeded runs.
+    num_processes: number of processes for the runs, 0 uses all cpus.
+    seed: seed of the first run.
+    max_iter: maximum number of iterations of a run.
+  Returns:
+    [k, 2] array of anchor [width, height] of the run with the lowest cost,
+    sorted by area.
+  """
+  assert mode in ['iou', 'linear', 'log'], \
+      'Clustering mode not supported: {}'.format(mode)
+  assert len(sizes) >= k, \
+      'Need at least {} boxes, found {}'.format(k, len(sizes))
+  # annotations are mostly whole pixels, so that many boxes share a size and
+  # every distinct size only needs to be clustered once
+  points, counts = np.unique(_to_points(sizes, mode), axis=0,
+                             return_counts=True)
+  counts = counts.astype(np.float64)
+  runs = [(points, counts, k, mode, seed+i, max_iter)
+          for i in range(num_restarts)]
+  num_processes = min(num_processes or multiprocessing.cpu_count(),
+                      num_restarts)
+  if num_processes > 1:
+    pool = multiprocessing.Pool(num_processes)
+    try:
+      results = pool.map(_kmeans, runs)
+    finally:
+      pool.close()
+      pool.join()
+  else:
+    results = [_kmeans(r) for r in runs]
+
+  centroids, _ = min(results, key=lambda r: r[1])
+  shapes = _to_sizes(centroids, mode)
+  return shapes[np.argsort(shapes[:, 0]*shapes[:, 1])]
+
+def mean_best_iou(sizes, shapes):
+  """Mean IOU of every box with the anchor shape it overlaps most."""
+  return np.mean(np.max(shape_iou(sizes, np.asarray(shapes)), axis=1))
+
+def format_shapes(name, shapes):
+  """Anchor shapes as an entry of ANCHOR_SHAPES, three per line."""
+  prefix = "    '{}': [".format(name)
+  entries = ['[{:.2f}, {:.2f}]'.format(w, h) for w, h in shapes]
+  lines = [', '.join(entries[i:i+3]) for i in range(0, len(entries), 3)]
+  return prefix + (',\n'+' '*len(prefix)).join(lines) + '],'
+
+def _load_box_sizes():
+  """Box sizes of the image set, scaled to the input resolution of the net."""
+  assert FLAGS.dataset == 'KITTI' or FLAGS.dataset == 'CITYSCAPE', \
+      'Currently only support KITTI and CITYSCAPE datasets'
+  if FLAGS.dataset == 'KITTI':
+    mc = kitti_squeezeDet_config(4, False, 'normal')
+    imdb = kitti(FLAGS.image_set, FLAGS.data_path, mc)
+  else:
+    mc = cityscape_squeezeDet_config(4, False, False, 'normal')
+    imdb = cityscape(FLAGS.image_set, FLAGS.data_path, mc)
+
+  original_width, original_height = ORIGINAL_SIZE[FLAGS.dataset]
+  original_width = FLAGS.original_width or original_width
+  original_height = FLAGS.original_height or original_height
+
+  sizes = imdb.box_sizes()
+  sizes = sizes[(sizes[:, 0] >= FLAGS.min_size) & (sizes[:, 1] >= FLAGS.min_size)]
+  sizes *= [mc.IMAGE_WIDTH/original_width, mc.IMAGE_HEIGHT/original_height]
+  return sizes, mc
+
+def main(argv=None):
+  sizes, mc = _load_box_sizes()
+  print('Clustering {} boxes into {} anchor shapes, {} distance, {} restarts'
+        .format(len(sizes), FLAGS.num_anchors, FLAGS.mode, FLAGS.num_restarts))
+
+  start = time.time()
+  shapes = cluster(sizes, FLAGS.num_anchors, FLAGS.mode, FLAGS.num_restarts,
+                   FLAGS.num_processes, FLAGS.seed, FLAGS.max_iter)
+  print('Done in {:.2f} s'.format(time.time()-start))
+
+  name = FLAGS.name or '{}_{}'.format(FLAGS.dataset.lower(), FLAGS.mode)
+  print('\nAnchor shapes for {}x{} images:'.format(
+      mc.IMAGE_WIDTH, mc.IMAGE_HEIGHT))
+  print(format_shapes(name, shapes))
+
+  best = np.argmax(shape_iou(sizes, shapes), axis=1)
+  print('\nShare of the boxes per anchor:')
+  for j, (w, h) in enumerate(shapes):
+    print('  [{:7.2f}, {:7.2f}]: {:5.1f}%'.format(
+        w, h, 100.0*np.mean(best == j)))
+
+  baseline = FLAGS.baseline_shapes
+  if not baseline:
+    if FLAGS.dataset == 'KITTI':
+      baseline = 'kitti'
+    else:
+      baseline = 'cityscape_log' if FLAGS.mode == 'log' else 'cityscape_linear'
+  print('\nMean best IOU: {:.4f} ({}: {:.4f})'.format(
+      mean_best_iou(sizes, shapes), baseline,
+      mean_best_iou(sizes, ANCHOR_SHAPES[baseline])))
+
+if __name__ == '__main__':
+  tf.app.run()
@@ -0,0 +1,87 @@
+"""Throughput of the offline batched inference for several batch sizes.
+
+Reads up to --num_frames frames of --input_path, a video or a glob of images,
+into memory once and runs all of them through the offline pipeline of
+inference.py for every batch size of --batch_sizes, on the same frozen
+inference graph. Pre-processing, network and post-processing overlap in
+their threads, so the frame rate is the one of the slowest stage. For every
+batch size the frame rate, the time per frame, the mean latency of the
+network and of the post-processing per batch and the speedup over the first
+batch size are printed, e.g.
+
+  python ./src/benchmark_batch_inference.py --inference_graph=$GRAPH \
+      --input_path=$VIDEO --dataset_inf=CITYSCAPE --batch_sizes=1,2,4,8,16
+
+The graph needs a dynamic batch dimension, as exported by
+export_inference_graph.py.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import itertools
+import time
+from multiprocessing.pool import ThreadPool
+
+import tensorflow as tf
+
+from inference import (build_decoder, load_inference_graph, offline_pipeline,
+                       read_frames)
+
+FLAGS = tf.app.flags.FLAGS
+
+tf.app.flags.DEFINE_string('batch_sizes', '1,2,4,8,16',
+                           """Comma-separated list of batch sizes.""")
+tf.app.flags.DEFINE_integer('num_frames', 256,
+                            """Maximum number of frames to run.""")
+tf.app.flags.DEFINE_integer('num_runs', 3,
+                            """Number of timed runs per batch size.""")
+
+def _read_frames(input_path, num_frames):
+  """(name, BGR image) of the first num_frames frames of a video or a glob."""
+  return [(name, img) for _, name, img
+          in itertools.islice(read_frames(input_path), num_frames)]
+
+def main(argv=None):
+  batch_sizes = [int(b) for b in FLAGS.batch_sizes.split(',')]
+  frames = _read_frames(FLAGS.input_path, FLAGS.num_frames)
+  assert len(frames) > 0, 'No frame found at {}'.format(FLAGS.input_path)
+  print('{} frames of {}'.format(len(frames), FLAGS.input_path))
+
+  graph, image_tensor, output_tensor = load_inference_graph(FLAGS.inference_graph)
+  decoder = build_decoder(FLAGS.mask_parameterization_inf,
+                          FLAGS.log_anchors_inf, FLAGS.encoding_type_inf)
+  pool = ThreadPool(FLAGS.post_processing_threads_inf)
+
+  print('{:>6s} {:>10s} {:>10s} {:>14s} {:>15s} {:>8s}'.format(
+      'batch', 'frames/s', 'ms/frame', 'net ms/batch', 'post ms/batch',
+      'speedup'))
+  first_fps = None
+  with tf.Session(graph=graph) as sess:
+    for batch_size in batch_sizes:
+      # untimed run of one batch, the first run of a new input shape is slow
+      for _ in offline_pipeline(frames[:batch_size], sess, output_tensor,
+                                image_tensor, decoder, batch_size, pool=pool):
+        pass
+      fps, net_ms, post_ms = [], [], []
+      for _ in range(FLAGS.num_runs):
+        pipeline = offline_pipeline(
+            frames, sess, output_tensor, image_tensor, decoder, batch_size,
+            pool=pool, queue_size=FLAGS.queue_size_inf)
+        start = time.time()
+        num_frames = sum(len(batch) for batch in pipeline)
+        fps.append(num_frames/(time.time()-start))
+        summary = pipeline.stats.summary()
+        net_ms.append(summary['inference'][0])
+        post_ms.append(summary['post-process'][0])
+      best = max(range(FLAGS.num_runs), key=lambda i: fps[i])
+      if first_fps is None:
+        first_fps = fps[best]
+      print('{:6d} {:10.2f} {:10.2f} {:14.2f} {:15.2f} {:8.2f}'.format(
+          batch_size, fps[best], 1000/fps[best], net_ms[best], post_ms[best],
+          fps[best]/first_fps))
+  pool.close()
+
+if __name__ == '__main__':
+  tf.app.run()
@@ -0,0 +1,100 @@
+"""Benchmark the sweep NMS against the dense NMS.
+
+Generates synthetic detection candidates, a cluster of jittered boxes around
+every object, and times util.nms, which compares all pairs of boxes, and
+util.sweep_nms, which only compares boxes overlapping along x, for a range of
+candidate counts. The keep masks of both are checked to be identical. The
+scaling exponent between two candidate counts is log(t2/t1)/log(n2/n1), 2 for
+quadratic and 1 for linear scaling.
+
+With --constant_density the scene grows with the number of candidates, like
+more objects on a larger image, so that every box overlaps about the same
+number of others. Otherwise all candidates are placed on one image of
+--image_width x --image_height, where the number of overlapping pairs, and so
+the time of any exact NMS, grows quadratically in the end, e.g.
+
+  python ./src/benchmark_nms.py --num_candidates=500,1000,2000,4000,8000
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import math
+import time
+
+import numpy as np
+import tensorflow as tf
+
+from utils.util import nms, sweep_nms
+
+FLAGS = tf.app.flags.FLAGS
+
+tf.app.flags.DEFINE_string('num_candidates', '250,500,1000,2000,4000,8000',
+                           """Comma-separated list of candidate counts.""")
+tf.app.flags.DEFINE_integer('candidates_per_object', 20,
+                            """Number of jittered boxes around an object.""")
+tf.app.flags.DEFINE_boolean('constant_density', True,
+                            """Grow the scene with the number of candidates ?""")
+tf.app.flags.DEFINE_integer('image_width', 1024,
+                            """Width of the scene of the smallest count.""")
+tf.app.flags.DEFINE_integer('image_height', 512,
+                            """Height of the scene of the smallest count.""")
+tf.app.flags.DEFINE_float('nms_thresh', 0.4, """IOU threshold of the NMS.""")
+tf.app.flags.DEFINE_integer('num_runs', 5, """Number of timed runs per NMS.""")
+tf.app.flags.DEFINE_integer('seed', 0, """Seed of the candidates.""")
+
+def synthetic_candidates(num_candidates, candidates_per_object, width, height,
+                         rng):
+  """Clusters of boxes around random objects.
+
+  Returns:
+    boxes: [num_candidates, 4] array of [cx, cy, w, h].
+    probs: [num_candidates] array of probabilities.
+  """
+  num_objects = int(math.ceil(num_candidates/candidates_per_object))
+  sizes = np.exp(rng.uniform(np.log(10), np.log(200), size=(num_objects, 2)))
+  centers = rng.uniform([0, 0], [width, height], size=(num_objects, 2))
+  obj = rng.randint(num_objects, size=num_candidates)
+  boxes = np.empty((num_candidates, 4))
+  boxes[:, :2] = centers[obj] + rng.normal(scale=0.2, size=(num_candidates, 2))*sizes[obj]
+  boxes[:, 2:] = sizes[obj]*np.exp(rng.normal(scale=0.2, size=(num_candidates, 2)))
+  return boxes, rng.uniform(size=num_candidates)
+
+def _time(fn, num_runs):
+  """Result of fn and its median run time in ms."""
+  times = []
+  for _ in range(num_runs):
+    start = time.time()
+    result = fn()
+    times.append(time.time()-start)
+  return result, 1000*np.median(times)
+
+def main(argv=None):
+  rng = np.random.RandomState(FLAGS.seed)
+  counts = [int(n) for n in FLAGS.num_candidates.split(',')]
+  print('{:>8s} {:>12s} {:>12s} {:>8s} {:>10s} {:>10s}'.format(
+      'boxes', 'dense ms', 'sweep ms', 'speedup', 'dense exp', 'sweep exp'))
+  last = None
+  for n in counts:
+    scale = math.sqrt(n/counts[0]) if FLAGS.constant_density else 1.0
+    boxes, probs = synthetic_candidates(
+        n, FLAGS.candidates_per_object, FLAGS.image_width*scale,
+        FLAGS.image_height*scale, rng)
+    keep, dense_ms = _time(
+        lambda: nms(boxes, probs, FLAGS.nms_thresh), FLAGS.num_runs)
+    sweep_keep, sweep_ms = _time(
+        lambda: sweep_nms(boxes, probs, FLAGS.nms_thresh), FLAGS.num_runs)
+    assert np.array_equal(keep, sweep_keep), \
+        'Sweep NMS differs from the dense NMS for {} boxes'.format(n)
+
+    exponents = ['', '']
+    if last is not None:
+      for i, (t, last_t) in enumerate(zip([dense_ms, sweep_ms], last[1:])):
+        exponents[i] = '{:.2f}'.format(math.log(t/last_t)/math.log(n/last[0]))
+    print('{:8d} {:12.2f} {:12.2f} {:8.1f} {:>10s} {:>10s}'.format(
+        n, dense_ms, sweep_ms, dense_ms/sweep_ms, *exponents))
+    last = (n, dense_ms, sweep_ms)
+
+if __name__ == '__main__':
+  tf.app.run()
@@ -0,0 +1,177 @@
+"""Compare frozen inference graphs on the same images.
+
+Runs a reference graph (usually the float32 export) and one or more candidate
+graphs (e.g. exported with --quantize) over an image list. For every graph the
+file size and the latency of pre-processing, network and post-processing are
+reported, together with the agreement of its detections with the ones of the
+reference graph: the fraction of reference detections matched, the mean IOU
+of the matched boxes and the mean absolute difference of their scores.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import glob
+import os
+import time
+
+import cv2
+import numpy as np
+import tensorflow as tf
+
+from inference import (build_decoder, graph_detections, load_inference_graph,
+                       preprocess_frame)
+from utils.post_processing import filter_prediction
+from utils.util import batch_iou
+
+FLAGS = tf.app.flags.FLAGS
+
+tf.app.flags.DEFINE_string(
+    'reference_graph', '',
+    """Path to the frozen inference graph the others are compared to.""")
+tf.app.flags.DEFINE_string(
+    'candidate_graphs', '',
+    """Comma-separated list of paths to the frozen inference graphs to """
+    """compare.""")
+tf.app.flags.DEFINE_integer('num_images', 100,
+                            """Maximum number of images to run.""")
+tf.app.flags.DEFINE_integer('num_warmup', 5,
+                            """Number of untimed runs before timing a graph.""")
+tf.app.flags.DEFINE_float('score_thresh', 0.5,
+                          """Only compare detections with a higher score.""")
+tf.app.flags.DEFINE_float('match_iou', 0.5,
+                          """Detections are matched if their IOU is larger.""")
+
+PROB_THRESH = 0.005
+
+def _run_graph(graph_path, images):
+  """Run a frozen inference graph on a list of images.
+
+  Args:
+    graph_path: path to the frozen inference graph.
+    images: list of BGR images.
+  Returns:
+    detections: list of (boxes, probs, classes) per image.
+    timings: dict of stage name to an array of per-image latencies in ms.
+  """
+  graph, image_tensor, output_tensor = load_inference_graph(graph_path)
+
+  decoder = build_decoder(FLAGS.mask_parameterization_inf,
+                          FLAGS.log_anchors_inf, FLAGS.encoding_type_inf)
+  timings = {'pre-processing': [], 'network': [], 'post-processing': []}
+  detections = []
+  with tf.Session(graph=graph) as sess:
+    for i in range(-FLAGS.num_warmup, len(images)):
+      img = images[max(i, 0)]
+
+      start = time.time()
+      _, image = preprocess_frame(img)
+      pre_end = time.time()
+
+      output = sess.run(output_tensor, feed_dict={image_tensor: image})
+      net_end = time.time()
+
+      if isinstance(output, list):
+        # the graph filtered its detections itself
+        det_bbox, det_prob, det_class = graph_detections(output, 0)
+      else:
+        boxes, probs, classes = decoder(output)
+        det_bbox, det_prob, det_class = filter_prediction(
+            boxes[0], probs[0], classes[0], PROB_THRESH, nms_thresh=0.5)
+      keep_idx = [idx for idx in range(len(det_prob)) \
+                      if det_prob[idx] >= FLAGS.score_thresh]
+      end = time.time()
+
+      if i < 0:
+        continue
+      timings['pre-processing'].append((pre_end-start)*1000)
+      timings['network'].append((net_end-pre_end)*1000)
+      timings['post-processing'].append((end-net_end)*1000)
+      detections.append((
+          np.array([det_bbox[idx][:4] for idx in keep_idx]).reshape(-1, 4),
+          np.array([det_prob[idx] for idx in keep_idx]),
+          np.array([det_class[idx] for idx in keep_idx])))
+
+  return detections, {k: np.array(v) for k, v in timings.items()}
+
+def _match_detections(ref_detections, detections):
+  """Greedily match detections to reference detections of the same class,
+  most probable reference detection first.
+
+  Returns:
+    ious: IOU of every matched pair.
+    score_deltas: absolute score difference of every matched pair.
+    num_unmatched: number of detections without a reference detection.
+  """
+  ref_boxes, ref_probs, ref_classes = ref_detections
+  boxes, probs, classes = detections
+  ious, score_deltas = [], []
+  matched = np.zeros(len(probs), dtype=bool)
+  for i in np.argsort(-ref_probs):
+    candidates = np.nonzero((classes == ref_classes[i]) & ~matched)[0]
+    if len(candidates) == 0:
+      continue
+    overlaps = batch_iou(boxes[candidates], ref_boxes[i])
+    best = np.argmax(overlaps)
+    if overlaps[best] > FLAGS.match_iou:
+      matched[candidates[best]] = True
+      ious.append(overlaps[best])
+      score_deltas.append(abs(probs[candidates[best]] - ref_probs[i]))
+  return ious, score_deltas, len(probs) - np.sum(matched)
+
+def compare():
+  """Compare the candidate graphs against the reference graph."""
+  assert FLAGS.reference_graph, 'A reference graph is needed'
+  graph_paths = [FLAGS.reference_graph] \
+      + [p for p in FLAGS.candidate_graphs.split(',') if p]
+
+  image_paths = sorted(glob.glob(FLAGS.input_path))[:FLAGS.num_images]
+  assert len(image_paths) > 0, \
+      'No image found at {}'.format(FLAGS.input_path)
+  images = [cv2.imread(p) for p in image_paths]
+  print('Comparing {} graphs on {} images'.format(
+      len(graph_paths), len(images)))
+
+  ref_detections = None
+  for graph_path in graph_paths:
+    detections, timings = _run_graph(graph_path, images)
+    if ref_detections is None:
+      ref_detections = detections
+
+    print('\n{}'.format(graph_path))
+    print('  file size: {:.2f} MB'.format(
+        os.path.getsize(graph_path)/(1024.0*1024.0)))
+    total = np.zeros(len(images))
+    for stage in ['pre-processing', 'network', 'post-processing']:
+      total += timings[stage]
+      print('  {}: {:.2f} ms mean, {:.2f} ms p50, {:.2f} ms p90'.format(
+          stage, np.mean(timings[stage]), np.percentile(timings[stage], 50),
+          np.percentile(timings[stage], 90)))
+    print('  total: {:.2f} ms mean, {:.2f} ms p90'.format(
+        np.mean(total), np.percentile(total, 90)))
+
+    if graph_path == FLAGS.reference_graph:
+      continue
+    all_ious, all_deltas = [], []
+    num_ref, num_unmatched = 0, 0
+    for ref, det in zip(ref_detections, detections):
+      ious, score_deltas, unmatched = _match_detections(ref, det)
+      all_ious.extend(ious)
+      all_deltas.extend(score_deltas)
+      num_ref += len(ref[1])
+      num_unmatched += unmatched
+    print('  matched reference detections: {}/{} ({:.1f}%)'.format(
+        len(all_ious), num_ref, 100.0*len(all_ious)/max(num_ref, 1)))
+    if len(all_ious) > 0:
+      print('  matched box IOU: {:.4f} mean, {:.4f} min'.format(
+          np.mean(all_ious), np.min(all_ious)))
+      print('  score delta: {:.4f} mean, {:.4f} max'.format(
+          np.mean(all_deltas), np.max(all_deltas)))
+    print('  detections without reference: {}'.format(num_unmatched))
+
+def main(argv=None):
+  compare()
+
+if __name__ == '__main__':
+  tf.app.run()
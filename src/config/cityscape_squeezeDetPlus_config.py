@@ -5,6 +5,7 @@
 import numpy as np
 
 from .config import base_model_config
+from utils.anchors import anchor_grid, feature_map_size
 
 def cityscape_squeezeDetPlus_config(mask_parameterization, log_anchors, tune_only_last_layer, encoding_type):
   """Specify the parameters to tune below."""
@@ -49,48 +50,11 @@ def cityscape_squeezeDetPlus_config(mask_parameterization, log_anchors, tune_onl
   return mc
 
 def set_anchors(mc, log_anchors):
-  H, W, B = 31, 63, 9
+  H, W = feature_map_size('squeezeDet+', mc.IMAGE_HEIGHT, mc.IMAGE_WIDTH)
   if log_anchors:
     print("Using Log domain extracted anchors and ", mc.ENCODING_TYPE, "encoding type")
-    anchor_shapes = np.reshape(
-      [np.array(
-          [[8.01, 11.25], [11.45, 26.49], [18.02, 13.88],
-           [21.40, 50.10], [31.07, 24.21], [42.67, 103.73],
-           [55.73, 42.22], [107.92, 76.43], [171.29, 181.58]])] * H * W,
-      (H, W, B, 2)
-    )
+    shapes = 'cityscape_log'
   else:
     print("Using Linear domain extracted anchors and ", mc.ENCODING_TYPE, "encoding type")
-    anchor_shapes = np.reshape(
-        [np.array(
-            [[17.31, 18.20], [35.13, 39.49], [99.93, 66.42],
-             [34.60, 73.31], [56.66, 125.19], [166.94, 114.14],
-             [94.15, 203.37], [257.57, 187.70], [196.69, 312.63]])] * H * W,
-        (H, W, B, 2)
-    )
-  center_x = np.reshape(
-      np.transpose(
-          np.reshape(
-              np.array([np.arange(1, W+1)*16]*H*B), 
-              (B, H, W)
-          ),
-          (1, 2, 0)
-      ),
-      (H, W, B, 1)
-  )
-  center_y = np.reshape(
-      np.transpose(
-          np.reshape(
-              np.array([np.arange(1, H+1)*16]*W*B),
-              (B, W, H)
-          ),
-          (2, 1, 0)
-      ),
-      (H, W, B, 1)
-  )
-  anchors = np.reshape(
-      np.concatenate((center_x, center_y, anchor_shapes), axis=3),
-      (-1, 4)
-  )
-
-  return anchors
+    shapes = 'cityscape_linear'
+  return anchor_grid(H, W, shapes, stride=16, offset=16).boxes
@@ -73,6 +73,29 @@ def base_model_config(dataset='PASCAL_VOC'):
   # Bounding boxes with IOU larger than this are going to be removed
   cfg.NMS_THRESH = 0.2
 
+  # Decay the probabilities of overlapping boxes with soft-NMS instead of
+  # removing them
+  cfg.SOFT_NMS = False
+
+  # sigma of the gaussian probability decay of soft-NMS
+  cfg.SOFT_NMS_SIGMA = 0.5
+
+  # probability decay of soft-NMS, 'gaussian' or 'linear' (by 1-IOU for IOUs
+  # above NMS_THRESH)
+  cfg.SOFT_NMS_METHOD = 'gaussian'
+
+  # With EIGHT_POINT_REGRESSION, whether NMS compares the octagonal masks
+  # instead of their bounding boxes
+  cfg.OCTAGON_NMS = False
+
+  # Whether inference models filter the detections in the graph (top-N,
+  # probability threshold and per-class NMS)
+  cfg.IN_GRAPH_POST_PROCESSING = False
+
+  # Number of anchors of highest confidence that the in-graph post-processing
+  # decodes, 0 decodes all anchors
+  cfg.CONF_TOP_K = 0
+
   # Pixel mean values (BGR order) as a (1, 1, 3) array. Below is the BGR mean
   # of VGG16
   cfg.BGR_MEANS = np.array([[[103.939, 116.779, 123.68]]])
@@ -142,7 +165,22 @@ def base_model_config(dataset='PASCAL_VOC'):
   # capacity for FIFOQueue
   cfg.QUEUE_CAPACITY = 100
 
+  # number of threads that filter the predictions of the images of a batch
+  cfg.NUM_POST_PROCESSING_THREADS = 4
+
   # indicate if the model is in training mode
   cfg.IS_TRAINING = False
 
+  # number of [squeeze 1x1, expand 1x1, expand 3x3] filters of the fire
+  # modules that differ from the original architecture, e.g. after pruning
+  cfg.FIRE_MODULE_FILTERS = {}
+
+  # number of synchronous replicas in distributed training, 1 means training
+  # in a single process
+  cfg.NUM_REPLICAS = 1
+
+  # device of the local worker in distributed training. Per-replica state is
+  # pinned to it instead of the parameter server
+  cfg.WORKER_DEVICE = ''
+
   return cfg
@@ -5,6 +5,7 @@
 import numpy as np
 
 from .config import base_model_config
+from utils.anchors import anchor_grid
 
 def kitti_model_config():
   """Specify the parameters to tune below."""
@@ -43,37 +44,7 @@ def kitti_model_config():
   return mc
 
 def set_anchors(mc):
-  H, W, B = 24, 78, 9
-  anchor_shapes = np.reshape(
-      [np.array(
-          [[  36.,  37.], [ 366., 174.], [ 115.,  59.],
-           [ 162.,  87.], [  38.,  90.], [ 258., 173.],
-           [ 224., 108.], [  78., 170.], [  72.,  43.]])] * H * W,
-      (H, W, B, 2)
-  )
-  center_x = np.reshape(
-      np.transpose(
-          np.reshape(
-              np.array([np.arange(1, W+1)*float(mc.IMAGE_WIDTH)/(W+1)]*H*B), 
-              (B, H, W)
-          ),
-          (1, 2, 0)
-      ),
-      (H, W, B, 1)
-  )
-  center_y = np.reshape(
-      np.transpose(
-          np.reshape(
-              np.array([np.arange(1, H+1)*float(mc.IMAGE_HEIGHT)/(H+1)]*W*B),
-              (B, W, H)
-          ),
-          (2, 1, 0)
-      ),
-      (H, W, B, 1)
-  )
-  anchors = np.reshape(
-      np.concatenate((center_x, center_y, anchor_shapes), axis=3),
-      (-1, 4)
-  )
-
-  return anchors
+  H, W = 24, 78
+  # anchors evenly spread over the image
+  stride = (float(mc.IMAGE_WIDTH)/(W+1), float(mc.IMAGE_HEIGHT)/(H+1))
+  return anchor_grid(H, W, 'kitti', stride=stride, offset=stride).boxes
@@ -25,6 +25,7 @@ from config import *
 from train import _draw_box
 from nets import *
 from dataset.cityscape_utils.cityscapesscripts.helpers.labels import assureSingleInstanceName
+from utils.post_processing import decode_parameterization
 
 FLAGS = tf.app.flags.FLAGS
 
@@ -136,82 +137,6 @@ def _load_cityscape_annotations( _label_path, index, include_8_point_masks=False
             polygons.append([imgHeight, imgWidth, polygon])
   return bboxes, boundaryadhesions, polygons
 
-def decode_parameterization(mask_vector):
-  """Decodes the octagonal parameterization of the mask to get
-     the 8 points approximation of the polygon.
-  Args:
-    mask vector: [cx, cy, w, h, of1, of2, of3, of4]
-  Returns:
-    intersecting_pts: list of points where the octagonal mask 
-                      intersects the bounding box
-  """
-
-  def _get_intersecting_point(vert_hor, eq1, pt, m):
-    """Finds the point of intersection of a line1 with vertical or 
-       horizontal line.
-    Args:
-      vert_hor: "vert" or "hor" represents intersection is to be found 
-                with respect to which line.
-      eq1: equation of vertical or horizontal line.
-      pt : point on line1.
-      m  : slope of line1.
-    Returns:
-      point of intersection of line1 with vertical or horizontal.
-    """
-    pt_x, pt_y = pt
-    c = pt_y - (m*pt_x)
-    if vert_hor == "vert":
-        x_cor = eq1
-        y_cor = (m*x_cor) + c
-    else:
-        y_cor = eq1
-        x_cor = (y_cor - c)/m
-    return (x_cor, y_cor)
-
-  center_x, center_y, width, height, off1, off2, off3, off4 = mask_vector
-  cos = math.cos(math.radians(45))
-  sin = math.cos(math.radians(45))
-  pts = [0,0,0,0]
-  pts[0] = (center_x-off1*cos, center_y-off1*sin)
-  pts[1] = (center_x-off2*cos, center_y+off2*sin)
-  pts[2] = (center_x+off3*cos, center_y+off3*sin)
-  pts[3] = (center_x+off4*cos, center_y-off4*sin)
-  xmin = center_x - (0.5*width)
-  xmax = center_x + (0.5*width)
-  ymin = center_y - (0.5*height)
-  ymax = center_y + (0.5*height)
-  points = [pts[0], pts[1], pts[1], pts[2], pts[2], pts[3], pts[3], pts[0]]
-  eq1s = [xmin, xmin, ymax, ymax, xmax, xmax, ymin, ymin]
-  vert_or_hors = ["vert", "vert", "hor", "hor", "vert", "vert", "hor", "hor"]
-  EPSILON = 1e-8
-  dr1 = (pts[2][0]-pts[0][0])
-  if dr1 == 0:
-    dr1 = EPSILON
-  dr2 = (pts[3][0]-pts[1][0])
-  if dr2 == 0:
-    dr2 = EPSILON
-  m1 = (pts[2][1]-pts[0][1])/dr1
-  m2 = (pts[3][1]-pts[1][1])/dr2
-  assert m1 != 0 and m2 != 0, "Slopes are zero in _get_intersecting_point"
-  ms = [-1/m1, -1/m2, -1/m2, -1/m1, -1/m1, -1/m2, -1/m2, -1/m1]
-  intersecting_pts = []
-  for i, eq1, pt, vert_hor, m in zip(range(8), eq1s, points, vert_or_hors, ms):
-      op_pt = _get_intersecting_point(vert_hor, eq1, pt, m)
-      x_val, y_val = op_pt
-      if vert_hor == 'vert':
-        if i == 0 or i == 5:
-          y_val = min(y_val, center_y)
-        elif i == 1 or i == 4:
-          y_val = max(y_val, center_y)
-      else:
-        if i == 2 or i == 7:
-          x_val = min(x_val, center_x)
-        elif i == 3 or i == 6:
-          x_val = max(x_val, center_x)
-      op_pt = (min(max(xmin, x_val), xmax), min(max(ymin, y_val), ymax))
-      intersecting_pts.append(op_pt)
-  return intersecting_pts
-
 def image_demo(label_path, mask_parameterization_now, log_anchors_now, encoding_type_now, checkpoint_path, out_dir, fmt):
   assert FLAGS.demo_net == 'squeezeDet' or FLAGS.demo_net == 'squeezeDet+', \
       'Selected neural net architecture not supported: {}'.format(FLAGS.demo_net)
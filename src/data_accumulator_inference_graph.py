@@ -20,8 +20,8 @@ import json
 import math
 import numpy as np
 import tensorflow as tf
-from scipy import special as sp
 from config import *
+from utils.post_processing import Decoder, filter_prediction, decode_parameterization
 import copy
 from train import _viz_prediction_result, _draw_box
 from dataset.cityscape_utils.cityscapesscripts.helpers.labels import assureSingleInstanceName
@@ -41,6 +41,21 @@ tf.app.flags.DEFINE_string(
     'demo_net', 'squeezeDet', """Neural net architecture.""")
 tf.app.flags.DEFINE_string(
     'label_path', 'None', """Label path.""")
+tf.app.flags.DEFINE_boolean('soft_nms', False,
+                            """Decay the probabilities of overlapping detections with """
+                            """soft-NMS instead of removing them with NMS ?""")
+tf.app.flags.DEFINE_float('soft_nms_sigma', 0.5,
+                          """Width of the gaussian decay of soft-NMS.""")
+tf.app.flags.DEFINE_string('soft_nms_method', 'gaussian',
+                           """Decay of soft-NMS, 'gaussian' or 'linear'.""")
+tf.app.flags.DEFINE_boolean('soft_nms_per_class', True,
+                            """Only decay detections of the same class with soft-NMS ?""")
+tf.app.flags.DEFINE_boolean('conf_pruning', False,
+                            """Only decode anchors whose confidence is above the """
+                            """probability threshold ? Does not change the detections.""")
+tf.app.flags.DEFINE_integer('conf_top_k', 0,
+                            """Only decode this many anchors of highest confidence, 0 """
+                            """decodes all.""")
 
 def get_bounding_box_parameterization(polygon, height, width):
   """Extract the bounding box of a polygon representing the instance mask.
@@ -156,7 +171,12 @@ def run_inference_on_multiple_images(image_path_list, graph, label_path, mask_pa
           print(tensor_name)
           tensor_dict[key] = tf.get_default_graph().get_tensor_by_name(
               tensor_name)
-      image_tensor = tf.get_default_graph().get_tensor_by_name('image_input_1:0')
+      # graphs exported with the old SqueezeDet_inf name their input
+      # image_input_1
+      if 'image_input_1:0' in all_tensor_names:
+        image_tensor = tf.get_default_graph().get_tensor_by_name('image_input_1:0')
+      else:
+        image_tensor = tf.get_default_graph().get_tensor_by_name('image_input:0')
       # Run inference
       for image_path in image_path_list:
         print("Processing", image_path)
@@ -187,354 +207,6 @@ def run_inference_on_multiple_images(image_path_list, graph, label_path, mask_pa
         # break
   return output_dict_list, read_images, time_diff, gt_bounding_boxes, gt_classes, file_names, gt_polygons
 
-def set_anchors(H, W, log_anchors=False):
-  B = 9
-  if log_anchors:
-      print("Using Log domain extracted anchors")
-      anchor_shapes = np.reshape(
-        [np.array(
-            [[8.01, 11.25], [11.45, 26.49], [18.02, 13.88],
-             [21.40, 50.10], [31.07, 24.21], [42.67, 103.73],
-             [55.73, 42.22], [107.92, 76.43], [171.29, 181.58]])] * H * W,
-        (H, W, B, 2)
-      )
-  else:
-      print("Using Linear domain extracted anchors")
-      anchor_shapes = np.reshape(
-          [np.array(
-              [[17.31, 18.20], [35.13, 39.49], [99.93, 66.42],
-               [34.60, 73.31], [56.66, 125.19], [166.94, 114.14],
-               [94.15, 203.37], [257.57, 187.70], [196.69, 312.63]])] * H * W,
-          (H, W, B, 2)
-      )
-  center_x = np.reshape(
-    np.transpose(
-        np.reshape(
-            np.array([np.arange(1, W+1)*16]*H*B), 
-            (B, H, W)
-        ),
-        (1, 2, 0)
-    ),
-    (H, W, B, 1)
-  )
-  center_y = np.reshape(
-    np.transpose(
-        np.reshape(
-            np.array([np.arange(1, H+1)*16]*W*B),
-            (B, W, H)
-        ),
-        (2, 1, 0)
-    ),
-    (H, W, B, 1)
-  )
-  anchors = np.reshape(
-    np.concatenate((center_x, center_y, anchor_shapes), axis=3),
-    (-1, 4)
-  )
-
-  return anchors
-
-def safe_exp(w, thresh):
-  slope = np.exp(thresh)
-  lin_bool = w > thresh
-  lin_region = np.where(lin_bool, np.ones_like(w), np.zeros_like(w))
-  lin_out = slope*(w - thresh + 1.)
-  exp_out = np.exp(np.where(lin_bool, np.zeros_like(w), w))
-  out = lin_region*lin_out + (1.-lin_region)*exp_out
-  return out
-
-def sigmoid(input_volume):
-  return (1 / (1 + np.exp(-input_volume)))
-
-def iou(box1, box2):
-  """Compute the Intersection-Over-Union of two given boxes.
-
-  Args:
-    box1: array of 4 elements [cx, cy, width, height].
-    box2: same as above
-  Returns:
-    iou: a float number in range [0, 1]. iou of the two boxes.
-  """
-  lr = min(box1[0]+0.5*box1[2], box2[0]+0.5*box2[2]) - \
-      max(box1[0]-0.5*box1[2], box2[0]-0.5*box2[2])
-  if lr > 0:
-    tb = min(box1[1]+0.5*box1[3], box2[1]+0.5*box2[3]) - \
-        max(box1[1]-0.5*box1[3], box2[1]-0.5*box2[3])
-    if tb > 0:
-      intersection = tb*lr
-      union = box1[2]*box1[3]+box2[2]*box2[3]-intersection
-      return intersection/union
-  return 0
-
-def batch_iou(boxes, box):
-  """Compute the Intersection-Over-Union of a batch of boxes with another
-  box.
-
-  Args:
-    box1: 2D array of [cx, cy, width, height].
-    box2: a single array of [cx, cy, width, height]
-  Returns:
-    ious: array of a float number in range [0, 1].
-  """
-  lr = np.maximum(
-      np.minimum(boxes[:,0]+0.5*boxes[:,2], box[0]+0.5*box[2]) - \
-      np.maximum(boxes[:,0]-0.5*boxes[:,2], box[0]-0.5*box[2]),
-      0
-  )
-  tb = np.maximum(
-      np.minimum(boxes[:,1]+0.5*boxes[:,3], box[1]+0.5*box[3]) - \
-      np.maximum(boxes[:,1]-0.5*boxes[:,3], box[1]-0.5*box[3]),
-      0
-  )
-  inter = lr*tb
-  union = boxes[:,2]*boxes[:,3] + box[2]*box[3] - inter
-  return inter/union
-
-def nms(boxes, probs, threshold):
-  """Non-Maximum supression.
-  Args:
-    boxes: array of [cx, cy, w, h] (center format)
-    probs: array of probabilities
-    threshold: two boxes are considered overlapping if their IOU is largher than
-        this threshold
-    form: 'center' or 'diagonal'
-  Returns:
-    keep: array of True or False.
-  """
-  order = probs.argsort()[::-1] 
-  keep = [True]*len(order)
-  # count = 0
-  for i in range(len(order)-1):
-    ovps = batch_iou(boxes[order[i+1:]], boxes[order[i]])
-    for j, ov in enumerate(ovps):
-      # count +=1
-      if ov > threshold:
-        keep[order[j+i+1]] = False
-  return keep
-
-def soft_nms(boxes, probs):
-  """Soft Non-Maximum supression.
-  Args:
-    boxes: array of [cx, cy, w, h] (center format)
-    probs: array of probabilities
-    threshold: two boxes are considered overlapping if their IOU is largher than
-        this threshold
-    form: 'center' or 'diagonal'
-  Returns:
-    recalculated_probs: probabilities recalculated
-  """
-  order = probs.argsort()[::-1]
-  new_probs = copy.deepcopy(probs)
-  # count = 0
-  for i in range(len(order)-1):
-    ovps = batch_iou(boxes[order[i+1:]], boxes[order[i]])
-    new_probs[order[i+1:]] *= np.exp(-1*(ovps**2)/0.5)
-  # print(count)
-  return new_probs
-
-def filter_prediction(boxes, probs, cls_idx, PROB_THRESH, softnms=True):
-  filtered_idx = np.nonzero(probs> PROB_THRESH)[0]
-  probs = probs[filtered_idx]
-  boxes = boxes[filtered_idx]
-  cls_idx = cls_idx[filtered_idx]
-
-  final_boxes = []
-  final_probs = []
-  final_cls_idx = []
-  NUM_CLASSES = 7
-  if softnms:
-      final_boxes = boxes
-      final_probs = soft_nms(boxes, probs)
-      final_cls_idx = cls_idx
-  else:
-      for c in range(NUM_CLASSES):
-        idx_per_class = [i for i in range(len(probs)) if cls_idx[i] == c]
-        keep = nms(boxes[idx_per_class], probs[idx_per_class], 0.4)
-        for i in range(len(keep)):
-          if keep[i]:
-            final_boxes.append(boxes[idx_per_class[i]])
-            final_probs.append(probs[idx_per_class[i]])
-            final_cls_idx.append(c)
-  return final_boxes, final_probs, final_cls_idx
-
-    
-def interpret_output(output_volume, mask_parameterization=4, img_id='default', log_anchors=False, imgSize=(1024,512), encoding_type_now='normal'):
-  ANCHOR_PER_GRID = 9
-  NUM_CLASSES = 7
-  BATCH_SIZE, H, W, nc = np.shape(output_volume)
-  ANCHOR_BOX = set_anchors(H, W, log_anchors)
-  ANCHORS = len(ANCHOR_BOX)
-  num_class_probs = ANCHOR_PER_GRID*NUM_CLASSES
-  pred_class_probs = np.reshape(
-        sp.softmax(
-            np.reshape(
-                output_volume[:, :, :, :num_class_probs],
-                [-1, NUM_CLASSES]
-            ), axis=1 
-        ), [BATCH_SIZE, ANCHORS, NUM_CLASSES])
-  
-  num_confidence_scores = ANCHOR_PER_GRID+num_class_probs
-  pred_conf = sp.expit(
-    np.reshape(
-        output_volume[:, :, :, num_class_probs:num_confidence_scores],
-        [BATCH_SIZE, ANCHORS]
-    )
-  )
-  pred_box_delta = np.reshape(
-    output_volume[:, :, :, num_confidence_scores:],
-    [BATCH_SIZE, ANCHORS, mask_parameterization]
-  )
-  
-  anchor_x = ANCHOR_BOX[:, 0]
-  anchor_y = ANCHOR_BOX[:, 1]
-  anchor_w = ANCHOR_BOX[:, 2]
-  anchor_h = ANCHOR_BOX[:, 3]
-
-  delta_x, delta_y, delta_w, delta_h = np.squeeze(pred_box_delta[:,:,0]), np.squeeze(pred_box_delta[:,:,1]), np.squeeze(pred_box_delta[:,:,2]), np.squeeze(pred_box_delta[:,:,3])
-
-
-  if mask_parameterization == 8:
-    delta_of1, delta_of2, delta_of3, delta_of4 = np.squeeze(pred_box_delta[:,:,4]), np.squeeze(pred_box_delta[:,:,5]), np.squeeze(pred_box_delta[:,:,6]), np.squeeze(pred_box_delta[:,:,7])
-    EPSILON = 1e-8
-    anchor_diag = (anchor_w**2 + anchor_h**2)**(0.5)
-    box_of1 = (anchor_diag * safe_exp(delta_of1, 1.0))-EPSILON
-    box_of2 = (anchor_diag * safe_exp(delta_of2, 1.0))-EPSILON
-    box_of3 = (anchor_diag * safe_exp(delta_of3, 1.0))-EPSILON
-    box_of4 = (anchor_diag * safe_exp(delta_of4, 1.0))-EPSILON
-
-  if encoding_type_now == 'normal':
-    # Normal decoding
-    box_center_x = anchor_x + delta_x * anchor_w
-    box_center_y = anchor_y + delta_y * anchor_h
-    box_width = anchor_w * safe_exp(delta_w, 1.0)
-    box_height = anchor_h * safe_exp(delta_h, 1.0)
-    # box_width = anchor_w * np.exp(delta_w)
-    # box_height = anchor_h * np.exp(delta_h)
-    xmins= box_center_x-box_width/2
-    ymins = box_center_y-box_height/2
-    xmaxs = box_center_x+box_width/2
-    ymaxs = box_center_y+box_height/2
-
-  elif encoding_type_now == 'asymmetric_log':
-    # Asymmetric Log
-    EPSILON = 0.5
-    delta_xmin, delta_ymin, delta_xmax, delta_ymax = delta_x, delta_y, delta_w, delta_h
-    xmins = anchor_x - (anchor_w * (np.exp(delta_xmin)-EPSILON))
-    ymins = anchor_y - (anchor_h * (np.exp(delta_ymin)-EPSILON))
-    xmaxs = anchor_x + (anchor_w * (np.exp(delta_xmax)-EPSILON))
-    ymaxs = anchor_y + (anchor_h * (np.exp(delta_ymax)-EPSILON))
-  elif encoding_type_now == 'asymmetric_linear':
-    # Asymmetric Lìnear
-    delta_xmin, delta_ymin, delta_xmax, delta_ymax = delta_x, delta_y, delta_w, delta_h
-    xmins_a = anchor_x-anchor_w/2
-    ymins_a = anchor_y-anchor_h/2
-    xmaxs_a = anchor_x+anchor_w/2
-    ymaxs_a = anchor_y+anchor_h/2
-    xmins = xmins_a + delta_xmin * anchor_w
-    ymins = ymins_a + delta_ymin * anchor_h
-    xmaxs = xmaxs_a + delta_xmax * anchor_w
-    ymaxs = ymaxs_a + delta_ymax * anchor_h
-
-  # Trimming
-  xmins = np.minimum(np.maximum([0.0]*len(xmins), xmins), [imgSize[0]-1.0]*len(xmins))
-  ymins = np.minimum(np.maximum([0.0]*len(ymins), ymins), [imgSize[1]-1.0]*len(ymins))
-  xmaxs = np.maximum(np.minimum([imgSize[0]-1.0]*len(xmaxs), xmaxs), [0.0]*len(xmaxs))
-  ymaxs = np.maximum(np.minimum([imgSize[1]-1.0]*len(ymaxs), ymaxs), [0.0]*len(ymaxs))
-  width       = xmaxs - xmins
-  height      = ymaxs - ymins
-  box_center_x  = xmins + 0.5*width 
-  box_center_y  = ymins + 0.5*height
-  box_width  = width
-  box_height  = height
-
-  probs = np.multiply(
-      pred_class_probs,
-      np.reshape(pred_conf, [BATCH_SIZE, ANCHORS, 1])
-  )
-  det_probs = np.amax(probs, 2)
-  det_class = np.argmax(probs, 2)
-  if mask_parameterization == 8:
-    det_boxes = np.transpose(np.stack([box_center_x, box_center_y, box_width, box_height, box_of1, box_of2, box_of3, box_of4]))
-  else:
-    det_boxes = np.transpose(np.stack([box_center_x, box_center_y, box_width, box_height]))
-  return det_boxes, np.squeeze(det_probs), np.squeeze(det_class)
-
-def decode_parameterization(mask_vector):
-  """Decodes the octagonal parameterization of the mask to get
-     the 8 points approximation of the polygon.
-  Args:
-    mask vector: [cx, cy, w, h, of1, of2, of3, of4]
-  Returns:
-    intersecting_pts: list of points where the octagonal mask 
-                      intersects the bounding box
-  """
-
-  def _get_intersecting_point(vert_hor, eq1, pt, m):
-    """Finds the point of intersection of a line1 with vertical or 
-       horizontal line.
-    Args:
-      vert_hor: "vert" or "hor" represents intersection is to be found 
-                with respect to which line.
-      eq1: equation of vertical or horizontal line.
-      pt : point on line1.
-      m  : slope of line1.
-    Returns:
-      point of intersection of line1 with vertical or horizontal.
-    """
-    pt_x, pt_y = pt
-    c = pt_y - (m*pt_x)
-    if vert_hor == "vert":
-        x_cor = eq1
-        y_cor = (m*x_cor) + c
-    else:
-        y_cor = eq1
-        x_cor = (y_cor - c)/m
-    return (x_cor, y_cor)
-
-  center_x, center_y, width, height, off1, off2, off3, off4 = mask_vector
-  cos = math.cos(math.radians(45))
-  sin = math.cos(math.radians(45))
-  pts = [0,0,0,0]
-  pts[0] = (center_x-off1*cos, center_y-off1*sin)
-  pts[1] = (center_x-off2*cos, center_y+off2*sin)
-  pts[2] = (center_x+off3*cos, center_y+off3*sin)
-  pts[3] = (center_x+off4*cos, center_y-off4*sin)
-  xmin = center_x - (0.5*width)
-  xmax = center_x + (0.5*width)
-  ymin = center_y - (0.5*height)
-  ymax = center_y + (0.5*height)
-  points = [pts[0], pts[1], pts[1], pts[2], pts[2], pts[3], pts[3], pts[0]]
-  eq1s = [xmin, xmin, ymax, ymax, xmax, xmax, ymin, ymin]
-  vert_or_hors = ["vert", "vert", "hor", "hor", "vert", "vert", "hor", "hor"]
-  EPSILON = 1e-8
-  dr1 = (pts[2][0]-pts[0][0])
-  if dr1 == 0:
-    dr1 = EPSILON
-  dr2 = (pts[3][0]-pts[1][0])
-  if dr2 == 0:
-    dr2 = EPSILON
-  m1 = (pts[2][1]-pts[0][1])/dr1
-  m2 = (pts[3][1]-pts[1][1])/dr2
-  assert m1 != 0 and m2 != 0, "Slopes are zero in _get_intersecting_point"
-  ms = [-1/m1, -1/m2, -1/m2, -1/m1, -1/m1, -1/m2, -1/m2, -1/m1]
-  intersecting_pts = []
-  for i, eq1, pt, vert_hor, m in zip(range(8), eq1s, points, vert_or_hors, ms):
-      op_pt = _get_intersecting_point(vert_hor, eq1, pt, m)
-      x_val, y_val = op_pt
-      if vert_hor == 'vert':
-        if i == 0 or i == 5:
-          y_val = min(y_val, center_y)
-        elif i == 1 or i == 4:
-          y_val = max(y_val, center_y)
-      else:
-        if i == 2 or i == 7:
-          x_val = min(x_val, center_x)
-        elif i == 3 or i == 6:
-          x_val = max(x_val, center_x)
-      op_pt = (min(max(xmin, x_val), xmax), min(max(ymin, y_val), ymax))
-      intersecting_pts.append(op_pt)
-  return intersecting_pts
-
 def image_demo_inference_graph(label_path, mask_parameterization_now, log_anchors_now, encoding_type_now, \
   checkpoint_path, out_dir, fmt, softnms=False):
   assert FLAGS.demo_net == 'squeezeDet', 'Selected neural net architecture not supported: {}'.format(FLAGS.demo_net)
@@ -561,18 +233,25 @@ def image_demo_inference_graph(label_path, mask_parameterization_now, log_anchor
   y_scale = IMAGE_HEIGHT/1024
   PLOT_PROB_THRESH = 0.4
   PROB_THRESH = 0.005
+  decoder = Decoder('cityscape_log' if log_anchors_now else 'cityscape_linear', len(CLASS_NAMES),
+                    mask_parameterization_now, encoding_type_now, (IMAGE_WIDTH, IMAGE_HEIGHT))
   counter = 0
   for i, output_dict, image_np, run_time, gt_labels, gt_bbox in zip(filenames, outputs, img_read, time_values, gt_classes, gt_bounding_boxes):
     total_time = 0
     total_time += run_time*1000
     interpret_start = time.time()
-    boxes, probs, classes = interpret_output(output_dict['conv12/bias_add'], mask_parameterization_now, i.split('\\')[-1][:-4], log_anchors_now, [IMAGE_WIDTH, IMAGE_HEIGHT], encoding_type_now)
+    boxes, probs, classes = decoder(output_dict['conv12/bias_add'], FLAGS.conf_top_k,
+                                    PROB_THRESH if FLAGS.conf_pruning else 0.0)
     interpret_stop = time.time()
     int_time = (interpret_stop-interpret_start)*1000
     int_times.append(int_time)
     total_time += int_time
     NMS_start = time.time()
-    det_bbox, det_prob, det_class = filter_prediction(boxes, probs, classes, PROB_THRESH, softnms)
+    det_bbox, det_prob, det_class = filter_prediction(boxes[0], probs[0], classes[0], PROB_THRESH,
+                                                      nms_thresh=0.4, softnms=softnms,
+                                                      sigma=FLAGS.soft_nms_sigma,
+                                                      method=FLAGS.soft_nms_method,
+                                                      per_class=FLAGS.soft_nms_per_class)
     NMS_stop = time.time()
     nms_time = (NMS_stop-NMS_start)*1000
     nms_times.append(nms_time)
@@ -751,7 +430,7 @@ def main(argv=None):
         tf.gfile.MakeDirs(os.path.join(log_dir, "detections"))
       if not tf.gfile.Exists(os.path.join(log_dir, "groundtruths")):
         tf.gfile.MakeDirs(os.path.join(log_dir, "groundtruths"))
-      image_demo_inference_graph(FLAGS.label_path, mask_param, use_log_anchors, encoding_scheme, c, log_dir, frmt, softnms=False)
+      image_demo_inference_graph(FLAGS.label_path, mask_param, use_log_anchors, encoding_scheme, c, log_dir, frmt, softnms=FLAGS.soft_nms)
       # break
 
 if __name__ == '__main__':
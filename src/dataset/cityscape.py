@@ -12,6 +12,7 @@ import imageio as sp
 from PIL import Image
 from dataset.input_reader import input_reader
 from utils.util import bbox_transform_inv, batch_iou
+from utils.polygon import octagons, pad_polygons, pairwise_polygon_iou
 from collections import namedtuple
 from dataset.cityscape_utils.cityscapesscripts.helpers.labels import labels as csLabels
 from dataset.cityscape_utils.cityscapesscripts.helpers.labels import assureSingleInstanceName
@@ -194,7 +195,10 @@ class cityscape(input_reader):
       eval_dir: directory to write evaluation logs
       global_step: step of the checkpoint
       all_boxes: all_boxes[cls][image] = N x 5 arrays of 
-        [xmin, ymin, xmax, ymax, score]
+        [xmin, ymin, xmax, ymax, score], or N x 9 arrays of
+        [xmin, ymin, xmax, ymax, score, of1, of2, of3, of4] for octagonal
+        masks, whose offsets are written to an octagons directory next to
+        the detection files
     Returns:
       aps: array of average precisions.
       names: class names corresponding to each ap
@@ -204,9 +208,13 @@ class cityscape(input_reader):
         eval_dir, 'detection_files_{:s}'.format(global_step), 'data')
     if not os.path.isdir(det_file_dir):
       os.makedirs(det_file_dir)
+    octagon_dir = os.path.join(os.path.dirname(det_file_dir), 'octagons')
+    if not os.path.isdir(octagon_dir):
+      os.makedirs(octagon_dir)
 
     for im_idx, index in enumerate(self._image_idx):
       filename = os.path.join(det_file_dir, index+'.txt')
+      mask_offsets = []
       with open(filename, 'wt') as f:
         for cls_idx, cls in enumerate(self._classes):
           dets = all_boxes[cls_idx][im_idx]
@@ -217,6 +225,13 @@ class cityscape(input_reader):
                     cls.lower(), dets[k][0], dets[k][1], dets[k][2], dets[k][3],
                     dets[k][4])
             )
+            if len(dets[k]) > 5:
+              mask_offsets.append(dets[k][5:9])
+      # one line of offsets per line of the detection file
+      if mask_offsets:
+        with open(os.path.join(octagon_dir, index+'.txt'), 'wt') as f:
+          for offsets in mask_offsets:
+            f.write('{:.2f} {:.2f} {:.2f} {:.2f}\n'.format(*offsets))
 
     cmd = self._eval_tool + ' ' \
           + os.path.join(self._data_root_path, 'training') + ' ' \
@@ -260,7 +275,10 @@ class cityscape(input_reader):
       os.makedirs(det_error_dir)
     det_error_file = os.path.join(det_error_dir, 'det_error_file.txt')
 
-    stats = self.analyze_detections(det_file_dir, det_error_file)
+    stats = self.analyze_detections(
+        det_file_dir, det_error_file,
+        octagon_file_dir=os.path.join(
+            eval_dir, 'detection_files_{:s}'.format(global_step), 'octagons'))
     ims = self.visualize_detections(
         image_dir=self._image_path,
         image_format='.png',
@@ -271,7 +289,12 @@ class cityscape(input_reader):
 
     return stats, ims
 
-  def analyze_detections(self, detection_file_dir, det_error_file):
+  def analyze_detections(self, detection_file_dir, det_error_file,
+                         octagon_file_dir=None):
+    """Error analysis of the detections. Detections whose octagonal masks are
+    in octagon_file_dir are matched to the ground truth polygons by the IOU of
+    the polygons, with EIGHT_POINT_REGRESSION, and all others by the IOU of the
+    bounding boxes."""
     def _save_detection(f, idx, error_type, det, score):
       f.write(
           '{:s} {:s} {:.1f} {:.1f} {:.1f} {:.1f} {:s} {:.3f}\n'.format(
@@ -290,8 +313,16 @@ class cityscape(input_reader):
       with open(det_file_name) as f:
         lines = f.readlines()
       f.close()
+      offsets = [None]*len(lines)
+      if self._poly is not None and octagon_file_dir is not None:
+        octagon_file_name = os.path.join(octagon_file_dir, idx+'.txt')
+        if os.path.exists(octagon_file_name):
+          with open(octagon_file_name) as f:
+            offsets = [[float(o) for o in l.split()] for l in f.readlines()]
+          assert len(offsets) == len(lines), \
+              'Octagons of {} do not match its detections'.format(idx)
       bboxes = []
-      for line in lines:
+      for line, offset in zip(lines, offsets):
         obj = line.strip().split(' ')
         cls = self._class_to_idx[obj[0].lower().strip()]
         xmin = float(obj[4])
@@ -301,8 +332,11 @@ class cityscape(input_reader):
         score = float(obj[-1])
 
         x, y, w, h = bbox_transform_inv([xmin, ymin, xmax, ymax])
-        bboxes.append([x, y, w, h, cls, score])
-      bboxes.sort(key=lambda x: x[-1], reverse=True)
+        if offset is None:
+          bboxes.append([x, y, w, h, cls, score])
+        else:
+          bboxes.append([x, y, w, h, cls, score] + offset)
+      bboxes.sort(key=lambda x: x[5], reverse=True)
       self._det_rois[idx] = bboxes
 
     # do error analysis
@@ -325,10 +359,19 @@ class cityscape(input_reader):
         if len(gt_bboxes) < 1:
           continue
 
+        # IOUs of the ground truth polygons with all octagonal masks at once
+        masks = [det[:4]+det[6:] for det in det_bboxes if len(det) > 6]
+        if masks:
+          gt_polygons = pad_polygons([p[2] for p in self._poly[idx]])
+          mask_ious = pairwise_polygon_iou(gt_polygons, octagons(masks))
+
         for i, det in enumerate(det_bboxes):
           if i < len(gt_bboxes):
             num_dets += 1
-          ious = batch_iou(gt_bboxes[:, :4], det[:4])
+          if len(det) > 6:
+            ious = mask_ious[:, i]
+          else:
+            ious = batch_iou(gt_bboxes[:, :4], det[:4])
           max_iou = np.max(ious)
           gt_idx = np.argmax(ious)
           if max_iou > 0.1:
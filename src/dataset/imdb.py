@@ -61,6 +61,29 @@ class imdb(object):
         np.random.permutation(np.arange(len(self._image_idx)))]
     self._cur_idx = 0
 
+  def box_sizes(self):
+    """Width and height of every ground truth box of the image set, in pixels
+    of the original images.
+    Returns:
+      [N, 2] array of [width, height].
+    """
+    sizes = [[b[2], b[3]] for idx in self._image_idx for b in self._rois[idx]]
+    return np.array(sizes, dtype=np.float64).reshape(-1, 2)
+
+  def shard(self, num_shards, index):
+    """Keep only one of num_shards disjoint subsets of the images. Used in
+    distributed training so that every worker reads different images.
+    Args:
+      num_shards: total number of shards.
+      index: index of the shard to keep, in range [0, num_shards).
+    """
+    assert 0 <= index < num_shards, \
+        'Shard {} is out of range for {} shards'.format(index, num_shards)
+    self._image_idx = self._image_idx[index::num_shards]
+    assert len(self._image_idx) > self.mc.BATCH_SIZE, \
+        'Shard {} has too few images for a batch'.format(index)
+    self._shuffle_image_idx()
+
   def read_image_batch(self, shuffle=True):
     """Only Read a batch of images
     Args:
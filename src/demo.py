@@ -22,6 +22,7 @@ import tensorflow as tf
 
 from config import *
 from train import _draw_box
+from utils.detection_records import DetectionRecordWriter
 from nets import *
 
 FLAGS = tf.app.flags.FLAGS
@@ -39,6 +40,13 @@ tf.app.flags.DEFINE_string(
     'out_dir', './data/out/', """Directory to dump output image or video.""")
 tf.app.flags.DEFINE_string(
     'demo_net', 'squeezeDet', """Neural net architecture.""")
+tf.app.flags.DEFINE_string(
+    'detections_file', '',
+    """Write the detections to this record file instead of drawing them, """
+    """JSONL if it ends in .jsonl and binary otherwise.""")
+
+# [top, bottom, left, right] crop of the video frames
+VIDEO_CROP = [500, -205, 239, -439]
 
 
 def video_demo():
@@ -77,6 +85,11 @@ def video_demo():
     with tf.Session(config=tf.ConfigProto(allow_soft_placement=True)) as sess:
       saver.restore(sess, FLAGS.checkpoint)
 
+      sink = None
+      if FLAGS.detections_file:
+        sink = DetectionRecordWriter(FLAGS.detections_file, mc.CLASS_NAMES,
+                                     crop=VIDEO_CROP)
+
       times = {}
       count = 0
       while cap.isOpened():
@@ -88,7 +101,8 @@ def video_demo():
         ret, frame = cap.read()
         if ret==True:
           # crop frames
-          frame = frame[500:-205, 239:-439, :]
+          top, bottom, left, right = VIDEO_CROP
+          frame = frame[top:bottom, left:right, :]
           im_input = frame.astype(np.float32) - mc.BGR_MEANS
         else:
           break
@@ -105,8 +119,8 @@ def video_demo():
         times['detect']= t_detect - t_reshape
         
         # Filter
-        final_boxes, final_probs, final_class = model.filter_prediction(
-            det_boxes[0], det_probs[0], det_class[0])
+        final_boxes, final_probs, final_class = model.filter_batch_prediction(
+            det_boxes, det_probs, det_class)[0]
 
         keep_idx    = [idx for idx in range(len(final_probs)) \
                           if final_probs[idx] > mc.PLOT_PROB_THRESH]
@@ -117,6 +131,14 @@ def video_demo():
         t_filter = time.time()
         times['filter']= t_filter - t_detect
 
+        if sink is not None:
+          sink.write(count-1, os.path.basename(out_im_name), final_boxes,
+                     final_probs, final_class)
+          print('Total time: {:.4f}, detection time: {:.4f}, filter time: '
+                '{:.4f}'.format(time.time() - t_start, times['detect'],
+                                times['filter']))
+          continue
+
         # Draw boxes
 
         # TODO(bichen): move this color dict to configuration file
@@ -152,10 +174,14 @@ def video_demo():
 
         if cv2.waitKey(1) & 0xFF == ord('q'):
             break
+      if sink is not None:
+        sink.close()
+  model.close()
   # Release everything if job is finished
   cap.release()
   # out.release()
-  cv2.destroyAllWindows()
+  if not FLAGS.detections_file:
+    cv2.destroyAllWindows()
 
 
 def image_demo():
@@ -183,7 +209,12 @@ def image_demo():
     with tf.Session(config=tf.ConfigProto(allow_soft_placement=True)) as sess:
       saver.restore(sess, FLAGS.checkpoint)
 
-      for f in glob.iglob(FLAGS.input_path):
+      sink = None
+      if FLAGS.detections_file:
+        sink = DetectionRecordWriter(FLAGS.detections_file, mc.CLASS_NAMES,
+                                     image_size=(mc.IMAGE_WIDTH, mc.IMAGE_HEIGHT))
+
+      for frame_id, f in enumerate(sorted(glob.glob(FLAGS.input_path))):
         im = cv2.imread(f)
         im = im.astype(np.float32, copy=False)
         im = cv2.resize(im, (mc.IMAGE_WIDTH, mc.IMAGE_HEIGHT))
@@ -195,8 +226,8 @@ def image_demo():
             feed_dict={model.image_input:[input_image]})
 
         # Filter
-        final_boxes, final_probs, final_class = model.filter_prediction(
-            det_boxes[0], det_probs[0], det_class[0])
+        final_boxes, final_probs, final_class = model.filter_batch_prediction(
+            det_boxes, det_probs, det_class)[0]
 
         keep_idx    = [idx for idx in range(len(final_probs)) \
                           if final_probs[idx] > mc.PLOT_PROB_THRESH]
@@ -204,6 +235,12 @@ def image_demo():
         final_probs = [final_probs[idx] for idx in keep_idx]
         final_class = [final_class[idx] for idx in keep_idx]
 
+        file_name = os.path.split(f)[1]
+        if sink is not None:
+          sink.write(frame_id, 'out_'+file_name, final_boxes, final_probs,
+                     final_class)
+          continue
+
         # TODO(bichen): move this color dict to configuration file
         cls2clr = {
             'car': (255, 191, 0),
@@ -219,11 +256,16 @@ def image_demo():
             cdict=cls2clr,
         )
 
-        file_name = os.path.split(f)[1]
         out_file_name = os.path.join(FLAGS.out_dir, 'out_'+file_name)
         cv2.imwrite(out_file_name, im)
         print ('Image detection output saved to {}'.format(out_file_name))
 
+      if sink is not None:
+        sink.close()
+        print ('Detections of {} images written to {}'.format(
+            sink.num_frames, FLAGS.detections_file))
+    model.close()
+
 
 def main(argv=None):
   if not tf.gfile.Exists(FLAGS.out_dir):
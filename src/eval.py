@@ -78,17 +78,17 @@ def eval_once(
       _t['im_detect'].toc()
 
       _t['misc'].tic()
-      for j in range(len(det_boxes)): # batch
-        # rescale
-        det_boxes[j, :, 0::2] /= scales[j][0]
-        det_boxes[j, :, 1::2] /= scales[j][1]
-
-        det_bbox, score, det_class = model.filter_prediction(
-            det_boxes[j], det_probs[j], det_class[j])
+      # rescale
+      scales = np.asarray(scales, dtype=det_boxes.dtype)
+      det_boxes[:, :, 0::2] /= scales[:, 0, None, None]
+      det_boxes[:, :, 1::2] /= scales[:, 1, None, None]
 
+      for det_bbox, score, det_class in model.filter_batch_prediction(
+          det_boxes, det_probs, det_class):
         num_detection += len(det_bbox)
         for c, b, s in zip(det_class, det_bbox, score):
-          all_boxes[c][i].append(bbox_transform(b) + [s])
+          # offsets of octagonal masks follow the score
+          all_boxes[c][i].append(bbox_transform(b[:4]) + [s] + list(b[4:]))
       _t['misc'].toc()
 
       print ('im_detect: {:d}/{:d} im_read: {:.3f}s '
@@ -214,6 +214,7 @@ def evaluate():
         eval_once(
             saver, FLAGS.checkpoint_path, summary_writer, eval_summary_ops,
             eval_summary_phs, imdb, model)
+        model.close()
         return
       else:
         # When run_once is false, checkpoint_path should point to the directory
@@ -2,11 +2,15 @@
 
 """Code to export the checkpoint to frozen inference graph"""
 
+import numpy as np
 import tensorflow as tf
 from tensorflow.python.tools import freeze_graph
+from tensorflow.python.framework import tensor_util
+import json
 import os
 from nets import *
 from config import *
+from utils.util import write_graph_nodes
 from tensorflow.python.tools.inspect_checkpoint import print_tensors_in_checkpoint_file
 from tensorflow.tools.graph_transforms import TransformGraph
 
@@ -25,22 +29,83 @@ tf.app.flags.DEFINE_integer('mask_parameterization_now', 4,
 							"""Bounding box is 4, octagonal mask is 8. other values not supported""")
 tf.app.flags.DEFINE_string('dataset_now', 'KITTI',
                            """Currently only support KITTI and CITYSCAPE datasets.""")
+tf.app.flags.DEFINE_boolean('post_processing', False,
+							"""Export the top-N, threshold and NMS filtering in the graph ?""")
+tf.app.flags.DEFINE_boolean('soft_nms', False,
+							"""Use soft-NMS in the exported post-processing ?""")
+tf.app.flags.DEFINE_string('soft_nms_method', 'gaussian',
+							"""Probability decay of soft-NMS, gaussian or linear.""")
+tf.app.flags.DEFINE_integer('conf_top_k', 0,
+							"""Only decode the anchors of highest confidence in the exported """
+							"""post-processing, 0 decodes all anchors.""")
+tf.app.flags.DEFINE_string('architecture_config', '',
+							"""Json file with the fire module filters of a pruned model.""")
+tf.app.flags.DEFINE_string('quantize', 'none',
+							"""Quantization of the frozen graph: none, weights (8 bit weights), """
+							"""eight_bit (8 bit weights and ops) or float16 (16 bit weights).""")
+
+def _float16_weights(graph_def, min_size=1024):
+	"""Store the float32 constants with at least min_size elements as float16.
+	Each of them is replaced by a float16 constant followed by a cast back to
+	float32 that keeps the original name, so that the consumers are unchanged.
+	"""
+	out_graph_def = tf.GraphDef()
+	out_graph_def.versions.CopyFrom(graph_def.versions)
+	out_graph_def.library.CopyFrom(graph_def.library)
+	for node in graph_def.node:
+		if node.op == 'Const' and node.attr['dtype'].type == tf.float32.as_datatype_enum:
+			value = tensor_util.MakeNdarray(node.attr['value'].tensor)
+			if value.size >= min_size:
+				half_node = out_graph_def.node.add()
+				half_node.op = 'Const'
+				half_node.name = node.name + '/float16'
+				half_node.device = node.device
+				half_node.attr['dtype'].type = tf.float16.as_datatype_enum
+				half_node.attr['value'].tensor.CopyFrom(
+					tensor_util.make_tensor_proto(value.astype(np.float16)))
+				cast_node = out_graph_def.node.add()
+				cast_node.op = 'Cast'
+				cast_node.name = node.name
+				cast_node.device = node.device
+				cast_node.input.append(half_node.name)
+				cast_node.attr['SrcT'].type = tf.float16.as_datatype_enum
+				cast_node.attr['DstT'].type = tf.float32.as_datatype_enum
+				continue
+		out_graph_def.node.extend([node])
+	return out_graph_def
 
 # meta_path = FLAGS.train_dir+'/model.ckpt-87000'
-output_node_names = ['conv12/bias_add']
 input_node_names = ['image_input']
 
+# config and inference model of every net, for KITTI and CITYSCAPE
+nets = {
+	'squeezeDet': (kitti_squeezeDet_config, cityscape_squeezeDet_config, SqueezeDet_inf),
+	'squeezeDet+': (kitti_squeezeDetPlus_config, cityscape_squeezeDetPlus_config, SqueezeDetPlus_inf),
+	'resnet50': (kitti_res50_config, cityscape_res50_config, ResNet50ConvDet_inf),
+	'vgg16': (kitti_vgg16_config, cityscape_vgg16_config, VGG16ConvDet_inf)}
+assert FLAGS.net in nets, "Model not supported!"
+
 with tf.Graph().as_default():
+	kitti_config, cityscape_config, net_class = nets[FLAGS.net]
 	if FLAGS.dataset_now == 'CITYSCAPE':
-		mc = cityscape_squeezeDet_config(FLAGS.mask_parameterization_now, FLAGS.log_anchors_now, False, FLAGS.encoding_type_now)
+		mc = cityscape_config(FLAGS.mask_parameterization_now, FLAGS.log_anchors_now, False, FLAGS.encoding_type_now)
 	else:
-		mc = kitti_squeezeDet_config(FLAGS.mask_parameterization_now, False, FLAGS.encoding_type_now)
+		mc = kitti_config(FLAGS.mask_parameterization_now, False, FLAGS.encoding_type_now)
 	mc.LOAD_PRETRAINED_MODEL = False
 	mc.IS_TRAINING = False
-	if FLAGS.net == 'squeezeDet':
-		model = SqueezeDet_inf(mc)
-	else:
-		assert False, "Model not supported!"
+	mc.IN_GRAPH_POST_PROCESSING = FLAGS.post_processing
+	mc.SOFT_NMS = FLAGS.soft_nms
+	mc.SOFT_NMS_METHOD = FLAGS.soft_nms_method
+	mc.CONF_TOP_K = FLAGS.conf_top_k
+	if FLAGS.architecture_config:
+		with open(FLAGS.architecture_config) as f:
+			mc.FIRE_MODULE_FILTERS = json.load(f)
+	model = net_class(mc)
+	# conv12/bias_add for squeezeDet and squeezeDet+
+	output_node_names = [model.preds.op.name]
+	if FLAGS.post_processing:
+		output_node_names = ['post_processing/boxes', 'post_processing/probs',
+							'post_processing/class_idx', 'post_processing/num_detections']
 	sess = tf.Session(config=tf.ConfigProto(allow_soft_placement=True))
 
 	saver = tf.train.Saver(tf.global_variables())
@@ -63,7 +128,26 @@ with tf.Graph().as_default():
 		sess,
 		transformed_graph_def,
 		output_node_names)
+	# quantization works on the constants, so it runs on the frozen graph
+	assert FLAGS.quantize in ['none', 'weights', 'eight_bit', 'float16'], \
+		'Quantization not supported: {}'.format(FLAGS.quantize)
+	if FLAGS.quantize == 'weights':
+		frozen_graph_def = TransformGraph(frozen_graph_def, input_node_names, output_node_names,
+						['quantize_weights', 'strip_unused_nodes', 'sort_by_execution_order'])
+	elif FLAGS.quantize == 'eight_bit':
+		frozen_graph_def = TransformGraph(frozen_graph_def, input_node_names, output_node_names,
+						['fold_constants(ignore_errors=true)', 'quantize_weights', 'quantize_nodes',
+						'strip_unused_nodes', 'sort_by_execution_order'])
+	elif FLAGS.quantize == 'float16':
+		frozen_graph_def = _float16_weights(frozen_graph_def)
+	if FLAGS.quantize == 'none':
+		graph_file_name = 'frozen_inference_graph.pb'
+	else:
+		graph_file_name = 'frozen_inference_graph_{}.pb'.format(FLAGS.quantize)
 	if not tf.gfile.Exists(FLAGS.out_dir):
 		tf.gfile.MakeDirs(FLAGS.out_dir)
-	with open(os.path.join(FLAGS.out_dir, 'frozen_inference_graph.pb'), 'wb') as f:
+	with open(os.path.join(FLAGS.out_dir, graph_file_name), 'wb') as f:
 		f.write(frozen_graph_def.SerializeToString())
+	# the inference scripts read the output nodes, which depend on the net
+	write_graph_nodes(os.path.join(FLAGS.out_dir, graph_file_name),
+					input_node_names, output_node_names)
@@ -20,9 +20,13 @@ import json
 import math
 import numpy as np
 import tensorflow as tf
-from scipy import special as sp
 from config import *
+from utils.post_processing import Decoder, filter_prediction
+from utils.pipeline import Pipeline
+from utils.detection_records import DetectionRecordWriter
+from utils.util import read_graph_nodes
 import copy
+from multiprocessing.pool import ThreadPool
 from train import _viz_prediction_result, _draw_box
 from dataset.cityscape_utils.cityscapesscripts.helpers.labels import assureSingleInstanceName
 
@@ -38,7 +42,21 @@ tf.app.flags.DEFINE_string(
 tf.app.flags.DEFINE_string(
     'out_dir', './data/out/', """Directory to dump output image or video.""")
 tf.app.flags.DEFINE_string(
-    'demo_net', 'squeezeDet', """Neural net architecture.""")
+    'demo_net', 'squeezeDet', """Neural net architecture of the graph, any net exported by """
+    """export_inference_graph.py.""")
+tf.app.flags.DEFINE_string('output_node_inf', '',
+                           """Comma-separated output nodes of the frozen graph. By default """
+                           """they are read from the .nodes.json file written next to the """
+                           """graph at export, conv12/bias_add for graphs without one.""")
+tf.app.flags.DEFINE_boolean('soft_nms_inf', False,
+                            """Decay the probabilities of overlapping detections with """
+                            """soft-NMS instead of removing them with NMS ?""")
+tf.app.flags.DEFINE_float('soft_nms_sigma_inf', 0.5,
+                          """Width of the gaussian decay of soft-NMS.""")
+tf.app.flags.DEFINE_string('soft_nms_method_inf', 'gaussian',
+                           """Decay of soft-NMS, 'gaussian' or 'linear'.""")
+tf.app.flags.DEFINE_boolean('soft_nms_per_class_inf', True,
+                            """Only decay detections of the same class with soft-NMS ?""")
 tf.app.flags.DEFINE_integer('mask_parameterization_inf', 4,
                             """Bounding box is 4, octagonal mask is 8. other values not supported""")
 tf.app.flags.DEFINE_boolean('log_anchors_inf', False, """Use Log domain extracted anchors ?""")
@@ -47,441 +65,260 @@ tf.app.flags.DEFINE_string('encoding_type_inf', 'normal',
 tf.app.flags.DEFINE_boolean('write_to_disk', False, """Write the segmentations to disk ?""")
 tf.app.flags.DEFINE_string('dataset_inf', 'KITTI',
                            """Currently only support KITTI and CITYSCAPE datasets.""")
+tf.app.flags.DEFINE_boolean('conf_pruning_inf', False,
+                            """Only decode anchors whose confidence is above the """
+                            """probability threshold ? Does not change the detections.""")
+tf.app.flags.DEFINE_integer('conf_top_k_inf', 0,
+                            """Only decode this many anchors of highest confidence, 0 """
+                            """decodes all.""")
+tf.app.flags.DEFINE_string('frame_drop_policy', 'auto',
+                           """'latest' drops the oldest queued frame when a stage falls """
+                           """behind, 'lossless' processes every frame, 'auto' drops for """
+                           """cameras and streams only.""")
+tf.app.flags.DEFINE_integer('queue_size_inf', 2,
+                            """Number of frames queued between the pipeline stages.""")
+tf.app.flags.DEFINE_float('stats_interval_inf', 10.0,
+                          """Seconds between reports of the stage latencies, 0 only """
+                          """reports at the end.""")
+tf.app.flags.DEFINE_integer('batch_size_inf', 1,
+                            """Number of frames run through the network at once. Above 1 """
+                            """files are processed offline: frames are read ahead, run in """
+                            """batches and none is dropped.""")
+tf.app.flags.DEFINE_integer('post_processing_threads_inf', 4,
+                            """Number of threads filtering the detections of a batch.""")
+tf.app.flags.DEFINE_string('detections_file_inf', '',
+                           """Write the detections of every frame to this record file, """
+                           """JSONL if it ends in .jsonl and binary otherwise, instead of """
+                           """rendering them. See render_detections.py.""")
+
+def build_decoder(mask_parameterization, log_anchors, encoding_type):
+  """Decoder of the output of the frozen inference graphs of --dataset_inf."""
+  if FLAGS.dataset_inf == 'CITYSCAPE':
+    return Decoder('cityscape_log' if log_anchors else 'cityscape_linear', 7,
+                   mask_parameterization, encoding_type, (1024, 512))
+  return Decoder('kitti', 3, mask_parameterization, encoding_type, (1248, 384))
 
-def set_anchors_cityscape(H, W, log_anchors=False):
-  B = 9
-  if log_anchors:
-      print("Using Log domain extracted anchors")
-      anchor_shapes = np.reshape(
-        [np.array(
-            [[8.01, 11.25], [11.45, 26.49], [18.02, 13.88],
-             [21.40, 50.10], [31.07, 24.21], [42.67, 103.73],
-             [55.73, 42.22], [107.92, 76.43], [171.29, 181.58]])] * H * W,
-        (H, W, B, 2)
-      )
-  else:
-      print("Using Linear domain extracted anchors")
-      anchor_shapes = np.reshape(
-          [np.array(
-              [[17.31, 18.20], [35.13, 39.49], [99.93, 66.42],
-               [34.60, 73.31], [56.66, 125.19], [166.94, 114.14],
-               [94.15, 203.37], [257.57, 187.70], [196.69, 312.63]])] * H * W,
-          (H, W, B, 2)
-      )
-  center_x = np.reshape(
-    np.transpose(
-        np.reshape(
-            np.array([np.arange(1, W+1)*16]*H*B), 
-            (B, H, W)
-        ),
-        (1, 2, 0)
-    ),
-    (H, W, B, 1)
-  )
-  center_y = np.reshape(
-    np.transpose(
-        np.reshape(
-            np.array([np.arange(1, H+1)*16]*W*B),
-            (B, W, H)
-        ),
-        (2, 1, 0)
-    ),
-    (H, W, B, 1)
-  )
-  anchors = np.reshape(
-    np.concatenate((center_x, center_y, anchor_shapes), axis=3),
-    (-1, 4)
-  )
-
-  return anchors
-
-def set_anchors_kitti(H, W):
-  B = 9
-  anchor_shapes = np.reshape(
-      [np.array(
-          [[  36.,  37.], [ 366., 174.], [ 115.,  59.],
-           [ 162.,  87.], [  38.,  90.], [ 258., 173.],
-           [ 224., 108.], [  78., 170.], [  72.,  43.]])] * H * W,
-      (H, W, B, 2)
-  )
-  center_x = np.reshape(
-    np.transpose(
-        np.reshape(
-            np.array([np.arange(1, W+1)*16]*H*B), 
-            (B, H, W)
-        ),
-        (1, 2, 0)
-    ),
-    (H, W, B, 1)
-  )
-  center_y = np.reshape(
-    np.transpose(
-        np.reshape(
-            np.array([np.arange(1, H+1)*16]*W*B),
-            (B, W, H)
-        ),
-        (2, 1, 0)
-    ),
-    (H, W, B, 1)
-  )
-  anchors = np.reshape(
-    np.concatenate((center_x, center_y, anchor_shapes), axis=3),
-    (-1, 4)
-  )
-
-  return anchors
-
-def safe_exp(w, thresh):
-  slope = np.exp(thresh)
-  lin_bool = w > thresh
-  lin_region = np.where(lin_bool, np.ones_like(w), np.zeros_like(w))
-  lin_out = slope*(w - thresh + 1.)
-  exp_out = np.exp(np.where(lin_bool, np.zeros_like(w), w))
-  out = lin_region*lin_out + (1.-lin_region)*exp_out
-  return out
-
-def sigmoid(input_volume):
-  return (1 / (1 + np.exp(-input_volume)))
-
-def iou(box1, box2):
-  """Compute the Intersection-Over-Union of two given boxes.
-
-  Args:
-    box1: array of 4 elements [cx, cy, width, height].
-    box2: same as above
-  Returns:
-    iou: a float number in range [0, 1]. iou of the two boxes.
-  """
-  lr = min(box1[0]+0.5*box1[2], box2[0]+0.5*box2[2]) - \
-      max(box1[0]-0.5*box1[2], box2[0]-0.5*box2[2])
-  if lr > 0:
-    tb = min(box1[1]+0.5*box1[3], box2[1]+0.5*box2[3]) - \
-        max(box1[1]-0.5*box1[3], box2[1]-0.5*box2[3])
-    if tb > 0:
-      intersection = tb*lr
-      union = box1[2]*box1[3]+box2[2]*box2[3]-intersection
-      return intersection/union
-  return 0
-
-def batch_iou(boxes, box):
-  """Compute the Intersection-Over-Union of a batch of boxes with another
-  box.
+def load_inference_graph(graph_path):
+  """Graph of a frozen inference graph file, with its input and output tensors.
 
-  Args:
-    box1: 2D array of [cx, cy, width, height].
-    box2: a single array of [cx, cy, width, height]
-  Returns:
-    ious: array of a float number in range [0, 1].
-  """
-  lr = np.maximum(
-      np.minimum(boxes[:,0]+0.5*boxes[:,2], box[0]+0.5*box[2]) - \
-      np.maximum(boxes[:,0]-0.5*boxes[:,2], box[0]-0.5*box[2]),
-      0
-  )
-  tb = np.maximum(
-      np.minimum(boxes[:,1]+0.5*boxes[:,3], box[1]+0.5*box[3]) - \
-      np.maximum(boxes[:,1]-0.5*boxes[:,3], box[1]-0.5*box[3]),
-      0
-  )
-  inter = lr*tb
-  union = boxes[:,2]*boxes[:,3] + box[2]*box[3] - inter
-  return inter/union
-
-def nms(boxes, probs, threshold):
-  """Non-Maximum supression.
-  Args:
-    boxes: array of [cx, cy, w, h] (center format)
-    probs: array of probabilities
-    threshold: two boxes are considered overlapping if their IOU is largher than
-        this threshold
-    form: 'center' or 'diagonal'
-  Returns:
-    keep: array of True or False.
+  The output tensor is the raw output of the net, e.g. conv12/bias_add for
+  SqueezeDet and conv6/bias_add for VGG16. For graphs exported with
+  --post_processing it is the list of the post_processing/boxes, probs,
+  class_idx and num_detections tensors, which postprocess_batch takes as is.
   """
-  order = probs.argsort()[::-1] 
-  keep = [True]*len(order)
-  overlap_matrix = np.zeros((len(order), len(order)))
-  # count = 0
-  for i in range(len(order)-1):
-    ovps = batch_iou(boxes[order[i+1:]], boxes[order[i]])
-    overlap_matrix[order[i], order[i+1:]] = ovps
-    overlap_matrix[order[i+1:], order[i]] = ovps
-    for j, ov in enumerate(ovps):
-      # count +=1
-      if ov > threshold:
-        keep[order[j+i+1]] = False
-        overlap_matrix[order[i], order[j+i+1]] = 0
-        overlap_matrix[order[j+i+1], order[i]] = 0
-  return keep, overlap_matrix
-
-def soft_nms(boxes, probs):
-  """Soft Non-Maximum supression.
-  Args:
-    boxes: array of [cx, cy, w, h] (center format)
-    probs: array of probabilities
-    threshold: two boxes are considered overlapping if their IOU is largher than
-        this threshold
-    form: 'center' or 'diagonal'
-  Returns:
-    recalculated_probs: probabilities recalculated
-  """
-  order = probs.argsort()[::-1]
-  new_probs = copy.deepcopy(probs)
-  # count = 0
-  for i in range(len(order)-1):
-    ovps = batch_iou(boxes[order[i+1:]], boxes[order[i]])
-    new_probs[order[i+1:]] *= np.exp(-1*(ovps**2)/0.5)
-  # print(count)
-  return new_probs
-
-def filter_prediction(boxes, probs, cls_idx, PROB_THRESH, softnms=True):
-  filtered_idx = np.nonzero(probs> PROB_THRESH)[0]
-  probs = probs[filtered_idx]
-  boxes = boxes[filtered_idx]
-  cls_idx = cls_idx[filtered_idx]
-
-  final_boxes = []
-  final_probs = []
-  final_cls_idx = []
-  max_overlaps = []
-  NUM_CLASSES = 7
-  if softnms:
-      final_boxes = boxes
-      final_probs = soft_nms(boxes, probs)
-      final_cls_idx = cls_idx
+  graph = tf.Graph()
+  with graph.as_default():
+    graph_def = tf.GraphDef()
+    with tf.gfile.GFile(graph_path, 'rb') as f:
+      graph_def.ParseFromString(f.read())
+    tf.import_graph_def(graph_def, name='')
+  nodes = read_graph_nodes(graph_path)
+  input_names, output_names = nodes or ([], ['conv12/bias_add'])
+  if FLAGS.output_node_inf:
+    output_names = FLAGS.output_node_inf.split(',')
+  # graphs exported with the old SqueezeDet_inf name their input
+  # image_input_1
+  for name in input_names + ['image_input_1', 'image_input']:
+    try:
+      image_tensor = graph.get_tensor_by_name(name+':0')
+      break
+    except KeyError:
+      pass
   else:
-      for c in range(NUM_CLASSES):
-        idx_per_class = [i for i in range(len(probs)) if cls_idx[i] == c]
-        keep, overlap_matrix = nms(boxes[idx_per_class], probs[idx_per_class], 0.5)
-        for i in range(len(keep)):
-          if keep[i]:
-            final_boxes.append(boxes[idx_per_class[i]])
-            final_probs.append(probs[idx_per_class[i]])
-            final_cls_idx.append(c)
-            max_overlaps.append(max(overlap_matrix[i,:]))
-  return final_boxes, final_probs, final_cls_idx, max_overlaps
-
-    
-def interpret_output(output_volume, mask_parameterization=4, log_anchors=False, imgSize=(1024,512), encoding_type_now='normal'):
-  ANCHOR_PER_GRID = 9
-  BATCH_SIZE, H, W, nc = np.shape(output_volume)
+    assert False, 'Cannot find the input tensor of the graph'
+  outputs = [graph.get_tensor_by_name(name+':0') for name in output_names]
+  assert len(outputs) in [1, 4], \
+      'Expected the raw output or the four post-processing outputs, got {}'.format(output_names)
+  return graph, image_tensor, outputs[0] if len(outputs) == 1 else outputs
+
+def class_names():
+  """Names of the class indices of --dataset_inf."""
   if FLAGS.dataset_inf == 'CITYSCAPE':
-    NUM_CLASSES = 7
-    ANCHOR_BOX = set_anchors_cityscape(H, W, log_anchors)
-  else:
-    NUM_CLASSES = 3
-    ANCHOR_BOX = set_anchors_kitti(H, W)
-  ANCHORS = len(ANCHOR_BOX)
-  num_class_probs = ANCHOR_PER_GRID*NUM_CLASSES
-  pred_class_probs = np.reshape(
-        sp.softmax(
-            np.reshape(
-                output_volume[:, :, :, :num_class_probs],
-                [-1, NUM_CLASSES]
-            ), axis=1 
-        ), [BATCH_SIZE, ANCHORS, NUM_CLASSES])
-  
-  num_confidence_scores = ANCHOR_PER_GRID+num_class_probs
-  pred_conf = sp.expit(
-    np.reshape(
-        output_volume[:, :, :, num_class_probs:num_confidence_scores],
-        [BATCH_SIZE, ANCHORS]
-    )
-  )
-  pred_box_delta = np.reshape(
-    output_volume[:, :, :, num_confidence_scores:],
-    [BATCH_SIZE, ANCHORS, mask_parameterization]
-  )
-  
-  anchor_x = ANCHOR_BOX[:, 0]
-  anchor_y = ANCHOR_BOX[:, 1]
-  anchor_w = ANCHOR_BOX[:, 2]
-  anchor_h = ANCHOR_BOX[:, 3]
-
-  delta_x, delta_y, delta_w, delta_h = np.squeeze(pred_box_delta[:,:,0]), np.squeeze(pred_box_delta[:,:,1]), np.squeeze(pred_box_delta[:,:,2]), np.squeeze(pred_box_delta[:,:,3])
-
-
-  if mask_parameterization == 8:
-    delta_of1, delta_of2, delta_of3, delta_of4 = np.squeeze(pred_box_delta[:,:,4]), np.squeeze(pred_box_delta[:,:,5]), np.squeeze(pred_box_delta[:,:,6]), np.squeeze(pred_box_delta[:,:,7])
-    EPSILON = 1e-8
-    anchor_diag = (anchor_w**2 + anchor_h**2)**(0.5)
-    box_of1 = (anchor_diag * safe_exp(delta_of1, 1.0))-EPSILON
-    box_of2 = (anchor_diag * safe_exp(delta_of2, 1.0))-EPSILON
-    box_of3 = (anchor_diag * safe_exp(delta_of3, 1.0))-EPSILON
-    box_of4 = (anchor_diag * safe_exp(delta_of4, 1.0))-EPSILON
-
-  if encoding_type_now == 'normal':
-    # Normal decoding
-    box_center_x = anchor_x + delta_x * anchor_w
-    box_center_y = anchor_y + delta_y * anchor_h
-    box_width = anchor_w * safe_exp(delta_w, 1.0)
-    box_height = anchor_h * safe_exp(delta_h, 1.0)
-    # box_width = anchor_w * np.exp(delta_w)
-    # box_height = anchor_h * np.exp(delta_h)
-    xmins= box_center_x-box_width/2
-    ymins = box_center_y-box_height/2
-    xmaxs = box_center_x+box_width/2
-    ymaxs = box_center_y+box_height/2
-
-  elif encoding_type_now == 'asymmetric_log':
-    # Asymmetric Log
-    EPSILON = 0.5
-    delta_xmin, delta_ymin, delta_xmax, delta_ymax = delta_x, delta_y, delta_w, delta_h
-    xmins = anchor_x - (anchor_w * (np.exp(delta_xmin)-EPSILON))
-    ymins = anchor_y - (anchor_h * (np.exp(delta_ymin)-EPSILON))
-    xmaxs = anchor_x + (anchor_w * (np.exp(delta_xmax)-EPSILON))
-    ymaxs = anchor_y + (anchor_h * (np.exp(delta_ymax)-EPSILON))
-  elif encoding_type_now == 'asymmetric_linear':
-    # Asymmetric Lìnear
-    delta_xmin, delta_ymin, delta_xmax, delta_ymax = delta_x, delta_y, delta_w, delta_h
-    xmins_a = anchor_x-anchor_w/2
-    ymins_a = anchor_y-anchor_h/2
-    xmaxs_a = anchor_x+anchor_w/2
-    ymaxs_a = anchor_y+anchor_h/2
-    xmins = xmins_a + delta_xmin * anchor_w
-    ymins = ymins_a + delta_ymin * anchor_h
-    xmaxs = xmaxs_a + delta_xmax * anchor_w
-    ymaxs = ymaxs_a + delta_ymax * anchor_h
-
-  # Trimming
-  xmins = np.minimum(np.maximum([0.0]*len(xmins), xmins), [imgSize[0]-1.0]*len(xmins))
-  ymins = np.minimum(np.maximum([0.0]*len(ymins), ymins), [imgSize[1]-1.0]*len(ymins))
-  xmaxs = np.maximum(np.minimum([imgSize[0]-1.0]*len(xmaxs), xmaxs), [0.0]*len(xmaxs))
-  ymaxs = np.maximum(np.minimum([imgSize[1]-1.0]*len(ymaxs), ymaxs), [0.0]*len(ymaxs))
-  # transforming back
-  # if mask_parameterization == 8:
-  width       = xmaxs - xmins
-  height      = ymaxs - ymins
-  # else:
-  #   width       = xmaxs - xmins + 1.0
-  #   height      = ymaxs - ymins + 1.0
-  box_center_x  = xmins + 0.5*width 
-  box_center_y  = ymins + 0.5*height
-  box_width  = width
-  box_height  = height
-
-  probs = np.multiply(
-      pred_class_probs,
-      np.reshape(pred_conf, [BATCH_SIZE, ANCHORS, 1])
-  )
-  det_probs = np.amax(probs, 2)
-  det_class = np.argmax(probs, 2)
-  if mask_parameterization == 8:
-    det_boxes = np.transpose(np.stack([box_center_x, box_center_y, box_width, box_height, box_of1, box_of2, box_of3, box_of4]))
-  else:
-    det_boxes = np.transpose(np.stack([box_center_x, box_center_y, box_width, box_height]))
-  return det_boxes, np.squeeze(det_probs), np.squeeze(det_class)
+    return tuple(sorted(('person', 'rider', 'car', 'truck', 'bus', 'motorcycle', 'bicycle')))
+  return tuple(sorted(('car', 'pedestrian', 'cyclist')))
 
-def decode_parameterization(mask_vector):
-  """Decodes the octagonal parameterization of the mask to get
-     the 8 points approximation of the polygon.
-  Args:
-    mask vector: [cx, cy, w, h, of1, of2, of3, of4]
-  Returns:
-    intersecting_pts: list of points where the octagonal mask 
-                      intersects the bounding box
-  """
-
-  def _get_intersecting_point(vert_hor, eq1, pt, m):
-    """Finds the point of intersection of a line1 with vertical or 
-       horizontal line.
-    Args:
-      vert_hor: "vert" or "hor" represents intersection is to be found 
-                with respect to which line.
-      eq1: equation of vertical or horizontal line.
-      pt : point on line1.
-      m  : slope of line1.
-    Returns:
-      point of intersection of line1 with vertical or horizontal.
-    """
-    pt_x, pt_y = pt
-    c = pt_y - (m*pt_x)
-    if vert_hor == "vert":
-        x_cor = eq1
-        y_cor = (m*x_cor) + c
-    else:
-        y_cor = eq1
-        x_cor = (y_cor - c)/m
-    return (x_cor, y_cor)
-
-  center_x, center_y, width, height, off1, off2, off3, off4 = mask_vector
-  cos = math.cos(math.radians(45))
-  sin = math.cos(math.radians(45))
-  pts = [0,0,0,0]
-  pts[0] = (center_x-off1*cos, center_y-off1*sin)
-  pts[1] = (center_x-off2*cos, center_y+off2*sin)
-  pts[2] = (center_x+off3*cos, center_y+off3*sin)
-  pts[3] = (center_x+off4*cos, center_y-off4*sin)
-  xmin = center_x - (0.5*width)
-  xmax = center_x + (0.5*width)
-  ymin = center_y - (0.5*height)
-  ymax = center_y + (0.5*height)
-  points = [pts[0], pts[1], pts[1], pts[2], pts[2], pts[3], pts[3], pts[0]]
-  eq1s = [xmin, xmin, ymax, ymax, xmax, xmax, ymin, ymin]
-  vert_or_hors = ["vert", "vert", "hor", "hor", "vert", "vert", "hor", "hor"]
-  EPSILON = 1e-8
-  dr1 = (pts[2][0]-pts[0][0])
-  if dr1 == 0:
-    dr1 = EPSILON
-  dr2 = (pts[3][0]-pts[1][0])
-  if dr2 == 0:
-    dr2 = EPSILON
-  m1 = (pts[2][1]-pts[0][1])/dr1
-  m2 = (pts[3][1]-pts[1][1])/dr2
-  assert m1 != 0 and m2 != 0, "Slopes are zero in _get_intersecting_point"
-  ms = [-1/m1, -1/m2, -1/m2, -1/m1, -1/m1, -1/m2, -1/m2, -1/m1]
-  intersecting_pts = []
-  for i, eq1, pt, vert_hor, m in zip(range(8), eq1s, points, vert_or_hors, ms):
-      op_pt = _get_intersecting_point(vert_hor, eq1, pt, m)
-      x_val, y_val = op_pt
-      if vert_hor == 'vert':
-        if i == 0 or i == 5:
-          y_val = min(y_val, center_y)
-        elif i == 1 or i == 4:
-          y_val = max(y_val, center_y)
-      else:
-        if i == 2 or i == 7:
-          x_val = min(x_val, center_x)
-        elif i == 3 or i == 6:
-          x_val = max(x_val, center_x)
-      op_pt = (min(max(xmin, x_val), xmax), min(max(ymin, y_val), ymax))
-      intersecting_pts.append(op_pt)
-  return intersecting_pts
-
-def process_frame(img, mask_parameterization_now, log_anchors_now, encoding_type_now, checkpoint_path, 
-                  sess, tensor_dict, image_tensor, softnms=False):
+def image_size():
   if FLAGS.dataset_inf == 'CITYSCAPE':
-    IMAGE_WIDTH = 1024
-    IMAGE_HEIGHT = 512
-  else:
-    IMAGE_WIDTH = 1248
-    IMAGE_HEIGHT  = 384
-  PLOT_PROB_THRESH = 0.5
-  PROB_THRESH = 0.005
+    return 1024, 512
+  return 1248, 384
+
+def preprocess_frame(img):
+  """Resize a frame to the input size of the graph and subtract the means.
+  Returns the resized frame to draw on and the input batch of one image."""
   BGR_MEANS = np.array([[[103.939, 116.779, 123.68]]])
-  image_np = cv2.resize(img, (IMAGE_WIDTH, IMAGE_HEIGHT))
+  image_np = cv2.resize(img, image_size())
   image_np_orig = copy.deepcopy(image_np)
   image_np = image_np.astype(np.float32, copy=False)
   image_unexpanded = image_np - BGR_MEANS
   image = np.expand_dims(image_unexpanded, axis=0)
-  output_dict = sess.run(tensor_dict,
-                         feed_dict={image_tensor: image})
-  boxes, probs, classes = interpret_output(output_dict['conv12/bias_add'], mask_parameterization_now, log_anchors_now, [IMAGE_WIDTH, IMAGE_HEIGHT], encoding_type_now)
-  det_bbox, det_prob, det_class, overlaps = filter_prediction(boxes, probs, classes, PLOT_PROB_THRESH, softnms)
+  return image_np_orig, image
+
+def preprocess_batch(images):
+  """preprocess_frame for a list of frames. Returns the resized frames and one
+  input batch of all of them."""
+  frames = [preprocess_frame(img) for img in images]
+  return [f[0] for f in frames], np.concatenate([f[1] for f in frames])
+
+def _final_detections(boxes, probs, classes, softnms=False):
+  PLOT_PROB_THRESH = 0.5
+  det_bbox, det_prob, det_class = filter_prediction(boxes, probs, classes, PLOT_PROB_THRESH,
+                                                    nms_thresh=0.5, softnms=softnms,
+                                                    sigma=FLAGS.soft_nms_sigma_inf,
+                                                    method=FLAGS.soft_nms_method_inf,
+                                                    per_class=FLAGS.soft_nms_per_class_inf)
   keep_idx    = [idx for idx in range(len(det_prob)) \
                     if det_prob[idx] >= 0.5]
   final_boxes = [det_bbox[idx] for idx in keep_idx]
   final_probs = [det_prob[idx] for idx in keep_idx]
   final_class = [det_class[idx] for idx in keep_idx]
-  final_overlaps = [overlaps[idx] for idx in keep_idx]
-  return final_boxes, final_probs, final_class, final_probs, image_np_orig
+  return final_boxes, final_probs, final_class
+
+def graph_detections(outputs, i):
+  """Boxes, probabilities and class indices of image i of the outputs of a
+  graph exported with --post_processing, which are already filtered."""
+  boxes, probs, classes, num_detections = outputs
+  n = num_detections[i]
+  return boxes[i, :n], probs[i, :n], classes[i, :n]
+
+def _exported_detections(outputs, i):
+  final_boxes, final_probs, final_class = graph_detections(outputs, i)
+  keep = final_probs >= 0.5
+  return list(final_boxes[keep]), list(final_probs[keep]), list(final_class[keep])
+
+def postprocess_frame(output_volume, decoder, softnms=False):
+  """Detections of a frame with a probability of at least 0.5."""
+  PLOT_PROB_THRESH = 0.5
+  if isinstance(output_volume, list):
+    return _exported_detections(output_volume, 0)
+  boxes, probs, classes = decoder(output_volume, FLAGS.conf_top_k_inf,
+                                  PLOT_PROB_THRESH if FLAGS.conf_pruning_inf else 0.0)
+  return _final_detections(boxes[0], probs[0], classes[0], softnms)
+
+def postprocess_batch(output_volume, decoder, softnms=False, pool=None):
+  """Detections of every frame of a batch, in order. The anchors of the whole
+  batch are decoded at once and the frames are filtered by the threads of
+  pool, if given. The outputs of graphs exported with --post_processing are
+  only thresholded."""
+  if isinstance(output_volume, list):
+    return [_exported_detections(output_volume, i)
+            for i in range(len(output_volume[3]))]
+  if FLAGS.conf_pruning_inf:
+    # pruning by confidence decodes one frame at a time
+    return [postprocess_frame(output_volume[i:i+1], decoder, softnms)
+            for i in range(len(output_volume))]
+  boxes, probs, classes = decoder(output_volume, FLAGS.conf_top_k_inf)
+  def _filter(i):
+    return _final_detections(boxes[i], probs[i], classes[i], softnms)
+  if pool is None:
+    return [_filter(i) for i in range(len(output_volume))]
+  # map keeps the order of the frames
+  return pool.map(_filter, range(len(output_volume)))
+
+def _batches(frames, batch_size):
+  """Group frames into lists of batch_size, the last one may be shorter."""
+  batch = []
+  for frame in frames:
+    batch.append(frame)
+    if len(batch) == batch_size:
+      yield batch
+      batch = []
+  if batch:
+    yield batch
+
+def offline_pipeline(frames, sess, output_tensor, image_tensor, decoder, batch_size,
+                     softnms=False, pool=None, queue_size=2):
+  """Pipeline detecting objects in batches of frames of a file.
+
+  Frames are read and pre-processed ahead in the capture thread, batch_size of
+  them are run through the network in one session run and the detections of a
+  batch are filtered in parallel by the threads of pool. No frame is dropped.
+
+  Args:
+    frames: iterable of (key, BGR image), the key is passed on with the
+        detections of the frame.
+    sess: session of a frozen inference graph with a dynamic batch dimension.
+    output_tensor: the output of the graph, as returned by load_inference_graph.
+    image_tensor: the input tensor of the graph.
+    decoder: Decoder of the output of the graph.
+    batch_size: number of frames per session run.
+    softnms: soft NMS instead of NMS ?
+    pool: ThreadPool filtering the detections, None filters in the
+        post-processing thread.
+    queue_size: number of batches queued between the pipeline stages.
+  Returns:
+    Pipeline yielding for every batch a list of (key, resized image, boxes,
+    probs, classes) of its frames, in frame order.
+  """
+  assert batch_size == 1 or image_tensor.get_shape()[0].value is None, \
+      'Batches of frames need a graph with a dynamic batch dimension'
+
+  def _read(frames):
+    for batch in _batches(frames, batch_size):
+      keys = [key for key, _ in batch]
+      images, image = preprocess_batch([img for _, img in batch])
+      yield keys, images, image
+
+  def _inference(batch):
+    keys, images, image = batch
+    return keys, images, sess.run(output_tensor, feed_dict={image_tensor: image})
+
+  def _post_processing(batch):
+    keys, images, output_volume = batch
+    detections = postprocess_batch(output_volume, decoder, softnms, pool)
+    return [(key, img) + tuple(det) for key, img, det in zip(keys, images, detections)]
+
+  return Pipeline(
+      _read(frames), [('inference', _inference), ('post-process', _post_processing)],
+      queue_size, 'lossless', frame_count=len)
+
+def frame_drop_policy(input_path):
+  """Latest frame wins for cameras and streams, which cannot be slowed down,
+  no frame is dropped from files."""
+  if FLAGS.frame_drop_policy != 'auto':
+    return FLAGS.frame_drop_policy
+  if input_path.isdigit() or '://' in input_path:
+    return 'latest'
+  return 'lossless'
+
+def is_image_sequence(input_path):
+  """Whether input_path is a glob of images, rather than a video file, a
+  camera index or a stream URL."""
+  return '.png' in input_path or '*' in input_path
+
+def read_frames(input_path):
+  """Frame id, output file name and BGR image of every frame of a source.
+
+  Images of a glob are read in the order of their sorted paths and keep their
+  name, with a .png extension. The frames of a video, camera or stream are
+  named after it and numbered from 1, e.g. video_1.png.
+  """
+  if is_image_sequence(input_path):
+    for frame_id, image_path in enumerate(sorted(glob.glob(input_path))):
+      name = os.path.splitext(os.path.basename(image_path))[0]+".png"
+      yield frame_id, name, cv2.imread(image_path)
+    return
+  # a camera is opened by its index
+  cap = cv2.VideoCapture(int(input_path) if input_path.isdigit() else input_path)
+  assert cap.isOpened(), 'Error opening video stream or file {}'.format(input_path)
+  prefix = os.path.splitext(os.path.basename(input_path))[0]
+  frame_id = 0
+  try:
+    while cap.isOpened():
+      ret, img = cap.read()
+      if not ret:
+        break
+      yield frame_id, prefix+"_"+str(frame_id+1)+".png", img
+      frame_id += 1
+  finally:
+    cap.release()
 
 def video_demo_inference_graph(mask_parameterization_now, log_anchors_now, encoding_type_now, checkpoint_path, softnms=False):
-  assert FLAGS.demo_net == 'squeezeDet', 'Selected neural net architecture not supported: {}'.format(FLAGS.demo_net)
-  if FLAGS.dataset_inf == 'CITYSCAPE':
-    CLASS_NAMES = tuple(sorted(('person', 'rider', 'car', 'truck', 'bus', 'motorcycle', 'bicycle')))
-  else:
-    CLASS_NAMES = tuple(sorted(('car', 'pedestrian', 'cyclist')))
+  """Detect objects in an image sequence or a video, a file, camera or stream.
+
+  Frames are read, run through the network and post-processed in a pipeline
+  of threads, while the main thread draws and displays the previous frames.
+  """
+  CLASS_NAMES = class_names()
 
   # Class specific color definitions
   _cdict = {}
@@ -495,90 +332,91 @@ def video_demo_inference_graph(mask_parameterization_now, log_anchors_now, encod
   _cdict['bicycle']     = (255,128,0)
   _cdict['cyclist']     = (255,128,0)
 
-  detection_graph = tf.Graph()
-  if not '.png' in FLAGS.input_path:
-    cap = cv2.VideoCapture(FLAGS.input_path)
-    if (cap.isOpened()== False): 
-      print("Error opening video stream or file")
-
-  with detection_graph.as_default():
-    od_graph_def = tf.GraphDef()
-    with tf.gfile.GFile(checkpoint_path, 'rb') as fid:
-      serialized_graph = fid.read()
-      od_graph_def.ParseFromString(serialized_graph)
-      tf.import_graph_def(od_graph_def, name='')
-    with tf.Session() as sess:
-      # Get handles to input and output tensors
-      ops = tf.get_default_graph().get_operations()
-      all_tensor_names = {output.name for op in ops for output in op.outputs}
-      tensor_dict = {}
-      for key in ['conv12/bias_add']:
-        tensor_name = key + ':0'
-        if tensor_name in all_tensor_names:
-          tensor_dict[key] = tf.get_default_graph().get_tensor_by_name(
-              tensor_name)
-      image_tensor = tf.get_default_graph().get_tensor_by_name('image_input_1:0')
-      if '.png' in FLAGS.input_path:
-        print("Processing image sequences!")
-        for image_path in glob.iglob(FLAGS.input_path):
-          start = time.time()
-          read_img = cv2.imread(image_path)
-          frame_read_time = time.time()-start
-          image_np_orig = copy.deepcopy(read_img)
-          # Run inference
-          final_boxes, final_probs, final_class, final_probs, image_np_orig = process_frame(read_img, mask_parameterization_now, \
-                                      log_anchors_now, encoding_type_now, checkpoint_path, sess, tensor_dict, image_tensor, \
-                                      softnms)
-          end = time.time()
-          fps = 1 / (end-start)
-          fps_text = "FPS counter: {:0.2f} fps/Per frame read time: {:0.2f} ms".format(round(fps,2), round(frame_read_time*1000,2))
-          _draw_box(
-            image_np_orig, final_boxes,
-            [CLASS_NAMES[idx]+': (%.2f)'% prob \
-                for idx, prob in zip(final_class, final_probs)],
-            (0, 0, 255), draw_masks=(mask_parameterization_now == 8), fill=False, cdict=_cdict, fps_text=fps_text)
-          cv2.imshow('Frame',image_np_orig)
-          if FLAGS.write_to_disk:
-            out_file_name = os.path.join(FLAGS.out_dir, image_path.split('\\')[-1][:-4]+".png")
-            cv2.imwrite(out_file_name, image_np_orig)
-          if cv2.waitKey(25) & 0xFF == ord('q'):
-            break
+  decoder = build_decoder(mask_parameterization_now, log_anchors_now, encoding_type_now)
+  graph, image_tensor, output_tensor = load_inference_graph(checkpoint_path)
+
+  # frames are keyed by their index in the sequence and their output file,
+  # videos are cut after 1200 frames
+  def _frames():
+    for frame_id, name, read_img in read_frames(FLAGS.input_path):
+      if not is_image_sequence(FLAGS.input_path) and frame_id >= 1200:
+        break
+      yield (frame_id, os.path.join(FLAGS.out_dir, name)), read_img
+
+  with tf.Session(graph=graph) as sess:
+    def _inference(frame):
+      key, read_img = frame
+      image_np_orig, image = preprocess_frame(read_img)
+      output_volume = sess.run(output_tensor,
+                               feed_dict={image_tensor: image})
+      return key, image_np_orig, output_volume
+
+    def _post_processing(frame):
+      key, image_np_orig, output_volume = frame
+      return (key, image_np_orig) + tuple(
+          postprocess_frame(output_volume, decoder, softnms))
+
+    if is_image_sequence(FLAGS.input_path):
+      print("Processing image sequences!")
+    else:
+      print("Processing video!")
+    frames = _frames()
+    pool = None
+    if FLAGS.batch_size_inf > 1:
+      assert frame_drop_policy(FLAGS.input_path) == 'lossless', \
+          'Batches of frames are only supported for files, not for cameras and streams'
+      print("Offline processing in batches of", FLAGS.batch_size_inf, "frames")
+      pool = ThreadPool(FLAGS.post_processing_threads_inf)
+      pipeline = offline_pipeline(
+          frames, sess, output_tensor, image_tensor, decoder,
+          FLAGS.batch_size_inf, softnms, pool, FLAGS.queue_size_inf)
+      detections = (frame for batch in pipeline for frame in batch)
+    else:
+      policy = frame_drop_policy(FLAGS.input_path)
+      print("Frame drop policy:", policy)
+      pipeline = Pipeline(
+          frames, [('inference', _inference), ('post-process', _post_processing)],
+          FLAGS.queue_size_inf, policy)
+      detections = pipeline
+    # headless: the detections are streamed to a record file, nothing is drawn
+    sink = None
+    if FLAGS.detections_file_inf:
+      print("Writing the detections to", FLAGS.detections_file_inf)
+      sink = DetectionRecordWriter(FLAGS.detections_file_inf, CLASS_NAMES,
+                                   mask_parameterization_now, image_size())
+    last_report = time.time()
+    for (frame_id, out_file_name), image_np_orig, final_boxes, final_probs, final_class in detections:
+      if sink is not None:
+        sink.write(frame_id, os.path.basename(out_file_name), final_boxes, final_probs, final_class)
       else:
-        frame_cnt = 0
-        print("Processing video!")
-        while(cap.isOpened()):
-          start = time.time()
-          ret, read_img = cap.read()
-          frame_read_time = time.time()-start
-          if ret == True:
-            # Run inference
-            final_boxes, final_probs, final_class, final_probs, image_np_orig = process_frame(read_img, mask_parameterization_now, \
-                                        log_anchors_now, encoding_type_now, checkpoint_path, sess, tensor_dict, image_tensor, \
-                                        softnms)
-            end = time.time()
-            fps = 1 / (end-start)
-            fps_text = "FPS counter: {:0.2f} fps/Per frame read time: {:0.2f} ms".format(round(fps,2), round(frame_read_time*1000,2))
-            _draw_box(
-              image_np_orig, final_boxes,
-              [CLASS_NAMES[idx]+': (%.2f)'% prob \
-                  for idx, prob in zip(final_class, final_probs)],
-              (0, 0, 255), draw_masks=(mask_parameterization_now == 8), fill=False, cdict=_cdict, fps_text=fps_text)
-            cv2.imshow('Frame',image_np_orig)
-            frame_cnt +=1
-            if FLAGS.write_to_disk:
-              out_file_name = os.path.join(FLAGS.out_dir, FLAGS.input_path.split('\\')[-1][:-4]+"_"+str(frame_cnt)+".png")
-              cv2.imwrite(out_file_name, image_np_orig)
-            if cv2.waitKey(25) & 0xFF == ord('q') or frame_cnt==1200:
-              break
-          else:
-            break
-
-  if not '.png' in FLAGS.input_path: 
-    cap.release()
+        fps_text = "FPS counter: {:0.2f} fps/Dropped frames: {:d}".format(
+            pipeline.stats.fps(), pipeline.num_dropped)
+        _draw_box(
+          image_np_orig, final_boxes,
+          [CLASS_NAMES[idx]+': (%.2f)'% prob \
+              for idx, prob in zip(final_class, final_probs)],
+          (0, 0, 255), draw_masks=(mask_parameterization_now == 8), fill=False, cdict=_cdict, fps_text=fps_text)
+        cv2.imshow('Frame',image_np_orig)
+        if FLAGS.write_to_disk:
+          cv2.imwrite(out_file_name, image_np_orig)
+      if FLAGS.stats_interval_inf > 0 and time.time()-last_report >= FLAGS.stats_interval_inf:
+        print(pipeline.stats.report(pipeline.num_dropped))
+        last_report = time.time()
+      # the pipeline keeps running while waiting, no need to sleep
+      if sink is None and cv2.waitKey(1) & 0xFF == ord('q'):
+        break
+    pipeline.stop()
+    if pool is not None:
+      pool.close()
+    if sink is not None:
+      sink.close()
+    print(pipeline.stats.report(pipeline.num_dropped))
+
+  if not FLAGS.detections_file_inf:
     cv2.destroyAllWindows()
 
 def main(argv=None):
-  video_demo_inference_graph(FLAGS.mask_parameterization_inf, FLAGS.log_anchors_inf, FLAGS.encoding_type_inf, FLAGS.inference_graph, softnms=False)
+  video_demo_inference_graph(FLAGS.mask_parameterization_inf, FLAGS.log_anchors_inf, FLAGS.encoding_type_inf, FLAGS.inference_graph, softnms=FLAGS.soft_nms_inf)
 
 if __name__ == '__main__':
   tf.app.run()
@@ -8,6 +8,7 @@ import os
 import platform
 from nets import *
 from config import *
+from utils.util import write_graph_nodes
 from tensorflow.python.tools.inspect_checkpoint import print_tensors_in_checkpoint_file
 from tensorflow.tools.graph_transforms import TransformGraph
 
@@ -20,9 +21,16 @@ tf.app.flags.DEFINE_string(
 tf.app.flags.DEFINE_string('net', 'squeezeDet',
 							"""Neural net architecture. """)
 
-output_node_names = ['conv12/bias_add']
 input_node_names = ['image_input']
 
+# cityscape config and inference model of every net
+nets = {
+	'squeezeDet': (cityscape_squeezeDet_config, SqueezeDet_inf),
+	'squeezeDet+': (cityscape_squeezeDetPlus_config, SqueezeDetPlus_inf),
+	'resnet50': (cityscape_res50_config, ResNet50ConvDet_inf),
+	'vgg16': (cityscape_vgg16_config, VGG16ConvDet_inf)}
+assert FLAGS.net in nets, "Model not supported!"
+
 checkpoints = []
 if platform.system() == 'Linux':
 	separator = '/'
@@ -68,13 +76,12 @@ for i, c in enumerate(checkpoints):
 		tf.gfile.MakeDirs(log_dir)
 
 	with tf.Graph().as_default():
-		mc = cityscape_squeezeDet_config(mask_param, use_log_anchors, False, encoding_scheme)
+		cityscape_config, net_class = nets[FLAGS.net]
+		mc = cityscape_config(mask_param, use_log_anchors, False, encoding_scheme)
 		mc.LOAD_PRETRAINED_MODEL = False
 		mc.IS_TRAINING = False
-		if FLAGS.net == 'squeezeDet':
-			model = SqueezeDet_inf(mc)
-		else:
-			assert False, "Model not supported!"
+		model = net_class(mc)
+		output_node_names = [model.preds.op.name]
 		sess = tf.Session(config=tf.ConfigProto(allow_soft_placement=True))
 
 		saver = tf.train.Saver(tf.global_variables())
@@ -96,3 +103,5 @@ for i, c in enumerate(checkpoints):
 
 		with open(os.path.join(log_dir, 'frozen_inference_graph.pb'), 'wb') as f:
 			f.write(frozen_graph_def.SerializeToString())
+		write_graph_nodes(os.path.join(log_dir, 'frozen_inference_graph.pb'),
+						input_node_names, output_node_names)
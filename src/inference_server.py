@@ -0,0 +1,144 @@
+"""Local HTTP inference server for frozen inference graphs.
+
+Loads the frozen graph of --inference_graph once and serves detections over
+HTTP. Every connection is handled in its own thread, which decodes and
+pre-processes the image, and a DynamicBatcher coalesces the images of
+concurrent requests into batches of up to --max_batch_size, waiting at most
+--max_wait_ms for a batch to fill. A batch is run through the network in one
+session run and post-processed like in inference.py. The graph needs a
+dynamic batch dimension, as exported by export_inference_graph.py.
+
+  POST /detect   body: an encoded image (PNG, JPEG, ...), returns the JSON
+                 of the detections in the coordinates of the network input.
+  GET /metrics   returns the JSON of the request rate, the latency
+                 percentiles and the batch sizes.
+
+  python ./src/inference_server.py --inference_graph=$GRAPH \
+      --dataset_inf=CITYSCAPE --log_anchors_inf --max_batch_size=8
+
+See load_generator.py for benchmarking a running server.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import json
+from multiprocessing.pool import ThreadPool
+
+import cv2
+import numpy as np
+import tensorflow as tf
+from six.moves import BaseHTTPServer, socketserver
+
+from inference import (build_decoder, class_names, load_inference_graph,
+                       image_size, postprocess_batch, preprocess_frame)
+from utils.batching import DynamicBatcher
+from utils.detection_records import detection_dicts
+
+FLAGS = tf.app.flags.FLAGS
+
+tf.app.flags.DEFINE_string('host', '127.0.0.1',
+                           """Address to listen on, local only by default.""")
+tf.app.flags.DEFINE_integer('port', 8500, """Port to listen on.""")
+tf.app.flags.DEFINE_integer('max_batch_size', 8,
+                            """Maximum number of images per session run.""")
+tf.app.flags.DEFINE_float('max_wait_ms', 5.0,
+                          """Maximum time in ms a batch waits for more images.""")
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+  def _send_json(self, code, body):
+    data = json.dumps(body, sort_keys=True).encode('utf-8')
+    self.send_response(code)
+    self.send_header('Content-Type', 'application/json')
+    self.send_header('Content-Length', str(len(data)))
+    self.end_headers()
+    self.wfile.write(data)
+
+  def do_GET(self):
+    if self.path == '/metrics':
+      self._send_json(200, self.server.batcher.metrics())
+    else:
+      self._send_json(404, {'error': 'Unknown path {}'.format(self.path)})
+
+  def do_POST(self):
+    if self.path != '/detect':
+      self._send_json(404, {'error': 'Unknown path {}'.format(self.path)})
+      return
+    length = int(self.headers.get('Content-Length', 0))
+    img = cv2.imdecode(np.frombuffer(self.rfile.read(length), dtype=np.uint8),
+                       cv2.IMREAD_COLOR)
+    if img is None:
+      self._send_json(400, {'error': 'Cannot decode the image'})
+      return
+    _, image = preprocess_frame(img)
+    try:
+      boxes, probs, classes = self.server.batcher.submit(image)
+    except Exception as e:
+      self._send_json(500, {'error': str(e)})
+      return
+    self._send_json(200, {
+        'image_size': list(image_size()),
+        'detections': detection_dicts(boxes, probs, classes,
+                                      self.server.class_names)})
+
+  def log_message(self, format, *args):
+    # one line per request would cost more than the request
+    pass
+
+class InferenceServer(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+  daemon_threads = True
+
+  def __init__(self, address, sess, image_tensor, output_tensor, decoder,
+               class_names, max_batch_size=8, max_wait_ms=5.0, pool=None):
+    """
+    Args:
+      address: (host, port) to listen on.
+      sess: session of a frozen inference graph with a dynamic batch
+          dimension.
+      image_tensor: the input tensor of the graph.
+      output_tensor: the output of the graph, as returned by
+          load_inference_graph.
+      decoder: Decoder of the output of the graph.
+      class_names: names of the class indices.
+      max_batch_size: maximum number of images per session run.
+      max_wait_ms: maximum time in ms a batch waits for more images.
+      pool: ThreadPool filtering the detections of a batch.
+    """
+    BaseHTTPServer.HTTPServer.__init__(self, address, _Handler)
+    assert max_batch_size == 1 or image_tensor.get_shape()[0].value is None, \
+        'Batches of images need a graph with a dynamic batch dimension'
+    self.class_names = class_names
+
+    def _run_batch(images):
+      output_volume = sess.run(output_tensor,
+                               feed_dict={image_tensor: np.concatenate(images)})
+      return postprocess_batch(output_volume, decoder, pool=pool)
+    self.batcher = DynamicBatcher(_run_batch, max_batch_size, max_wait_ms)
+
+  def server_close(self):
+    BaseHTTPServer.HTTPServer.server_close(self)
+    self.batcher.stop()
+
+def main(argv=None):
+  graph, image_tensor, output_tensor = load_inference_graph(FLAGS.inference_graph)
+  decoder = build_decoder(FLAGS.mask_parameterization_inf,
+                          FLAGS.log_anchors_inf, FLAGS.encoding_type_inf)
+  pool = ThreadPool(FLAGS.post_processing_threads_inf)
+  with tf.Session(graph=graph) as sess:
+    server = InferenceServer(
+        (FLAGS.host, FLAGS.port), sess, image_tensor, output_tensor, decoder,
+        class_names(), FLAGS.max_batch_size, FLAGS.max_wait_ms, pool)
+    print('Serving {} on http://{}:{}'.format(
+        FLAGS.inference_graph, FLAGS.host, FLAGS.port))
+    try:
+      server.serve_forever()
+    except KeyboardInterrupt:
+      pass
+    finally:
+      server.server_close()
+      print(json.dumps(server.batcher.metrics(), indent=2, sort_keys=True))
+  pool.close()
+
+if __name__ == '__main__':
+  tf.app.run()
@@ -0,0 +1,117 @@
+"""Load generator for the local inference server.
+
+Sends the images of --input_path, in turn, to the /detect endpoint of a
+running inference_server.py from --concurrency client threads, each sending
+its next request as soon as the previous one is answered. For every
+concurrency level the throughput, the client side latency percentiles and the
+mean size of the batches the server formed meanwhile, from the difference of
+its /metrics, are printed, e.g.
+
+  python ./src/load_generator.py --input_path=$INP_DIR/*.png \
+      --concurrency=1,2,4,8,16 --num_requests=500
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import glob
+import json
+import threading
+import time
+
+import numpy as np
+import tensorflow as tf
+from six.moves.urllib import request as urllib_request
+
+FLAGS = tf.app.flags.FLAGS
+
+tf.app.flags.DEFINE_string('server_url', 'http://127.0.0.1:8500',
+                           """URL of the inference server.""")
+tf.app.flags.DEFINE_string('input_path', './data/sample.png',
+                           """Glob of the images to send.""")
+tf.app.flags.DEFINE_string('concurrency', '1,2,4,8,16',
+                           """Comma-separated list of numbers of client threads.""")
+tf.app.flags.DEFINE_integer('num_requests', 500,
+                            """Number of requests per concurrency level.""")
+tf.app.flags.DEFINE_integer('num_warmup', 10,
+                            """Number of untimed requests before the first level.""")
+
+def _get_json(url, data=None):
+  headers = {'Content-Type': 'application/octet-stream'} if data else {}
+  response = urllib_request.urlopen(urllib_request.Request(url, data, headers))
+  try:
+    return json.loads(response.read().decode('utf-8'))
+  finally:
+    response.close()
+
+def _batch_counts(metrics):
+  return dict((int(size), n) for size, n in metrics['batch_sizes'].items())
+
+def run_load(url, images, concurrency, num_requests):
+  """Send num_requests images from concurrency threads.
+
+  Returns:
+    list of the latencies in seconds of the answered requests, the number of
+    failed requests and the wall time in seconds.
+  """
+  lock = threading.Lock()
+  counter = [0]
+  latencies, errors = [], [0]
+
+  def _client():
+    while True:
+      with lock:
+        i = counter[0]
+        counter[0] += 1
+      if i >= num_requests:
+        return
+      start = time.time()
+      try:
+        _get_json(url, images[i % len(images)])
+      except Exception:
+        with lock:
+          errors[0] += 1
+        continue
+      with lock:
+        latencies.append(time.time()-start)
+
+  threads = [threading.Thread(target=_client) for _ in range(concurrency)]
+  start = time.time()
+  for thread in threads:
+    thread.start()
+  for thread in threads:
+    thread.join()
+  return latencies, errors[0], time.time()-start
+
+def main(argv=None):
+  image_paths = sorted(glob.glob(FLAGS.input_path))
+  assert len(image_paths) > 0, 'No image found at {}'.format(FLAGS.input_path)
+  images = []
+  for path in image_paths:
+    with open(path, 'rb') as f:
+      images.append(f.read())
+  detect_url = FLAGS.server_url.rstrip('/')+'/detect'
+  metrics_url = FLAGS.server_url.rstrip('/')+'/metrics'
+  print('{} images, {} requests per level'.format(len(images), FLAGS.num_requests))
+
+  run_load(detect_url, images, 1, FLAGS.num_warmup)
+  print('{:>8s} {:>10s} {:>10s} {:>10s} {:>10s} {:>10s} {:>7s} {:>7s}'.format(
+      'clients', 'req/s', 'mean ms', 'p50 ms', 'p90 ms', 'p99 ms', 'batch',
+      'errors'))
+  for concurrency in [int(c) for c in FLAGS.concurrency.split(',')]:
+    before = _batch_counts(_get_json(metrics_url))
+    latencies, errors, seconds = run_load(
+        detect_url, images, concurrency, FLAGS.num_requests)
+    after = _batch_counts(_get_json(metrics_url))
+    batches = dict((size, n - before.get(size, 0)) for size, n in after.items())
+    mean_batch = float(sum(size*n for size, n in batches.items())) \
+        / max(sum(batches.values()), 1)
+    latencies = 1000*np.array(latencies or [np.nan])
+    print('{:8d} {:10.2f} {:10.2f} {:10.2f} {:10.2f} {:10.2f} {:7.2f} {:7d}'.format(
+        concurrency, (FLAGS.num_requests-errors)/seconds, np.mean(latencies),
+        np.percentile(latencies, 50), np.percentile(latencies, 90),
+        np.percentile(latencies, 99), mean_batch, errors))
+
+if __name__ == '__main__':
+  tf.app.run()
@@ -0,0 +1,143 @@
+"""Detect objects in several video streams with one shared session.
+
+Every source of --input_paths, a video file, a glob of images, a camera index
+or a stream URL, is read and pre-processed in its own capture thread. A
+MultiStreamScheduler forms batches of the frames of all streams, fairly, and
+runs them through a single frozen inference graph in one session, so that
+the model is loaded once however many streams there are. The detections of
+every stream go to its own sink: a record file
+<out_dir>/stream_<i>.<--record_format>, as written by inference.py with
+--detections_file_inf, or with --write_to_disk the rendered frames in
+<out_dir>/stream_<i>/. Cameras and streams drop frames when the network
+falls behind, files do not, see --frame_drop_policy.
+
+  python ./src/multi_stream_inference.py --inference_graph=$GRAPH \
+      --input_paths=0,1,$VIDEO,"$INP_DIR/*.png" --dataset_inf=CITYSCAPE \
+      --log_anchors_inf --out_dir=$RES_DIR
+
+The graph needs a dynamic batch dimension, as exported by
+export_inference_graph.py.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import threading
+from multiprocessing.pool import ThreadPool
+
+import cv2
+import numpy as np
+import tensorflow as tf
+
+from inference import (build_decoder, class_names, frame_drop_policy,
+                       image_size, load_inference_graph, postprocess_batch,
+                       preprocess_frame, read_frames)
+from train import _draw_box
+from utils.detection_records import DetectionRecordWriter
+from utils.scheduler import MultiStreamScheduler
+
+FLAGS = tf.app.flags.FLAGS
+
+tf.app.flags.DEFINE_string(
+    'input_paths', '',
+    """Comma-separated list of the sources of the streams: videos, globs of """
+    """images, camera indices or stream URLs.""")
+tf.app.flags.DEFINE_integer('max_batch_size', 0,
+                            """Maximum number of frames per session run, 0 for one """
+                            """frame of every stream.""")
+tf.app.flags.DEFINE_string('record_format', 'bin',
+                           """'jsonl' or 'bin', format of the record files of the streams.""")
+tf.app.flags.DEFINE_integer('max_frames', 0,
+                            """Maximum number of frames per stream, 0 for all.""")
+
+def _stream_source(input_path, keep_images):
+  """Pre-processed frames of a source, read in its capture thread."""
+  for frame_id, _, img in read_frames(input_path):
+    if FLAGS.max_frames and frame_id >= FLAGS.max_frames:
+      break
+    image_np_orig, image = preprocess_frame(img)
+    yield frame_id, image_np_orig if keep_images else None, image
+
+def _record_sink(index):
+  path = os.path.join(FLAGS.out_dir, 'stream_{}.{}'.format(
+      index, FLAGS.record_format))
+  writer = DetectionRecordWriter(path, class_names(),
+                                 FLAGS.mask_parameterization_inf, image_size())
+  def _sink(output):
+    frame_id, _, boxes, probs, classes = output
+    writer.write(frame_id, '{:06d}.png'.format(frame_id), boxes, probs, classes)
+  return _sink, writer.close
+
+def _frame_sink(index):
+  out_dir = os.path.join(FLAGS.out_dir, 'stream_{}'.format(index))
+  if not tf.gfile.Exists(out_dir):
+    tf.gfile.MakeDirs(out_dir)
+  names = class_names()
+  def _sink(output):
+    frame_id, image_np_orig, boxes, probs, classes = output
+    _draw_box(
+        image_np_orig, boxes,
+        [names[idx]+': (%.2f)'% prob for idx, prob in zip(classes, probs)],
+        (0, 0, 255), draw_masks=(FLAGS.mask_parameterization_inf == 8))
+    cv2.imwrite(os.path.join(out_dir, '{:06d}.png'.format(frame_id)), image_np_orig)
+  return _sink, lambda: None
+
+def run_streams():
+  input_paths = [p for p in FLAGS.input_paths.split(',') if p]
+  assert len(input_paths) > 0, 'No input stream given'
+  graph, image_tensor, output_tensor = load_inference_graph(FLAGS.inference_graph)
+  assert len(input_paths) == 1 or image_tensor.get_shape()[0].value is None, \
+      'Several streams need a graph with a dynamic batch dimension'
+  decoder = build_decoder(FLAGS.mask_parameterization_inf,
+                          FLAGS.log_anchors_inf, FLAGS.encoding_type_inf)
+  pool = ThreadPool(FLAGS.post_processing_threads_inf)
+
+  sources, sinks, closers = [], [], []
+  for i, input_path in enumerate(input_paths):
+    sources.append(_stream_source(input_path, FLAGS.write_to_disk))
+    sink, close = _frame_sink(i) if FLAGS.write_to_disk else _record_sink(i)
+    sinks.append(sink)
+    closers.append(close)
+  policies = [frame_drop_policy(p) for p in input_paths]
+  for i, (input_path, policy) in enumerate(zip(input_paths, policies)):
+    print('Stream {}: {} ({})'.format(i, input_path, policy))
+
+  with tf.Session(graph=graph) as sess:
+    def _run_batch(frames):
+      output_volume = sess.run(output_tensor, feed_dict={
+          image_tensor: np.concatenate([image for _, _, image in frames])})
+      detections = postprocess_batch(output_volume, decoder, pool=pool)
+      return [(frame_id, image_np_orig) + tuple(det) for (frame_id, image_np_orig, _), det
+              in zip(frames, detections)]
+
+    scheduler = MultiStreamScheduler(
+        sources, sinks, _run_batch, FLAGS.max_batch_size, FLAGS.queue_size_inf,
+        policies)
+    finished = threading.Event()
+    def _report():
+      while not finished.wait(FLAGS.stats_interval_inf):
+        print(scheduler.report())
+    if FLAGS.stats_interval_inf > 0:
+      reporter = threading.Thread(target=_report)
+      reporter.daemon = True
+      reporter.start()
+    try:
+      scheduler.run()
+    except KeyboardInterrupt:
+      pass
+    finally:
+      finished.set()
+      for close in closers:
+        close()
+      pool.close()
+    print(scheduler.report())
+
+def main(argv=None):
+  if not tf.gfile.Exists(FLAGS.out_dir):
+    tf.gfile.MakeDirs(FLAGS.out_dir)
+  run_streams()
+
+if __name__ == '__main__':
+  tf.app.run()
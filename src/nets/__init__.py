@@ -3,3 +3,6 @@ from .squeezeDetPlus import SqueezeDetPlus
 from .resnet50_convDet import ResNet50ConvDet
 from .vgg16_convDet import VGG16ConvDet
 from .squeezeDet_inference import SqueezeDet_inf
+from .squeezeDetPlus_inference import SqueezeDetPlus_inf
+from .resnet50_convDet_inference import ResNet50ConvDet_inf
+from .vgg16_convDet_inference import VGG16ConvDet_inf
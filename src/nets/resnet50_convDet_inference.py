@@ -0,0 +1,22 @@
+"""ResNet50+ConvDet model for inference"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import tensorflow as tf
+from nn_skeleton import ModelSkeleton
+from .resnet50_convDet import ResNet50ConvDet
+
+class ResNet50ConvDet_inf(ResNet50ConvDet):
+  """ResNet50+ConvDet without the training inputs, loss and optimizer. Accepts images
+  of any batch size and resolution."""
+  def __init__(self, mc, gpu_id=0):
+    with tf.device('/gpu:{}'.format(gpu_id)):
+      ModelSkeleton.__init__(self, mc, inference_only=True)
+
+      self._add_forward_graph()
+      if mc.IN_GRAPH_POST_PROCESSING:
+        # detections can only be decoded at the configured input resolution
+        self._add_interpretation_graph(mc.CONF_TOP_K)
+        self._add_post_processing_graph()
@@ -9,8 +9,8 @@ from __future__ import print_function
 import os
 import sys
 
-import joblib
 from utils import util
+from utils.weights import load_pretrained_weights
 from easydict import EasyDict as edict
 import numpy as np
 import tensorflow as tf
@@ -39,7 +39,7 @@ class SqueezeDet(ModelSkeleton):
       assert tf.gfile.Exists(mc.PRETRAINED_MODEL_PATH), \
           'Cannot find pretrained model at the given path:' \
           '  {}'.format(mc.PRETRAINED_MODEL_PATH)
-      self.caffemodel_weight = joblib.load(mc.PRETRAINED_MODEL_PATH)
+      self.caffemodel_weight = load_pretrained_weights(mc.PRETRAINED_MODEL_PATH)
 
     conv1 = self._conv_layer(
         'conv1', self.image_input, filters=64, size=3, stride=2,
@@ -96,6 +96,10 @@ class SqueezeDet(ModelSkeleton):
     Returns:
       fire layer operation.
     """
+    mc = self.mc
+    if layer_name in mc.FIRE_MODULE_FILTERS:
+      # pruned architecture
+      s1x1, e1x1, e3x3 = mc.FIRE_MODULE_FILTERS[layer_name]
 
     sq1x1 = self._conv_layer(
         layer_name+'/squeeze1x1', inputs, filters=s1x1, size=1, stride=1,
@@ -9,8 +9,8 @@ from __future__ import print_function
 import os
 import sys
 
-import joblib
 from utils import util
+from utils.weights import load_pretrained_weights
 from easydict import EasyDict as edict
 import numpy as np
 import tensorflow as tf
@@ -40,7 +40,7 @@ class VGG16ConvDet(ModelSkeleton):
       assert tf.gfile.Exists(mc.PRETRAINED_MODEL_PATH), \
           'Cannot find pretrained model at the given path:' \
           '  {}'.format(mc.PRETRAINED_MODEL_PATH)
-      self.caffemodel_weight = joblib.load(mc.PRETRAINED_MODEL_PATH)
+      self.caffemodel_weight = load_pretrained_weights(mc.PRETRAINED_MODEL_PATH)
 
     with tf.variable_scope('conv1') as scope:
       conv1_1 = self._conv_layer(
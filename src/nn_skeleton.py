@@ -8,8 +8,10 @@ from __future__ import print_function
 
 import os
 import sys
+from multiprocessing.pool import ThreadPool
 
 from utils import util
+from utils import polygon
 from easydict import EasyDict as edict
 import numpy as np
 import tensorflow as tf
@@ -71,8 +73,17 @@ def _variable_with_weight_decay(name, shape, wd, initializer, trainable=True):
 
 class ModelSkeleton:
   """Base class of NN detection models."""
-  def __init__(self, mc):
+  def __init__(self, mc, inference_only=False):
+    """Set up the inputs of the model.
+
+    Args:
+      mc: model configuration.
+      inference_only: if true, only create an image placeholder of any batch
+          size and resolution, without the training inputs and queues.
+    """
     self.mc = mc
+    # threads of filter_batch_prediction, started on first use
+    self._post_processing_pool = None
     # a scalar tensor in range (0, 1]. Usually set to 0.5 in training phase and
     # 1.0 in evaluation phase
     # self.keep_prob = 0.5 if mc.IS_TRAINING else 1.0
@@ -81,6 +92,25 @@ class ModelSkeleton:
     else:
       self.num_mask_params = 4
     print("Number of mask params:", self.num_mask_params)
+
+    # model parameters
+    self.model_params = []
+
+    # model size counter
+    self.model_size_counter = [] # array of tuple of layer name, parameter size
+    # flop counter
+    self.flop_counter = [] # array of tuple of layer name, flop number
+    # activation counter
+    self.activation_counter = [] # array of tuple of layer name, output activations
+    self.activation_counter.append(('input', mc.IMAGE_WIDTH*mc.IMAGE_HEIGHT*3))
+
+    if inference_only:
+      # dropout is a no-op with a constant keep probability of 1
+      self.keep_prob = 1.0
+      self.image_input = tf.placeholder(
+          tf.float32, [None, None, None, 3], name='image_input')
+      return
+
     self.keep_prob = tf.placeholder_with_default(mc.DROP_OUT_PROB, shape=(), name='keep_prob') # So that we can disable dropout for validation
     # image batch input
     self.ph_image_input = tf.placeholder(
@@ -104,11 +134,21 @@ class ModelSkeleton:
     self.ph_edge_adhesions = tf.placeholder(
         tf.bool, [mc.BATCH_SIZE, mc.ANCHORS, self.num_mask_params], name='edge_adhesions')
 
-    # IOU between predicted anchors with ground-truth boxes
-    self.ious = tf.Variable(
-      initial_value=np.zeros((mc.BATCH_SIZE, mc.ANCHORS)), trainable=False,
-      name='iou', dtype=tf.float32
-    )
+    # IOU between predicted anchors with ground-truth boxes. Synchronous
+    # replicas each keep a local copy rather than sharing one on the parameter
+    # server.
+    if mc.NUM_REPLICAS > 1:
+      with tf.device(mc.WORKER_DEVICE):
+        self.ious = tf.Variable(
+          initial_value=np.zeros((mc.BATCH_SIZE, mc.ANCHORS)), trainable=False,
+          name='iou', dtype=tf.float32,
+          collections=[tf.GraphKeys.LOCAL_VARIABLES]
+        )
+    else:
+      self.ious = tf.Variable(
+        initial_value=np.zeros((mc.BATCH_SIZE, mc.ANCHORS)), trainable=False,
+        name='iou', dtype=tf.float32
+      )
 
     self.FIFOQueue = tf.FIFOQueue(
         capacity=mc.QUEUE_CAPACITY,
@@ -132,24 +172,22 @@ class ModelSkeleton:
             self.FIFOQueue.dequeue(), batch_size=mc.BATCH_SIZE,
             capacity=mc.QUEUE_CAPACITY) 
 
-    # model parameters
-    self.model_params = []
-
-    # model size counter
-    self.model_size_counter = [] # array of tuple of layer name, parameter size
-    # flop counter
-    self.flop_counter = [] # array of tuple of layer name, flop number
-    # activation counter
-    self.activation_counter = [] # array of tuple of layer name, output activations
-    self.activation_counter.append(('input', mc.IMAGE_WIDTH*mc.IMAGE_HEIGHT*3))
-
 
   def _add_forward_graph(self):
     """NN architecture specification."""
     raise NotImplementedError
 
-  def _add_interpretation_graph(self):
-    """Interpret NN output."""
+  def _add_interpretation_graph(self, conf_top_k=0):
+    """Interpret NN output.
+
+    Args:
+      conf_top_k: if positive, only the conf_top_k anchors of highest
+          confidence are decoded. The confidence is computed for all anchors
+          first and the class probabilities and boxes only for the kept ones,
+          whose indices are in self.anchor_idx. As the probability of a
+          detection is at most the confidence of its anchor, this only drops
+          detections less probable than the conf_top_k-th confidence.
+    """
     mc = self.mc
 
     with tf.variable_scope('interpret_output') as scope:
@@ -157,15 +195,9 @@ class ModelSkeleton:
 
       # probability
       num_class_probs = mc.ANCHOR_PER_GRID*mc.CLASSES
-      self.pred_class_probs = tf.reshape(
-          tf.nn.softmax(
-              tf.reshape(
-                  preds[:, :, :, :num_class_probs],
-                  [-1, mc.CLASSES]
-              )
-          ),
-          [mc.BATCH_SIZE, mc.ANCHORS, mc.CLASSES],
-          name='pred_class_probs'
+      class_logits = tf.reshape(
+          preds[:, :, :, :num_class_probs],
+          [-1, mc.ANCHORS, mc.CLASSES]
       )
       
       # confidence
@@ -173,7 +205,7 @@ class ModelSkeleton:
       self.pred_conf = tf.sigmoid(
           tf.reshape(
               preds[:, :, :, num_class_probs:num_confidence_scores],
-              [mc.BATCH_SIZE, mc.ANCHORS]
+              [-1, mc.ANCHORS]
           ),
           name='pred_confidence_score'
       )
@@ -181,12 +213,24 @@ class ModelSkeleton:
       # bbox_delta
       self.pred_box_delta = tf.reshape(
           preds[:, :, :, num_confidence_scores:],
-          [mc.BATCH_SIZE, mc.ANCHORS, self.num_mask_params],
+          [-1, mc.ANCHORS, self.num_mask_params],
           name='bbox_delta'
       )
 
-      # number of object. Used to normalize bbox and classification loss
-      self.num_objects = tf.reduce_sum(self.input_mask, name='num_objects')
+      num_anchors = mc.ANCHORS
+      anchor_box = mc.ANCHOR_BOX
+      if conf_top_k > 0:
+        num_anchors = min(conf_top_k, mc.ANCHORS)
+        self.pred_conf, anchor_idx = tf.nn.top_k(
+            self.pred_conf, k=num_anchors, sorted=False)
+        self.anchor_idx = tf.identity(anchor_idx, name='anchor_idx')
+        class_logits = util.batch_gather(class_logits, anchor_idx)
+        self.pred_box_delta = util.batch_gather(self.pred_box_delta, anchor_idx)
+        anchor_box = tf.gather(
+            tf.constant(mc.ANCHOR_BOX, dtype=tf.float32), anchor_idx)
+
+      self.pred_class_probs = tf.nn.softmax(
+          class_logits, name='pred_class_probs')
 
     with tf.variable_scope('bbox') as scope:
       with tf.variable_scope('stretching'):
@@ -207,13 +251,14 @@ class ModelSkeleton:
             delta_xmin, delta_ymin, delta_xmax, delta_ymax = tf.unstack(
                 self.pred_box_delta, axis=2)
 
-        anchor_x = mc.ANCHOR_BOX[:, 0]
-        anchor_y = mc.ANCHOR_BOX[:, 1]
-        anchor_w = mc.ANCHOR_BOX[:, 2]
-        anchor_h = mc.ANCHOR_BOX[:, 3]
+        anchor_x = anchor_box[..., 0]
+        anchor_y = anchor_box[..., 1]
+        anchor_w = anchor_box[..., 2]
+        anchor_h = anchor_box[..., 3]
 
         if mc.ENCODING_TYPE == 'asymmetric_linear':
-          xmins_a, ymins_a, xmaxs_a, ymaxs_a = util.bbox_transform(np.transpose(mc.ANCHOR_BOX))
+          xmins_a, ymins_a, xmaxs_a, ymaxs_a = util.bbox_transform(
+              [anchor_x, anchor_y, anchor_w, anchor_h])
           xmins = tf.identity(xmins_a + delta_xmin * anchor_w, name='bbox_xmin_uncropped') 
           ymins = tf.identity(ymins_a + delta_ymin * anchor_h, name='bbox_ymin_uncropped') 
           xmaxs = tf.identity(xmaxs_a + delta_xmax * anchor_w, name='bbox_xmax_uncropped') 
@@ -259,7 +304,7 @@ class ModelSkeleton:
 
         if self.mc.EIGHT_POINT_REGRESSION:
           EPSILON = 1e-8
-          anchor_diag = (mc.ANCHOR_BOX[:, 2]**2 + mc.ANCHOR_BOX[:, 3]**2)**(0.5)
+          anchor_diag = (anchor_w**2 + anchor_h**2)**(0.5)
           box_of1= tf.identity(
             (anchor_diag * util.safe_exp(delta_of1, mc.EXP_THRESH))-EPSILON,
             name='bbox_of1')
@@ -329,6 +374,98 @@ class ModelSkeleton:
               (1, 2, 0), name='bbox'
           )
 
+    with tf.variable_scope('probability') as scope:
+      self._activation_summary(self.pred_class_probs, 'class_probs')
+
+      probs = tf.multiply(
+          self.pred_class_probs,
+          tf.reshape(self.pred_conf, [-1, num_anchors, 1]),
+          name='final_class_prob'
+      )
+
+      self._activation_summary(probs, 'final_class_prob')
+
+      self.det_probs = tf.reduce_max(probs, 2, name='score')
+      self.det_class = tf.argmax(probs, 2, name='class_idx')
+
+  def _add_post_processing_graph(self):
+    """Filter the interpreted detections in the graph. Keeps the
+    mc.TOP_N_DETECTION most probable boxes, suppresses overlapping boxes of the
+    same class with NMS (or decays their scores with soft-NMS if mc.SOFT_NMS is
+    set) and drops boxes with probability below mc.PROB_THRESH. Outputs are
+    padded to mc.TOP_N_DETECTION detections per image, valid detections first
+    and ordered by probability.
+    """
+    mc = self.mc
+    assert mc.TOP_N_DETECTION > 0, \
+        'In-graph post-processing needs TOP_N_DETECTION > 0'
+    # only the anchors of highest confidence are interpreted with CONF_TOP_K
+    num_candidates = min(mc.TOP_N_DETECTION, self.det_probs.get_shape()[1].value)
+
+    with tf.variable_scope('post_processing') as scope:
+      probs, order = tf.nn.top_k(self.det_probs, k=num_candidates, sorted=True)
+      boxes = util.batch_gather(self.det_boxes, order)
+      cls_idx = util.batch_gather(self.det_class, order)
+
+      # only boxes of the same class suppress each other
+      same_class = tf.to_float(
+          tf.equal(tf.expand_dims(cls_idx, 2), tf.expand_dims(cls_idx, 1)))
+      ious = util.tensor_pairwise_iou(boxes[:, :, :4]) * same_class
+
+      if mc.SOFT_NMS:
+        # repeatedly select the most probable remaining box and decay the
+        # probabilities of the remaining boxes overlapping it
+        remaining = tf.ones_like(probs)
+        for _ in range(num_candidates):
+          best = tf.one_hot(
+              tf.argmax(tf.where(remaining > 0, probs, -tf.ones_like(probs)),
+                        axis=1),
+              num_candidates)
+          remaining -= best
+          best_ious = tf.reduce_sum(ious * tf.expand_dims(best, 2), axis=1)
+          if mc.SOFT_NMS_METHOD == 'linear':
+            decay = tf.where(best_ious > mc.NMS_THRESH, 1.0-best_ious,
+                             tf.ones_like(best_ious))
+          else:
+            decay = tf.exp(-tf.square(best_ious)/mc.SOFT_NMS_SIGMA)
+          probs *= remaining*decay + (1.0-remaining)
+        keep = probs > mc.PROB_THRESH
+      else:
+        # candidates are sorted by probability, so the strict upper triangle
+        # of the IOU matrix pairs every box with the more probable ones. As in
+        # util.nms, a box overlapping any more probable box is suppressed.
+        upper = tf.matrix_band_part(
+            tf.ones([num_candidates, num_candidates]), 0, -1) \
+            - tf.eye(num_candidates)
+        suppressed = tf.reduce_any(ious*upper > mc.NMS_THRESH, axis=1)
+        keep = tf.logical_and(
+            tf.logical_not(suppressed), probs > mc.PROB_THRESH)
+
+      # move kept detections to the front, most probable first
+      _, order = tf.nn.top_k(
+          tf.where(keep, probs, -tf.ones_like(probs)), k=num_candidates,
+          sorted=True)
+      keep = util.batch_gather(keep, order)
+      mask = tf.to_float(keep)
+
+      self.final_boxes = tf.multiply(
+          util.batch_gather(boxes, order), tf.expand_dims(mask, 2),
+          name='boxes')
+      self.final_probs = tf.multiply(
+          util.batch_gather(probs, order), mask, name='probs')
+      cls_idx = util.batch_gather(cls_idx, order)
+      self.final_class = tf.where(
+          keep, cls_idx, -tf.ones_like(cls_idx), name='class_idx')
+      self.num_detections = tf.reduce_sum(
+          tf.to_int32(keep), axis=1, name='num_detections')
+
+  def _add_loss_graph(self):
+    """Define the loss operation."""
+    mc = self.mc
+
+    # number of object. Used to normalize bbox and classification loss
+    self.num_objects = tf.reduce_sum(self.input_mask, name='num_objects')
+
     with tf.variable_scope('IOU'):
       def _tensor_iou(box1, box2):
         with tf.variable_scope('intersection'):
@@ -364,24 +501,6 @@ class ModelSkeleton:
       )
       self._activation_summary(self.ious, 'conf_score')
 
-    with tf.variable_scope('probability') as scope:
-      self._activation_summary(self.pred_class_probs, 'class_probs')
-
-      probs = tf.multiply(
-          self.pred_class_probs,
-          tf.reshape(self.pred_conf, [mc.BATCH_SIZE, mc.ANCHORS, 1]),
-          name='final_class_prob'
-      )
-
-      self._activation_summary(probs, 'final_class_prob')
-
-      self.det_probs = tf.reduce_max(probs, 2, name='score')
-      self.det_class = tf.argmax(probs, 2, name='class_idx')
-
-  def _add_loss_graph(self):
-    """Define the loss operation."""
-    mc = self.mc
-
     with tf.variable_scope('class_regression') as scope:
       # cross-entropy: q * -log(p) + (1-q) * -log(1-p)
       # add a small value into log to prevent blowing up
@@ -450,6 +569,12 @@ class ModelSkeleton:
     _add_loss_summaries(self.loss)
 
     opt = tf.train.MomentumOptimizer(learning_rate=self.lr, momentum=mc.MOMENTUM)
+    if mc.NUM_REPLICAS > 1:
+      # aggregate the gradients of all replicas before every update
+      opt = tf.train.SyncReplicasOptimizer(
+          opt, replicas_to_aggregate=mc.NUM_REPLICAS,
+          total_num_replicas=mc.NUM_REPLICAS)
+      self.sync_opt = opt
     grads_vars = opt.compute_gradients(self.loss, tf.trainable_variables())
 
     with tf.variable_scope('clip_gradient') as scope:
@@ -511,7 +636,7 @@ class ModelSkeleton:
 
       if mc.LOAD_PRETRAINED_MODEL:
         cw = self.caffemodel_weight
-        kernel_val = np.transpose(cw[conv_param_name][0], [2,3,1,0])
+        kernel_val = cw[conv_param_name][0]
         if conv_with_bias:
           bias_val = cw[conv_param_name][1]
         mean_val   = cw[bn_param_name][0]
@@ -528,8 +653,6 @@ class ModelSkeleton:
         gamma_val  = tf.constant_initializer(1.0)
         beta_val   = tf.constant_initializer(0.0)
 
-      # re-order the caffe kernel with shape [out, in, h, w] -> tf kernel with
-      # shape [h, w, in, out]
       kernel = _variable_with_weight_decay(
           'kernels', shape=[size, size, int(channels), filters],
           wd=mc.WEIGHT_DECAY, initializer=kernel_val, trainable=(not freeze))
@@ -556,13 +679,19 @@ class ModelSkeleton:
           conv, mean=mean, variance=var, offset=beta, scale=gamma,
           variance_epsilon=mc.BATCH_NORM_EPSILON, name='batch_norm')
 
-      if mc.IS_TRAINING:
-        self.model_size_counter.append(
-            (conv_param_name, (1+size*size*int(channels))*filters)
-        )
+      # the bias only exists if conv_with_bias, batch norm adds gamma, beta,
+      # mean and var, and a scale and an offset per output
+      num_params = size*size*int(channels)*filters + 4*filters
+      if conv_with_bias:
+        num_params += filters
+      self.model_size_counter.append((conv_param_name, num_params))
+      # flops and activations are only known for a fixed input resolution
+      if conv.get_shape()[1:].is_fully_defined():
         out_shape = conv.get_shape().as_list()
         num_flops = \
-          (1+2*int(channels)*size*size)*filters*out_shape[1]*out_shape[2]
+          (2+2*int(channels)*size*size)*filters*out_shape[1]*out_shape[2]
+        if conv_with_bias:
+          num_flops += filters*out_shape[1]*out_shape[2]
         if relu:
           num_flops += 2*filters*out_shape[1]*out_shape[2]
         self.flop_counter.append((conv_param_name, num_flops))
@@ -602,7 +731,7 @@ class ModelSkeleton:
     if mc.LOAD_PRETRAINED_MODEL:
       cw = self.caffemodel_weight
       if layer_name in cw:
-        kernel_val = np.transpose(cw[layer_name][0], [2,3,1,0])
+        kernel_val = cw[layer_name][0]
         bias_val = cw[layer_name][1]
         # check the shape
         if (kernel_val.shape == 
@@ -622,8 +751,7 @@ class ModelSkeleton:
     with tf.variable_scope(layer_name) as scope:
       channels = inputs.get_shape()[3]
 
-      # re-order the caffe kernel with shape [out, in, h, w] -> tf kernel with
-      # shape [h, w, in, out]
+      # pretrained kernels are already in the tf layout [h, w, in, out]
       if use_pretrained_param:
         if mc.DEBUG_MODE:
           print ('Using pretrained model for {}'.format(layer_name))
@@ -655,10 +783,11 @@ class ModelSkeleton:
       else:
         out = conv_bias
 
-      if mc.IS_TRAINING:
-        self.model_size_counter.append(
-            (layer_name, (1+size*size*int(channels))*filters)
-        )
+      self.model_size_counter.append(
+          (layer_name, (1+size*size*int(channels))*filters)
+      )
+      # flops and activations are only known for a fixed input resolution
+      if out.get_shape()[1:].is_fully_defined():
         out_shape = out.get_shape().as_list()
         num_flops = \
           (1+2*int(channels)*size*size)*filters*out_shape[1]*out_shape[2]
@@ -690,8 +819,10 @@ class ModelSkeleton:
                             ksize=[1, size, size, 1], 
                             strides=[1, stride, stride, 1],
                             padding=padding)
-      if mc.IS_TRAINING:
+      # one comparison per element of the pooling window
+      if out.get_shape()[1:].is_fully_defined():
         activation_size = np.prod(out.get_shape().as_list()[1:])
+        self.flop_counter.append((layer_name, size*size*activation_size))
         self.activation_counter.append((layer_name, activation_size))
       return out
 
@@ -736,15 +867,17 @@ class ModelSkeleton:
         if use_pretrained_param:
           try:
             # check the size before layout transform
-            assert kernel_val.shape == (hiddens, dim), \
+            assert kernel_val.shape == (dim, hiddens), \
                 'kernel shape error at {}'.format(layer_name)
+            # the inputs of the pretrained kernel are flattened in the caffe
+            # order
             kernel_val = np.reshape(
                 np.transpose(
                     np.reshape(
-                        kernel_val, # O x (C*H*W)
-                        (hiddens, input_shape[3], input_shape[1], input_shape[2])
-                    ), # O x C x H x W
-                    (2, 3, 1, 0)
+                        kernel_val, # (C*H*W) x O
+                        (input_shape[3], input_shape[1], input_shape[2], hiddens)
+                    ), # C x H x W x O
+                    (1, 2, 0, 3)
                 ), # H x W x C x O
                 (dim, -1)
             ) # (H*W*C) x O
@@ -760,7 +893,6 @@ class ModelSkeleton:
         dim = input_shape[1]
         if use_pretrained_param:
           try:
-            kernel_val = np.transpose(kernel_val, (1,0))
             assert kernel_val.shape == (dim, hiddens), \
                 'kernel shape error at {}'.format(layer_name)
           except:
@@ -805,7 +937,7 @@ class ModelSkeleton:
 
   def filter_prediction(self, boxes, probs, cls_idx):
     """Filter bounding box predictions with probability threshold and
-    non-maximum supression.
+    non-maximum supression, or soft-NMS if mc.SOFT_NMS is set.
 
     Args:
       boxes: array of [cx, cy, w, h].
@@ -829,18 +961,80 @@ class ModelSkeleton:
       boxes = boxes[filtered_idx]
       cls_idx = cls_idx[filtered_idx]
 
+    return self._suppress_overlaps(boxes, probs, cls_idx)
+
+  def filter_batch_prediction(self, boxes, probs, cls_idx):
+    """Filter the bounding box predictions of a batch of images like
+    filter_prediction, up to the order of equal probabilities. The top-N
+    selection and probability threshold are applied to the whole batch at once
+    and the NMS of the images runs on mc.NUM_POST_PROCESSING_THREADS threads.
+
+    Args:
+      boxes: [batch, ANCHORS, num_mask_params] array of boxes.
+      probs: [batch, ANCHORS] array of probabilities
+      cls_idx: [batch, ANCHORS] array of class indices
+    Returns:
+      list of (final_boxes, final_probs, final_cls_idx) of every image, as
+      returned by filter_prediction.
+    """
+    mc = self.mc
+    boxes, probs, cls_idx = np.asarray(boxes), np.asarray(probs), \
+        np.asarray(cls_idx)
+
+    if mc.TOP_N_DETECTION < probs.shape[1] and mc.TOP_N_DETECTION > 0:
+      # partition out the top-N of every image and only sort those
+      rows = np.arange(len(probs))[:, None]
+      order = np.argpartition(probs, -mc.TOP_N_DETECTION, axis=1)[
+          :, -mc.TOP_N_DETECTION:]
+      order = order[rows, probs[rows, order].argsort(axis=1)[:, ::-1]]
+      candidates = zip(boxes[rows, order], probs[rows, order],
+                       cls_idx[rows, order])
+    else:
+      above = probs > mc.PROB_THRESH
+      candidates = [(b[a], p[a], c[a])
+                    for b, p, c, a in zip(boxes, probs, cls_idx, above)]
+
+    candidates = list(candidates)
+    if len(candidates) < 2 or mc.NUM_POST_PROCESSING_THREADS < 2:
+      return [self._suppress_overlaps(*c) for c in candidates]
+    if self._post_processing_pool is None:
+      self._post_processing_pool = ThreadPool(mc.NUM_POST_PROCESSING_THREADS)
+    return self._post_processing_pool.map(
+        lambda c: self._suppress_overlaps(*c), candidates)
+
+  def close(self):
+    """Stop the threads of filter_batch_prediction, it starts new ones if it
+    is called again."""
+    if self._post_processing_pool is not None:
+      self._post_processing_pool.close()
+      self._post_processing_pool.join()
+      self._post_processing_pool = None
+
+  def _suppress_overlaps(self, boxes, probs, cls_idx):
+    """NMS or soft-NMS of the candidate boxes of an image, returns the kept
+    boxes, probabilities and class indices ordered by class."""
+    mc = self.mc
+
     final_boxes = []
     final_probs = []
     final_cls_idx = []
 
+    octagons = mc.EIGHT_POINT_REGRESSION and mc.OCTAGON_NMS
+    if mc.SOFT_NMS:
+      probs = util.soft_nms(
+          boxes, probs, mc.SOFT_NMS_SIGMA, mc.SOFT_NMS_METHOD, mc.NMS_THRESH,
+          mc.PROB_THRESH, cls_idx,
+          iou_fn=polygon.pairwise_octagon_iou if octagons else None)
+      keep = probs > mc.PROB_THRESH
+    else:
+      keep = util.sweep_nms(
+          boxes, probs, mc.NMS_THRESH, cls_idx,
+          iou_fn=polygon.octagon_iou if octagons else None)
     for c in range(mc.CLASSES):
-      idx_per_class = [i for i in range(len(probs)) if cls_idx[i] == c]
-      keep = util.nms(boxes[idx_per_class], probs[idx_per_class], mc.NMS_THRESH)
-      for i in range(len(keep)):
-        if keep[i]:
-          final_boxes.append(boxes[idx_per_class[i]])
-          final_probs.append(probs[idx_per_class[i]])
-          final_cls_idx.append(c)
+      for i in np.nonzero(keep & (cls_idx == c))[0]:
+        final_boxes.append(boxes[i])
+        final_probs.append(probs[i])
+        final_cls_idx.append(c)
     return final_boxes, final_probs, final_cls_idx
 
   def _activation_summary(self, x, layer_name):
@@ -0,0 +1,208 @@
+"""Per-layer latency profile and static cost of a detection model.
+
+Builds the forward graph of a net at the given resolution and batch size, runs
+it on random images on the local CPU and traces every run. The execution time
+of the ops is summed up per layer scope and reported next to the flops,
+parameters and activation size counted by the model while it was built, e.g.
+
+  python ./src/profile_model.py --net=squeezeDet --image_width=624 \\
+      --image_height=192 --batch_size=1
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import json
+import os
+import time
+
+import numpy as np
+import tensorflow as tf
+
+from config import *
+from nets import *
+from nn_skeleton import ModelSkeleton
+
+FLAGS = tf.app.flags.FLAGS
+
+tf.app.flags.DEFINE_string('dataset', 'KITTI',
+                           """Currently only support KITTI and CITYSCAPE datasets.""")
+tf.app.flags.DEFINE_string('net', 'squeezeDet',
+                           """Neural net architecture.""")
+tf.app.flags.DEFINE_integer('image_width', 0,
+                            """Input width, 0 uses the one of the config.""")
+tf.app.flags.DEFINE_integer('image_height', 0,
+                            """Input height, 0 uses the one of the config.""")
+tf.app.flags.DEFINE_integer('batch_size', 1, """Number of images per run.""")
+tf.app.flags.DEFINE_integer('num_runs', 20,
+                            """Number of timed and traced runs.""")
+tf.app.flags.DEFINE_integer('num_warmup', 3,
+                            """Number of runs before timing.""")
+tf.app.flags.DEFINE_integer('num_threads', 0,
+                            """Number of threads of an op, 0 lets tensorflow """
+                            """decide.""")
+tf.app.flags.DEFINE_string('architecture_config', '',
+                           """Json file with the fire module filters of a """
+                           """pruned squeezeDet or squeezeDet+ model.""")
+tf.app.flags.DEFINE_string('output_file', '',
+                           """Also write the report as csv to this file.""")
+tf.app.flags.DEFINE_integer('mask_parameterization', 4,
+                            """Bounding box is 4, octagonal mask is 8. Other values not supported.""")
+tf.app.flags.DEFINE_boolean('log_anchors', False, """Use Log domain extracted anchors ?""")
+tf.app.flags.DEFINE_string('encoding_type', 'normal',
+                            """what type of encoding to use""")
+
+def _model_config():
+  assert FLAGS.net == 'vgg16' or FLAGS.net == 'resnet50' \
+      or FLAGS.net == 'squeezeDet' or FLAGS.net == 'squeezeDet+', \
+      'Selected neural net architecture not supported: {}'.format(FLAGS.net)
+  assert FLAGS.dataset == 'KITTI' or FLAGS.dataset == 'CITYSCAPE', \
+      'Currently only support KITTI and CITYSCAPE datasets'
+
+  if FLAGS.net == 'vgg16':
+    if FLAGS.dataset == 'KITTI':
+      mc = kitti_vgg16_config(FLAGS.mask_parameterization, False, FLAGS.encoding_type)
+    elif FLAGS.dataset == 'CITYSCAPE':
+      mc = cityscape_vgg16_config(FLAGS.mask_parameterization, FLAGS.log_anchors, False, FLAGS.encoding_type)
+    net_class = VGG16ConvDet
+  elif FLAGS.net == 'resnet50':
+    if FLAGS.dataset == 'KITTI':
+      mc = kitti_res50_config(FLAGS.mask_parameterization, False, FLAGS.encoding_type)
+    elif FLAGS.dataset == 'CITYSCAPE':
+      mc = cityscape_res50_config(FLAGS.mask_parameterization, FLAGS.log_anchors, False, FLAGS.encoding_type)
+    net_class = ResNet50ConvDet
+  elif FLAGS.net == 'squeezeDet':
+    if FLAGS.dataset == 'KITTI':
+      mc = kitti_squeezeDet_config(FLAGS.mask_parameterization, False, FLAGS.encoding_type)
+    elif FLAGS.dataset == 'CITYSCAPE':
+      mc = cityscape_squeezeDet_config(FLAGS.mask_parameterization, FLAGS.log_anchors, False, FLAGS.encoding_type)
+    net_class = SqueezeDet
+  elif FLAGS.net == 'squeezeDet+':
+    if FLAGS.dataset == 'KITTI':
+      mc = kitti_squeezeDetPlus_config(FLAGS.mask_parameterization, False, FLAGS.encoding_type)
+    elif FLAGS.dataset == 'CITYSCAPE':
+      mc = cityscape_squeezeDetPlus_config(FLAGS.mask_parameterization, FLAGS.log_anchors, False, FLAGS.encoding_type)
+    net_class = SqueezeDetPlus
+
+  mc.LOAD_PRETRAINED_MODEL = False
+  mc.BATCH_SIZE = FLAGS.batch_size
+  if FLAGS.image_width > 0:
+    mc.IMAGE_WIDTH = FLAGS.image_width
+  if FLAGS.image_height > 0:
+    mc.IMAGE_HEIGHT = FLAGS.image_height
+  if FLAGS.architecture_config:
+    with open(FLAGS.architecture_config) as f:
+      mc.FIRE_MODULE_FILTERS = json.load(f)
+  return mc, net_class
+
+def _build_forward_graph(mc, net_class):
+  """Only build the forward graph of a net, the anchors of the config do not
+  need to match the resolution for it."""
+  model = net_class.__new__(net_class)
+  ModelSkeleton.__init__(model, mc)
+  model._add_forward_graph()
+  return model
+
+def _layer_scope(node_name, layer_names, cache):
+  """Name of the layer an op belongs to: the innermost layer of the model
+  whose scope contains the op, otherwise the scope of the op itself, like the
+  concatenation of a fire module or the residual connection of a ResNet
+  block."""
+  if node_name not in cache:
+    scope = '/'+node_name+'/'
+    matches = [l for l in layer_names if '/'+l+'/' in scope]
+    if matches:
+      cache[node_name] = max(matches, key=len)
+    elif '/' in node_name:
+      cache[node_name] = os.path.dirname(node_name)
+    else:
+      cache[node_name] = 'other'
+  return cache[node_name]
+
+def profile():
+  """Profile the forward graph of a net."""
+  mc, net_class = _model_config()
+  with tf.Graph().as_default():
+    model = _build_forward_graph(mc, net_class)
+
+    config = tf.ConfigProto(
+        device_count={'GPU': 0},
+        # ops run one after another, so that their times add up
+        inter_op_parallelism_threads=1,
+        intra_op_parallelism_threads=FLAGS.num_threads)
+    with tf.Session(config=config) as sess:
+      sess.run(tf.global_variables_initializer())
+      images = np.random.uniform(
+          -128, 128, [mc.BATCH_SIZE, mc.IMAGE_HEIGHT, mc.IMAGE_WIDTH, 3]
+      ).astype(np.float32)
+      feed_dict = {model.image_input: images, model.keep_prob: 1.0}
+
+      for _ in range(FLAGS.num_warmup):
+        sess.run(model.preds, feed_dict=feed_dict)
+
+      latencies = []
+      for _ in range(FLAGS.num_runs):
+        start = time.time()
+        sess.run(model.preds, feed_dict=feed_dict)
+        latencies.append((time.time()-start)*1000)
+
+      model_layers = [c[0] for c in model.activation_counter[1:]]
+      layer_names = list(model_layers)
+      layer_micros = {}
+      cache = {}
+      run_options = tf.RunOptions(trace_level=tf.RunOptions.FULL_TRACE)
+      for _ in range(FLAGS.num_runs):
+        run_metadata = tf.RunMetadata()
+        sess.run(model.preds, feed_dict=feed_dict, options=run_options,
+                 run_metadata=run_metadata)
+        for dev_stats in run_metadata.step_stats.dev_stats:
+          for node_stats in dev_stats.node_stats:
+            layer = _layer_scope(node_stats.node_name, model_layers, cache)
+            if layer not in layer_micros:
+              layer_micros[layer] = 0
+              if layer not in layer_names:
+                layer_names.append(layer)
+            layer_micros[layer] += \
+                node_stats.op_end_rel_micros - node_stats.op_start_rel_micros
+
+  params = dict(model.model_size_counter)
+  flops = dict(model.flop_counter)
+  activations = dict(model.activation_counter)
+  total_ms = sum(layer_micros.values())/1000.0/FLAGS.num_runs
+
+  rows = []
+  for layer in layer_names:
+    rows.append((
+        layer, layer_micros.get(layer, 0)/1000.0/FLAGS.num_runs,
+        flops.get(layer, 0)*mc.BATCH_SIZE, params.get(layer, 0),
+        activations.get(layer, 0)*mc.BATCH_SIZE*4))
+
+  print('{} at {}x{}, batch size {}, {} runs'.format(
+      FLAGS.net, mc.IMAGE_WIDTH, mc.IMAGE_HEIGHT, mc.BATCH_SIZE,
+      FLAGS.num_runs))
+  print('{:<32} {:>9} {:>6} {:>10} {:>10} {:>11}'.format(
+      'layer', 'ms', '%', 'MFLOPs', 'params', 'act. KB'))
+  for layer, ms, num_flops, num_params, num_bytes in rows:
+    print('{:<32} {:>9.3f} {:>6.1f} {:>10.1f} {:>10d} {:>11.1f}'.format(
+        layer, ms, 100.0*ms/max(total_ms, 1e-8), num_flops/1e6, num_params,
+        num_bytes/1024.0))
+  print('{:<32} {:>9.3f} {:>6.1f} {:>10.1f} {:>10d} {:>11.1f}'.format(
+      'total', total_ms, 100.0, sum(r[2] for r in rows)/1e6,
+      sum(r[3] for r in rows), sum(r[4] for r in rows)/1024.0))
+  print('Untraced latency: {:.3f} ms mean, {:.3f} ms p50, {:.3f} ms p90'.format(
+      np.mean(latencies), np.percentile(latencies, 50),
+      np.percentile(latencies, 90)))
+
+  if FLAGS.output_file:
+    with open(FLAGS.output_file, 'w') as f:
+      f.write('layer,ms,flops,params,activation_bytes\n')
+      for row in rows:
+        f.write('{},{:.4f},{},{},{}\n'.format(*row))
+    print('Report saved to {}'.format(FLAGS.output_file))
+
+def main(argv=None):
+  profile()
+
+if __name__ == '__main__':
+  tf.app.run()
@@ -0,0 +1,242 @@
+"""Structured channel pruning of the fire modules of SqueezeDet and SqueezeDet+.
+
+The channels of the squeeze and expand layers of every fire module are ranked by
+the L1 norm of their filters in a trained checkpoint and the weakest ones are
+removed, together with the matching input channels of the following layers.
+The pruned architecture is written to <out_dir>/architecture.json and the
+surviving weights to a checkpoint in out_dir, from which the model is
+fine-tuned with the usual training loop:
+
+  python ./src/train.py --net=squeezeDet --train_dir=<out_dir> \\
+      --architecture_config=<out_dir>/architecture.json ...
+
+The number of parameters and flops before and after pruning are taken from the
+cost counters of the model.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import json
+import os
+
+import numpy as np
+import tensorflow as tf
+
+from config import *
+from nets import *
+
+FLAGS = tf.app.flags.FLAGS
+
+tf.app.flags.DEFINE_string('dataset', 'KITTI',
+                           """Currently only support KITTI and CITYSCAPE datasets.""")
+tf.app.flags.DEFINE_string('net', 'squeezeDet',
+                           """Neural net architecture, squeezeDet or squeezeDet+.""")
+tf.app.flags.DEFINE_string('checkpoint_dir', '/tmp/bichen/logs/squeezeDet/train',
+                           """Directory of the trained model to prune.""")
+tf.app.flags.DEFINE_string('out_dir', '/tmp/bichen/logs/squeezeDet/pruned',
+                           """Directory to write the pruned model to.""")
+tf.app.flags.DEFINE_string('architecture_config', '',
+                           """Architecture of the model to prune, if it was """
+                           """already pruned before.""")
+tf.app.flags.DEFINE_float('prune_ratio', 0.3,
+                          """Fraction of the channels removed from every """
+                          """squeeze and expand layer.""")
+tf.app.flags.DEFINE_float('target_flop_reduction', 0.0,
+                          """If larger than 0, search the prune ratio that """
+                          """removes this fraction of the flops instead of """
+                          """using --prune_ratio.""")
+tf.app.flags.DEFINE_integer('mask_parameterization', 4,
+                            """Bounding box is 4, octagonal mask is 8. Other values not supported.""")
+tf.app.flags.DEFINE_boolean('log_anchors', False, """Use Log domain extracted anchors ?""")
+tf.app.flags.DEFINE_string('encoding_type', 'normal',
+                            """what type of encoding to use""")
+tf.app.flags.DEFINE_string('gpu', '0', """gpu id.""")
+
+FIRE_LAYERS = ['squeeze1x1', 'expand1x1', 'expand3x3']
+
+def _model_config(fire_module_filters):
+  assert FLAGS.net == 'squeezeDet' or FLAGS.net == 'squeezeDet+', \
+      'Only fire modules can be pruned, not supported: {}'.format(FLAGS.net)
+  assert FLAGS.dataset == 'KITTI' or FLAGS.dataset == 'CITYSCAPE', \
+      'Currently only support KITTI and CITYSCAPE datasets'
+
+  if FLAGS.net == 'squeezeDet':
+    if FLAGS.dataset == 'KITTI':
+      mc = kitti_squeezeDet_config(FLAGS.mask_parameterization, False, FLAGS.encoding_type)
+    elif FLAGS.dataset == 'CITYSCAPE':
+      mc = cityscape_squeezeDet_config(FLAGS.mask_parameterization, FLAGS.log_anchors, False, FLAGS.encoding_type)
+  elif FLAGS.net == 'squeezeDet+':
+    if FLAGS.dataset == 'KITTI':
+      mc = kitti_squeezeDetPlus_config(FLAGS.mask_parameterization, False, FLAGS.encoding_type)
+    elif FLAGS.dataset == 'CITYSCAPE':
+      mc = cityscape_squeezeDetPlus_config(FLAGS.mask_parameterization, FLAGS.log_anchors, False, FLAGS.encoding_type)
+  # build the same graph as train.py, so that the pruned checkpoint can be
+  # restored there
+  mc.IS_TRAINING = True
+  mc.LOAD_PRETRAINED_MODEL = False
+  mc.FIRE_MODULE_FILTERS = fire_module_filters
+  return mc
+
+def _build_model(mc):
+  if FLAGS.net == 'squeezeDet':
+    return SqueezeDet(mc)
+  return SqueezeDetPlus(mc)
+
+def _model_cost(fire_module_filters):
+  """Build the model and sum up its cost counters.
+
+  Returns:
+    num_params: number of parameters.
+    num_flops: number of flops.
+    layers: names of the convolutional layers, in the order of the network.
+  """
+  with tf.Graph().as_default():
+    model = _build_model(_model_config(fire_module_filters))
+    num_params = sum(c[1] for c in model.model_size_counter)
+    num_flops = sum(c[1] for c in model.flop_counter)
+    layers = [c[0] for c in model.model_size_counter]
+  return num_params, num_flops, layers
+
+def _fire_module_filters(shapes, layers):
+  """Number of [squeeze 1x1, expand 1x1, expand 3x3] filters of every fire
+  module, read from the kernel shapes of a checkpoint."""
+  filters = {}
+  for layer_name in layers:
+    module, layer = os.path.split(layer_name)
+    if layer in FIRE_LAYERS:
+      filters.setdefault(module, []).append(shapes[layer_name+'/kernels'][-1])
+  return filters
+
+def _pruned_filters(filters, prune_ratio):
+  return {module: [max(1, int(round(n*(1.0-prune_ratio)))) for n in counts]
+          for module, counts in filters.items()}
+
+def _rank_channels(kernel, num_keep):
+  """Indices of the num_keep output channels of a [h, w, in, out] kernel with
+  the largest L1 norm, in their original order."""
+  l1_norm = np.sum(np.abs(kernel), axis=(0, 1, 2))
+  return np.sort(np.argsort(-l1_norm, kind='mergesort')[:num_keep])
+
+def _prune_weights(reader, layers, pruned_filters):
+  """Slice the weights of a checkpoint to the pruned architecture.
+
+  Args:
+    reader: checkpoint reader of the model to prune.
+    layers: names of the convolutional layers, in the order of the network.
+    pruned_filters: dict of fire module name to its pruned [squeeze 1x1,
+      expand 1x1, expand 3x3] filters.
+  Returns:
+    dict of variable name to its pruned value.
+  """
+  weights = {}
+  # kept channels of the output of the previous layer, None keeps all
+  prev_keep = None
+  for layer_name in layers:
+    module, layer = os.path.split(layer_name)
+    kernel = reader.get_tensor(layer_name+'/kernels')
+    biases = reader.get_tensor(layer_name+'/biases')
+
+    # both expand layers read the output of the squeeze layer
+    in_keep = squeeze_keep if layer in FIRE_LAYERS[1:] else prev_keep
+    if in_keep is not None:
+      kernel = kernel[:, :, in_keep, :]
+    out_keep = None
+    if layer in FIRE_LAYERS:
+      num_filters = kernel.shape[-1]
+      out_keep = _rank_channels(
+          kernel, pruned_filters[module][FIRE_LAYERS.index(layer)])
+      kernel = kernel[:, :, :, out_keep]
+      biases = biases[out_keep]
+    weights[layer_name+'/kernels'] = kernel
+    weights[layer_name+'/biases'] = biases
+
+    if layer == 'squeeze1x1':
+      squeeze_keep = out_keep
+    elif layer == 'expand1x1':
+      # the next layer reads the concatenation of both expand layers
+      expand1x1_keep, expand1x1_filters = out_keep, num_filters
+    elif layer == 'expand3x3':
+      prev_keep = np.concatenate([expand1x1_keep, expand1x1_filters+out_keep])
+    else:
+      prev_keep = None
+  return weights
+
+def _search_prune_ratio(filters, num_flops, target_flop_reduction):
+  """Bisect the smallest prune ratio that removes the target fraction of the
+  flops."""
+  low, high = 0.0, 1.0
+  for _ in range(10):
+    ratio = (low+high)/2
+    _, pruned_flops, _ = _model_cost(_pruned_filters(filters, ratio))
+    if 1.0-pruned_flops/num_flops < target_flop_reduction:
+      low = ratio
+    else:
+      high = ratio
+  return high
+
+def prune():
+  """Prune the fire modules of a trained model."""
+  fire_module_filters = {}
+  if FLAGS.architecture_config:
+    with open(FLAGS.architecture_config) as f:
+      fire_module_filters = json.load(f)
+
+  ckpt = tf.train.get_checkpoint_state(FLAGS.checkpoint_dir)
+  assert ckpt and ckpt.model_checkpoint_path, \
+      'No checkpoint found in {}'.format(FLAGS.checkpoint_dir)
+  reader = tf.train.NewCheckpointReader(ckpt.model_checkpoint_path)
+  print('Pruning {}'.format(ckpt.model_checkpoint_path))
+
+  num_params, num_flops, layers = _model_cost(fire_module_filters)
+  filters = _fire_module_filters(reader.get_variable_to_shape_map(), layers)
+
+  prune_ratio = FLAGS.prune_ratio
+  if FLAGS.target_flop_reduction > 0:
+    prune_ratio = _search_prune_ratio(
+        filters, num_flops, FLAGS.target_flop_reduction)
+  assert 0 <= prune_ratio < 1, 'Prune ratio has to be in [0, 1)'
+  pruned_filters = _pruned_filters(filters, prune_ratio)
+  weights = _prune_weights(reader, layers, pruned_filters)
+
+  if not tf.gfile.Exists(FLAGS.out_dir):
+    tf.gfile.MakeDirs(FLAGS.out_dir)
+  with tf.Graph().as_default():
+    model = _build_model(_model_config(pruned_filters))
+    pruned_params = sum(c[1] for c in model.model_size_counter)
+    pruned_flops = sum(c[1] for c in model.flop_counter)
+
+    # all other variables, like the momentum of the optimizer and the global
+    # step, start from scratch for fine-tuning
+    saver = tf.train.Saver(tf.global_variables())
+    with tf.Session(config=tf.ConfigProto(allow_soft_placement=True)) as sess:
+      sess.run(tf.global_variables_initializer())
+      for v in model.model_params:
+        v.load(weights[v.op.name], sess)
+      checkpoint_path = saver.save(
+          sess, os.path.join(FLAGS.out_dir, 'model.ckpt'), global_step=0)
+
+  architecture_path = os.path.join(FLAGS.out_dir, 'architecture.json')
+  with open(architecture_path, 'w') as f:
+    json.dump(pruned_filters, f, indent=2, sort_keys=True)
+
+  print('Prune ratio: {:.3f}'.format(prune_ratio))
+  for layer_name in layers:
+    module, layer = os.path.split(layer_name)
+    if layer == FIRE_LAYERS[0]:
+      print('  {}: {} -> {}'.format(
+          module, filters[module], pruned_filters[module]))
+  print('Number of parameters: {} -> {} ({:.1f}% less)'.format(
+      num_params, pruned_params, 100.0*(1-pruned_params/num_params)))
+  print('Number of flops: {} -> {} ({:.1f}% less)'.format(
+      num_flops, pruned_flops, 100.0*(1-pruned_flops/num_flops)))
+  print('Pruned checkpoint saved to {}'.format(checkpoint_path))
+  print('Pruned architecture saved to {}'.format(architecture_path))
+
+def main(argv=None):
+  os.environ['CUDA_VISIBLE_DEVICES'] = FLAGS.gpu
+  prune()
+
+if __name__ == '__main__':
+  tf.app.run()
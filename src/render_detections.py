@@ -0,0 +1,85 @@
+"""Render the detections of a record file onto their frames.
+
+Headless runs of inference.py and demo.py with a detections file only write
+the detections. This reads such a record file together with the frames it
+was computed on, the same video or glob of images, crops and resizes every
+frame like it was before the network, draws the boxes or octagonal masks and
+writes the frame as an image named after its record, e.g.
+
+  python ./src/render_detections.py --detections_file=$RES_DIR/detections.bin \
+      --input_path=$INP_DIR --out_dir=$RES_DIR
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+
+import cv2
+import tensorflow as tf
+
+from inference import read_frames
+from train import _draw_box
+from utils.detection_records import read_records
+
+FLAGS = tf.app.flags.FLAGS
+
+tf.app.flags.DEFINE_string('detections_file', '',
+                           """Record file written by inference.py or demo.py.""")
+tf.app.flags.DEFINE_string(
+    'input_path', './data/sample.png',
+    """Video or glob of images the detections were computed on.""")
+tf.app.flags.DEFINE_string(
+    'out_dir', './data/out/', """Directory to write the rendered frames to.""")
+tf.app.flags.DEFINE_float('plot_prob_thresh', 0.0,
+                          """Only draw detections with a higher score.""")
+
+# Class specific color definitions
+_cdict = {}
+_cdict['person']      = (0,204,102)
+_cdict['pedestrian']  = (0,204,102)
+_cdict['rider']       = (102,0,204)
+_cdict['car']         = (0,000,204)
+_cdict['truck']       = (153,153,0)
+_cdict['bus']         = (0,153,153)
+_cdict['motorcycle']  = (204,0,102)
+_cdict['bicycle']     = (255,128,0)
+_cdict['cyclist']     = (255,128,0)
+
+def render():
+  assert FLAGS.detections_file, 'A detections file is needed'
+  header, records = read_records(FLAGS.detections_file)
+  class_names = header['class_names']
+  frames = read_frames(FLAGS.input_path)
+  num_frames = 0
+  for record in records:
+    # frames without a record were dropped by the pipeline
+    for frame_id, _, img in frames:
+      if frame_id == record['frame']:
+        break
+    else:
+      print('No frame {} in {}'.format(record['frame'], FLAGS.input_path))
+      break
+    if header['crop']:
+      top, bottom, left, right = header['crop']
+      img = img[top:bottom, left:right, :]
+    if header['image_size']:
+      img = cv2.resize(img, tuple(header['image_size']))
+    keep = record['scores'] > FLAGS.plot_prob_thresh
+    _draw_box(
+        img, record['boxes'][keep],
+        [class_names[idx]+': (%.2f)'% prob \
+            for idx, prob in zip(record['classes'][keep], record['scores'][keep])],
+        (0, 0, 255), draw_masks=(header['num_params'] == 8), cdict=_cdict)
+    cv2.imwrite(os.path.join(FLAGS.out_dir, record['name']), img)
+    num_frames += 1
+  print('{} frames rendered to {}'.format(num_frames, FLAGS.out_dir))
+
+def main(argv=None):
+  if not tf.gfile.Exists(FLAGS.out_dir):
+    tf.gfile.MakeDirs(FLAGS.out_dir)
+  render()
+
+if __name__ == '__main__':
+  tf.app.run()
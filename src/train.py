@@ -8,6 +8,8 @@ from __future__ import print_function
 
 import cv2
 from datetime import datetime
+import importlib
+import json
 import os.path
 import sys
 import time
@@ -16,13 +18,15 @@ import copy
 import numpy as np
 from six.moves import xrange
 import tensorflow as tf
-import threading
 
 from config import *
 from dataset import pascal_voc, kitti, cityscape
 from utils.util import sparse_to_dense, bgr_to_rgb, bbox_transform2, bbox_transform_inv2, bbox_transform
 from nets import *
 from dataset.input_reader import decode_parameterization
+from utils.async_checkpoint import AsyncCheckpointer
+from utils.telemetry import StepTelemetry, queue_wait_time
+from utils.producers import ProducerPool
 
 FLAGS = tf.app.flags.FLAGS
 
@@ -58,6 +62,45 @@ tf.app.flags.DEFINE_float('warm_restart_lr', -1.0,
                             """Learning rate to be used after warm restart""")
 tf.app.flags.DEFINE_string('encoding_type', 'normal',
                             """what type of encoding to use""")
+tf.app.flags.DEFINE_string('architecture_config', '',
+                           """Json file with the fire module filters of a """
+                           """pruned squeezeDet or squeezeDet+ model.""")
+tf.app.flags.DEFINE_string('job_name', '',
+                           """Either 'ps' or 'worker' in distributed training. """
+                           """Leave empty to train in a single process.""")
+tf.app.flags.DEFINE_string('ps_hosts', '',
+                           """Comma-separated list of host:port of the """
+                           """parameter servers.""")
+tf.app.flags.DEFINE_string('worker_hosts', '',
+                           """Comma-separated list of host:port of the """
+                           """workers.""")
+tf.app.flags.DEFINE_integer('task_index', 0,
+                            """Index of the task within its job. Worker 0 is """
+                            """the chief.""")
+tf.app.flags.DEFINE_string('resolution_schedule', '',
+                           """Comma-separated list of scale:step. Train at """
+                           """the given fraction of the input resolution """
+                           """until the step and at full resolution after """
+                           """the last one, e.g. 0.5:20000,0.75:40000.""")
+tf.app.flags.DEFINE_integer('telemetry_step', 10,
+                            """Number of steps per telemetry record.""")
+tf.app.flags.DEFINE_integer('telemetry_trace_step', 100,
+                            """Trace every this many steps to measure the """
+                            """time waiting for the input queue, 0 never """
+                            """traces.""")
+tf.app.flags.DEFINE_integer('min_producers', 0,
+                            """Minimum number of producer threads, 0 uses """
+                            """the number of the config.""")
+tf.app.flags.DEFINE_integer('max_producers', 0,
+                            """Maximum number of producer threads, 0 uses """
+                            """the number of the config. With a range, the """
+                            """number of producers follows the fill level """
+                            """of the input queue.""")
+tf.app.flags.DEFINE_string('queue_fill_band', '0.3,0.8',
+                           """Target fill level of the input queue, low,high.""")
+tf.app.flags.DEFINE_integer('producer_control_step', 50,
+                            """Number of steps between changes of the number """
+                            """of producers.""")
 
 def _draw_box(im, box_list_pre, label_list, color=None, cdict=None, form='center', draw_masks=False, fill=False, fps_text='NA'):
   assert form == 'center' or form == 'diagonal', \
@@ -121,6 +164,8 @@ def _draw_box(im, box_list_pre, label_list, color=None, cdict=None, form='center
 def _viz_prediction_result(model, images, bboxes, labels, batch_det_bbox,
                            batch_det_class, batch_det_prob, visualize_gt_masks=False, visualize_pred_masks=False, edge_adhesions=[]):
   mc = model.mc
+  batch_filtered = model.filter_batch_prediction(
+      batch_det_bbox, batch_det_prob, batch_det_class)
 
   for i in range(len(images)):
     # draw ground truth
@@ -140,8 +185,7 @@ def _viz_prediction_result(model, images, bboxes, labels, batch_det_bbox,
           draw_masks=visualize_gt_masks, fill=False)
 
     # draw prediction
-    det_bbox, det_prob, det_class = model.filter_prediction(
-        batch_det_bbox[i], batch_det_prob[i], batch_det_class[i])
+    det_bbox, det_prob, det_class = batch_filtered[i]
 
     keep_idx    = [idx for idx in range(len(det_prob)) \
                       if det_prob[idx] > mc.PLOT_PROB_THRESH]
@@ -157,14 +201,98 @@ def _viz_prediction_result(model, images, bboxes, labels, batch_det_bbox,
         (0, 0, 255), draw_masks=visualize_pred_masks, fill=False)
 
 
-def train():
-  """Train SqueezeDet model"""
+def _set_resolution(mc, scale):
+  """Scale the input resolution of a config. The nets are fully
+  convolutional, so only the anchors have to be laid out again on the feature
+  map of the new resolution. The images and boxes shrink with the
+  resolution, so do the anchor shapes."""
+  mc.IMAGE_WIDTH = int(round(mc.IMAGE_WIDTH*scale))
+  mc.IMAGE_HEIGHT = int(round(mc.IMAGE_HEIGHT*scale))
+  net_config = {'vgg16': 'vgg16', 'resnet50': 'res50',
+                'squeezeDet': 'squeezeDet', 'squeezeDet+': 'squeezeDetPlus'}
+  config_module = importlib.import_module('config.{}_{}_config'.format(
+      FLAGS.dataset.lower(), net_config[FLAGS.net]))
+  if FLAGS.dataset == 'CITYSCAPE':
+    mc.ANCHOR_BOX = config_module.set_anchors(mc, FLAGS.log_anchors)
+  else:
+    mc.ANCHOR_BOX = config_module.set_anchors(mc)
+  # the anchor grid is cached and shared, scale a copy
+  mc.ANCHOR_BOX = np.array(mc.ANCHOR_BOX)
+  mc.ANCHOR_BOX[:, 2:] *= scale
+  mc.ANCHORS = len(mc.ANCHOR_BOX)
+
+def _restorable_variables(var_list, checkpoint_path):
+  """Variables of var_list whose shape matches the checkpoint. The IOU buffer
+  of the anchors depends on the input resolution and is skipped when the
+  checkpoint was written at another one, it is recomputed at every step."""
+  shapes = tf.train.NewCheckpointReader(
+      checkpoint_path).get_variable_to_shape_map()
+  restorable = []
+  for v in var_list:
+    if v.op.name in shapes and shapes[v.op.name] != v.get_shape().as_list():
+      print("Not restoring", v.op.name, "of shape", shapes[v.op.name],
+            "into shape", v.get_shape().as_list())
+      continue
+    restorable.append(v)
+  return restorable
+
+def _resolution_phases():
+  """(scale, max steps) of every phase of the resolution schedule, the last
+  phase trains at full resolution until --max_steps."""
+  phases = []
+  for phase in FLAGS.resolution_schedule.split(','):
+    if phase:
+      scale, max_steps = phase.split(':')
+      phases.append((float(scale), int(max_steps)))
+  phases.append((1.0, FLAGS.max_steps))
+  for i, (scale, max_steps) in enumerate(phases):
+    assert 0 < scale <= 1, 'Resolution scale has to be in (0, 1]: {}'.format(scale)
+    assert i == 0 or max_steps > phases[i-1][1], \
+        'Steps of the resolution schedule have to increase'
+  return phases
+
+def train(scale=1.0, max_steps=None, first_phase=True):
+  """Train SqueezeDet model
+
+  Args:
+    scale: fraction of the input resolution of the config to train at.
+    max_steps: step to train until, defaults to --max_steps.
+    first_phase: False if the checkpoint in train_dir was written by an
+        earlier phase of the resolution schedule, it is then always fully
+        restored.
+  """
+  if max_steps is None:
+    max_steps = FLAGS.max_steps
   assert FLAGS.dataset == 'KITTI' or FLAGS.dataset == 'CITYSCAPE', \
       'Currently only support KITTI and CITYSCAPE datasets'
   assert FLAGS.mask_parameterization in [4,8], 'Values other than 4 and 8 are not supported !'
 
   os.environ['CUDA_VISIBLE_DEVICES'] = FLAGS.gpu
 
+  # distributed training: parameter servers only serve variables, workers
+  # train synchronous replicas of the model. Worker 0 is the chief which
+  # initializes, restores and checkpoints the shared variables.
+  server = None
+  is_chief = True
+  if FLAGS.job_name:
+    assert FLAGS.job_name == 'ps' or FLAGS.job_name == 'worker', \
+        'Distributed training role not supported: {}'.format(FLAGS.job_name)
+    cluster = tf.train.ClusterSpec({
+        'ps': FLAGS.ps_hosts.split(','),
+        'worker': FLAGS.worker_hosts.split(',')})
+    server = tf.train.Server(
+        cluster, job_name=FLAGS.job_name, task_index=FLAGS.task_index)
+    if FLAGS.job_name == 'ps':
+      server.join()
+      return
+    is_chief = (FLAGS.task_index == 0)
+    num_workers = cluster.num_tasks('worker')
+    worker_device = '/job:worker/task:{}'.format(FLAGS.task_index)
+    device_setter = tf.train.replica_device_setter(
+        worker_device=worker_device, cluster=cluster)
+  else:
+    device_setter = None
+
   with tf.Graph().as_default():
 
     assert FLAGS.net == 'vgg16' or FLAGS.net == 'resnet50' \
@@ -175,47 +303,49 @@ def train():
         mc = kitti_vgg16_config(FLAGS.mask_parameterization, FLAGS.only_tune_last_layer, FLAGS.encoding_type)
       elif FLAGS.dataset == 'CITYSCAPE':
         mc = cityscape_vgg16_config(FLAGS.mask_parameterization, FLAGS.log_anchors, FLAGS.only_tune_last_layer, FLAGS.encoding_type)
-      mc.IS_TRAINING = True
       # mc.PRETRAINED_MODEL_PATH = FLAGS.pretrained_model_path
       print("Not using pretrained model for VGG, uncomment above line and comment below line to use pretrained model !")
       mc.LOAD_PRETRAINED_MODEL = False
-      if FLAGS.warm_restart_lr != -1.0:
-        print("Updating the learning rate for warm restart to", FLAGS.warm_restart_lr)
-        mc.LEARNING_RATE = FLAGS.warm_restart_lr
-      model = VGG16ConvDet(mc)
+      net_class = VGG16ConvDet
     elif FLAGS.net == 'resnet50':
       if FLAGS.dataset == 'KITTI':
         mc = kitti_res50_config(FLAGS.mask_parameterization, FLAGS.only_tune_last_layer, FLAGS.encoding_type)
       elif FLAGS.dataset == 'CITYSCAPE':
         mc = cityscape_res50_config(FLAGS.mask_parameterization, FLAGS.log_anchors, FLAGS.only_tune_last_layer, FLAGS.encoding_type)
-      mc.IS_TRAINING = True
       mc.PRETRAINED_MODEL_PATH = FLAGS.pretrained_model_path
-      if FLAGS.warm_restart_lr != -1.0:
-        print("Updating the learning rate for warm restart to", FLAGS.warm_restart_lr)
-        mc.LEARNING_RATE = FLAGS.warm_restart_lr
-      model = ResNet50ConvDet(mc)
+      net_class = ResNet50ConvDet
     elif FLAGS.net == 'squeezeDet':
       if FLAGS.dataset == 'KITTI':
         mc = kitti_squeezeDet_config(FLAGS.mask_parameterization, FLAGS.only_tune_last_layer, FLAGS.encoding_type)
       elif FLAGS.dataset == 'CITYSCAPE':
         mc = cityscape_squeezeDet_config(FLAGS.mask_parameterization, FLAGS.log_anchors, FLAGS.only_tune_last_layer, FLAGS.encoding_type)
-      mc.IS_TRAINING = True
       mc.PRETRAINED_MODEL_PATH = FLAGS.pretrained_model_path
-      if FLAGS.warm_restart_lr != -1.0:
-        print("Updating the learning rate for warm restart to", FLAGS.warm_restart_lr)
-        mc.LEARNING_RATE = FLAGS.warm_restart_lr
-      model = SqueezeDet(mc)
+      net_class = SqueezeDet
     elif FLAGS.net == 'squeezeDet+':
       if FLAGS.dataset == 'KITTI':
         mc = kitti_squeezeDetPlus_config(FLAGS.mask_parameterization, FLAGS.only_tune_last_layer, FLAGS.encoding_type)
       elif FLAGS.dataset == 'CITYSCAPE':
         mc = cityscape_squeezeDetPlus_config(FLAGS.mask_parameterization, FLAGS.log_anchors, FLAGS.only_tune_last_layer, FLAGS.encoding_type)
-      mc.IS_TRAINING = True
       mc.PRETRAINED_MODEL_PATH = FLAGS.pretrained_model_path
-      if FLAGS.warm_restart_lr != -1.0:
-        print("Updating the learning rate for warm restart to", FLAGS.warm_restart_lr)
-        mc.LEARNING_RATE = FLAGS.warm_restart_lr
-      model = SqueezeDetPlus(mc)
+      net_class = SqueezeDetPlus
+
+    mc.IS_TRAINING = True
+    if scale != 1.0:
+      _set_resolution(mc, scale)
+      print("Training at {}x{} until step {}".format(
+          mc.IMAGE_WIDTH, mc.IMAGE_HEIGHT, max_steps))
+    if FLAGS.architecture_config:
+      with open(FLAGS.architecture_config) as f:
+        mc.FIRE_MODULE_FILTERS = json.load(f)
+      print("Using the fire module filters of", FLAGS.architecture_config)
+    if FLAGS.warm_restart_lr != -1.0:
+      print("Updating the learning rate for warm restart to", FLAGS.warm_restart_lr)
+      mc.LEARNING_RATE = FLAGS.warm_restart_lr
+    if server is not None:
+      mc.NUM_REPLICAS = num_workers
+      mc.WORKER_DEVICE = worker_device
+    with tf.device(device_setter):
+      model = net_class(mc)
 
     imdb_valid = None
     if FLAGS.dataset == 'KITTI':
@@ -231,35 +361,42 @@ def train():
         imdb_valid.mc.DATA_AUGMENTATION = False
         print("Margins for Validation data:", imdb_valid.left_margin, imdb_valid.top_margin, imdb_valid.right_margin, imdb_valid.bottom_margin)
 
+    if server is not None:
+      # every worker trains on its own part of the dataset
+      imdb.shard(num_workers, FLAGS.task_index)
+      print("Worker {} reads {} images".format(
+          FLAGS.task_index, len(imdb.image_idx)))
+
     print("Training model data augmentation:", imdb.mc.DATA_AUGMENTATION)
     if imdb_valid != None:
       print("Validation model data augmentation:", imdb_valid.mc.DATA_AUGMENTATION)
     # save model size, flops, activations by layers
-    with open(os.path.join(FLAGS.train_dir, 'model_metrics.txt'), 'w') as f:
-      f.write('Number of parameter by layer:\n')
-      count = 0
-      for c in model.model_size_counter:
-        f.write('\t{}: {}\n'.format(c[0], c[1]))
-        count += c[1]
-      f.write('\ttotal: {}\n'.format(count))
-
-      count = 0
-      f.write('\nActivation size by layer:\n')
-      for c in model.activation_counter:
-        f.write('\t{}: {}\n'.format(c[0], c[1]))
-
-        count += c[1]
-      f.write('\ttotal: {}\n'.format(count))
-
-      count = 0
-      f.write('\nNumber of flops by layer:\n')
-      for c in model.flop_counter:
-        f.write('\t{}: {}\n'.format(c[0], c[1]))
-        count += c[1]
-      f.write('\ttotal: {}\n'.format(count))
-    f.close()
-    print ('Model statistics saved to {}.'.format(
-      os.path.join(FLAGS.train_dir, 'model_metrics.txt')))
+    if is_chief:
+      with open(os.path.join(FLAGS.train_dir, 'model_metrics.txt'), 'w') as f:
+        f.write('Number of parameter by layer:\n')
+        count = 0
+        for c in model.model_size_counter:
+          f.write('\t{}: {}\n'.format(c[0], c[1]))
+          count += c[1]
+        f.write('\ttotal: {}\n'.format(count))
+
+        count = 0
+        f.write('\nActivation size by layer:\n')
+        for c in model.activation_counter:
+          f.write('\t{}: {}\n'.format(c[0], c[1]))
+
+          count += c[1]
+        f.write('\ttotal: {}\n'.format(count))
+
+        count = 0
+        f.write('\nNumber of flops by layer:\n')
+        for c in model.flop_counter:
+          f.write('\t{}: {}\n'.format(c[0], c[1]))
+          count += c[1]
+        f.write('\ttotal: {}\n'.format(count))
+      f.close()
+      print ('Model statistics saved to {}.'.format(
+        os.path.join(FLAGS.train_dir, 'model_metrics.txt')))
 
     def _load_data(load_to_placeholder=True, eval_valid=False):
       # read batch input
@@ -341,84 +478,136 @@ def train():
       return feed_dict, image_per_batch, label_per_batch, bbox_per_batch, edge_indices
 
 
-    def _enqueue(sess, coord):
-      try:
-        while not coord.should_stop():
-          feed_dict, _, _, _, _ = _load_data()
-          sess.run(model.enqueue_op, feed_dict=feed_dict)
-          if mc.DEBUG_MODE:
-            print ("added to the queue")
-        if mc.DEBUG_MODE:
-          print ("Finished enqueue")
-      except tf.errors.CancelledError:
-        coord.request_stop()
-
-    sess = tf.Session(config=tf.ConfigProto(allow_soft_placement=True))
+    def _enqueue():
+      producer_start = time.time()
+      feed_dict, _, _, _, _ = _load_data()
+      sess.run(model.enqueue_op, feed_dict=feed_dict)
+      telemetry.add_producer_time(time.time() - producer_start)
+      if mc.DEBUG_MODE:
+        print ("added to the queue")
 
-    saver = tf.train.Saver(tf.global_variables())
+    # only the chief writes checkpoints
+    checkpointer = AsyncCheckpointer(tf.global_variables()) if is_chief else None
     summary_op = tf.summary.merge_all()
+    queue_size_op = model.FIFOQueue.size()
 
     init = tf.global_variables_initializer()
-    sess.run(init)
-    glb_step = sess.run(model.global_step)
-    print("Global step before restore:", glb_step)
-
-    print("Kernels before restore")
-    for v in tf.trainable_variables():
-      if 'kernels' in v.name:
-        print("First few weights of ", v.name, " are ", sess.run(v)[0,0,0,0:5])
-
-    print("Learning rate before restore", sess.run(model.lr))
-
-    ckpt = tf.train.get_checkpoint_state(FLAGS.train_dir)
-    if ckpt and ckpt.model_checkpoint_path:
-      print("Found checkpoint at step: ", int(ckpt.model_checkpoint_path.split('/')[-1].split('-')[-1]))
-      last_layer_name = model.preds.name.split('/')[0]
-      if FLAGS.mask_parameterization == 8 and FLAGS.bounding_box_checkpoint:
-        print("Loading only partial weights (except last layer", last_layer_name, ")")
-        saver_partial_weights = tf.train.Saver([v for v in tf.global_variables() if last_layer_name not in v.name])
-        saver_partial_weights.restore(sess, ckpt.model_checkpoint_path)
-        if FLAGS.warm_restart_lr != -1.0:
-          print("Resetting global step")
-          sess.run([model.global_step.assign(0)])
+    sess_config = tf.ConfigProto(allow_soft_placement=True)
+    if server is not None:
+      # workers only talk to the parameter servers, never to each other
+      sess_config.device_filters.extend(['/job:ps', worker_device])
+      local_init = tf.local_variables_initializer()
+      # initialized by the chief only once the shared variables are restored,
+      # the other workers wait for it before they start training
+      with tf.device(device_setter):
+        chief_ready = tf.Variable(
+            False, trainable=False, name='chief_ready', collections=[])
+      if is_chief:
+        sync_init = [model.sync_opt.chief_init_op,
+                     model.sync_opt.get_init_tokens_op(),
+                     chief_ready.initializer]
+        tf.train.add_queue_runner(model.sync_opt.get_chief_queue_runner())
       else:
-        print("Loading all weights (including the last layer", last_layer_name, ")")
-        saver.restore(sess, ckpt.model_checkpoint_path)
-    else:
-      print("Checkpoint not found !")
-    glb_step = sess.run(model.global_step)
-    print("Global step after restore:", glb_step)
+        sync_init = [model.sync_opt.local_step_init_op]
+
+    summary_writer = None
+    metrics_file = None
+    if is_chief:
+      sess = tf.Session(
+          server.target if server is not None else '', config=sess_config)
+      sess.run(init)
+      glb_step = sess.run(model.global_step)
+      print("Global step before restore:", glb_step)
+
+      print("Kernels before restore")
+      for v in tf.trainable_variables():
+        if 'kernels' in v.name:
+          print("First few weights of ", v.name, " are ", sess.run(v)[0,0,0,0:5])
+
+      print("Learning rate before restore", sess.run(model.lr))
+
+      ckpt = tf.train.get_checkpoint_state(FLAGS.train_dir)
+      if ckpt and ckpt.model_checkpoint_path:
+        print("Found checkpoint at step: ", int(ckpt.model_checkpoint_path.split('/')[-1].split('-')[-1]))
+        last_layer_name = model.preds.name.split('/')[0]
+        if FLAGS.mask_parameterization == 8 and FLAGS.bounding_box_checkpoint \
+            and first_phase:
+          print("Loading only partial weights (except last layer", last_layer_name, ")")
+          saver_partial_weights = tf.train.Saver(_restorable_variables(
+              [v for v in tf.global_variables() if last_layer_name not in v.name],
+              ckpt.model_checkpoint_path))
+          saver_partial_weights.restore(sess, ckpt.model_checkpoint_path)
+          if FLAGS.warm_restart_lr != -1.0:
+            print("Resetting global step")
+            sess.run([model.global_step.assign(0)])
+        else:
+          print("Loading all weights (including the last layer", last_layer_name, ")")
+          tf.train.Saver(_restorable_variables(
+              tf.global_variables(), ckpt.model_checkpoint_path)).restore(
+                  sess, ckpt.model_checkpoint_path)
+      else:
+        print("Checkpoint not found !")
+      glb_step = sess.run(model.global_step)
+      print("Global step after restore:", glb_step)
     
-    print("Kernels after restore")
-    for v in tf.trainable_variables():
-      if 'kernels' in v.name:
-        print("First few weights of ", v.name, " are ", sess.run(v)[0,0,0,0:5])
-
-    print("Learning rate after restore", sess.run(model.lr))
-
-    summary_writer = tf.summary.FileWriter(FLAGS.train_dir, sess.graph)
-    with open(os.path.join(FLAGS.train_dir, 'training_metrics.txt'), 'a') as f:
-      f.write("Global step after restore: "+str(glb_step)+"\n")
-    f.close()
-    if FLAGS.eval_valid:
-      with open(os.path.join(FLAGS.train_dir, 'validation_metrics.txt'), 'a') as f:
-        f.write("Global step after restore: "+str(glb_step)+"\n")
-      f.close()
+      print("Kernels after restore")
+      for v in tf.trainable_variables():
+        if 'kernels' in v.name:
+          print("First few weights of ", v.name, " are ", sess.run(v)[0,0,0,0:5])
+
+      print("Learning rate after restore", sess.run(model.lr))
+
+      summary_writer = tf.summary.FileWriter(FLAGS.train_dir, sess.graph)
+      # kept open for the whole training, every line is flushed
+      metrics_file = open(
+          os.path.join(FLAGS.train_dir, 'training_metrics.txt'), 'a', 1)
+      metrics_file.write("Global step after restore: "+str(glb_step)+"\n")
+      if FLAGS.eval_valid:
+        with open(os.path.join(FLAGS.train_dir, 'validation_metrics.txt'), 'a') as f:
+          f.write("Global step after restore: "+str(glb_step)+"\n")
+        f.close()
+    else:
+      print("Waiting for the chief to initialize the model")
+      session_manager = tf.train.SessionManager(
+          ready_op=tf.report_uninitialized_variables(
+              tf.global_variables() + [chief_ready]))
+      sess = session_manager.wait_for_session(server.target, config=sess_config)
+      glb_step = sess.run(model.global_step)
+      print("Global step from the chief:", glb_step)
+
+    if server is not None:
+      sess.run(local_init)
+      sess.run(sync_init)
+      # the chief may have restored the global step in the meantime
+      glb_step = sess.run(model.global_step)
+
+    if is_chief:
+      telemetry_path = os.path.join(FLAGS.train_dir, 'telemetry.jsonl')
+    else:
+      telemetry_path = os.path.join(
+          FLAGS.train_dir, 'telemetry_worker{}.jsonl'.format(FLAGS.task_index))
+    telemetry = StepTelemetry(
+        telemetry_path, mc.BATCH_SIZE, mc.QUEUE_CAPACITY, summary_writer)
+
     coord = tf.train.Coordinator()
 
+    producers = None
     if mc.NUM_THREAD > 0:
-      enq_threads = []
-      for _ in range(mc.NUM_THREAD):
-        enq_thread = threading.Thread(target=_enqueue, args=[sess, coord])
-        # enq_thread.isDaemon()
-        enq_thread.start()
-        enq_threads.append(enq_thread)
+      producers = ProducerPool(
+          _enqueue, coord, mc.NUM_THREAD,
+          min_producers=FLAGS.min_producers or mc.NUM_THREAD,
+          max_producers=FLAGS.max_producers or mc.NUM_THREAD,
+          queue_capacity=mc.QUEUE_CAPACITY,
+          fill_band=[float(f) for f in FLAGS.queue_fill_band.split(',')],
+          log_fn=telemetry.add_event)
 
     threads = tf.train.start_queue_runners(coord=coord, sess=sess)
     run_options = tf.RunOptions(timeout_in_ms=60000)
+    trace_options = tf.RunOptions(
+        timeout_in_ms=60000, trace_level=tf.RunOptions.SOFTWARE_TRACE)
 
     try: 
-      for step in xrange(glb_step, FLAGS.max_steps):
+      for step in xrange(glb_step, max_steps):
         if coord.should_stop():
           sess.run(model.FIFOQueue.close(cancel_pending_enqueues=True))
           coord.request_stop()
@@ -426,8 +615,9 @@ def train():
           break
 
         start_time = time.time()
+        data_wait, summary_time, queue_size = None, 0.0, None
 
-        if step % FLAGS.summary_step == 0:
+        if is_chief and step % FLAGS.summary_step == 0:
           feed_dict, image_per_batch, label_per_batch, bbox_per_batch, edge_ids = \
               _load_data(load_to_placeholder=False)
           op_list = [
@@ -438,6 +628,7 @@ def train():
           _, loss_value, summary_str, det_boxes, det_probs, det_class, \
               conf_loss, bbox_loss, class_loss, edge_adhesions_pre_filtered = sess.run(
                   op_list, feed_dict=feed_dict)
+          train_end = time.time()
 
           summary_writer.add_summary(summary_str, step)
           # Visualize the training examples only if validation is not enabled
@@ -470,10 +661,8 @@ def train():
           
           print ('total_loss: {}, conf_loss: {}, bbox_loss: {}, class_loss: {}'.\
                 format(loss_value, conf_loss, bbox_loss, class_loss))
-          with open(os.path.join(FLAGS.train_dir, 'training_metrics.txt'), 'a') as f:
-            f.write('step: {}, total_loss: {}, conf_loss: {}, bbox_loss: {}, class_loss: {}\n'.\
-                format(step, loss_value, conf_loss, bbox_loss, class_loss))
-          f.close()
+          metrics_file.write('step: {}, total_loss: {}, conf_loss: {}, bbox_loss: {}, class_loss: {}\n'.\
+              format(step, loss_value, conf_loss, bbox_loss, class_loss))
           if FLAGS.eval_valid:
             print ('\n!! Validation Set evaluation at step ', step, ' !!')
             with open(os.path.join(FLAGS.train_dir, 'validation_metrics.txt'), 'a') as f:
@@ -545,13 +734,25 @@ def train():
                 summary_writer.add_summary(viz_summary, step)
             f.close()
           summary_writer.flush()
+          # writing summaries, visualization and validation after the
+          # training step
+          summary_time = time.time() - train_end
         else:
           if mc.NUM_THREAD > 0:
-            _, loss_value, conf_loss, bbox_loss, class_loss = sess.run(
+            traced = FLAGS.telemetry_trace_step > 0 \
+                and (step + 1) % FLAGS.telemetry_trace_step == 0
+            run_metadata = tf.RunMetadata() if traced else None
+            _, loss_value, conf_loss, bbox_loss, class_loss, queue_size = sess.run(
                 [model.train_op, model.loss, model.conf_loss, model.bbox_loss,
-                 model.class_loss], options=run_options)
+                 model.class_loss, queue_size_op],
+                options=trace_options if traced else run_options,
+                run_metadata=run_metadata)
+            if traced:
+              data_wait = queue_wait_time(
+                  run_metadata, model.image_input.op.name)
           else:
             feed_dict, _, _, _, _ = _load_data(load_to_placeholder=False)
+            data_wait = time.time() - start_time
             _, loss_value, conf_loss, bbox_loss, class_loss = sess.run(
                 [model.train_op, model.loss, model.conf_loss, model.bbox_loss,
                  model.class_loss], feed_dict=feed_dict)
@@ -570,38 +771,81 @@ def train():
                         'sec/batch)')
           print (format_str % (datetime.now(), step, loss_value,
                                images_per_sec, sec_per_batch))
-          with open(os.path.join(FLAGS.train_dir, 'training_metrics.txt'), 'a') as f:
-            f.write(format_str % (datetime.now(), step, loss_value,
-                               images_per_sec, sec_per_batch) + '\n')
-          f.close()
+          if is_chief:
+            metrics_file.write(format_str % (datetime.now(), step, loss_value,
+                                             images_per_sec, sec_per_batch) + '\n')
           sys.stdout.flush()
 
         # Save the model checkpoint periodically.
-        if step % FLAGS.checkpoint_step == 0 or (step + 1) == FLAGS.max_steps:
+        checkpoint_start = time.time()
+        if is_chief and (step % FLAGS.checkpoint_step == 0 or (step + 1) == max_steps):
           checkpoint_path = os.path.join(FLAGS.train_dir, 'model.ckpt')
           print("Checkpointing at ", step)
-          saver.save(sess, checkpoint_path, global_step=step)
+          checkpointer.save(sess, checkpoint_path, global_step=step)
+        checkpoint_time = time.time() - checkpoint_start
+
+        telemetry.add_step(
+            duration + checkpoint_time, data_wait, summary_time,
+            checkpoint_time, queue_size)
+        if producers is not None:
+          if queue_size is not None:
+            producers.observe(queue_size, duration)
+          if (step + 1) % FLAGS.producer_control_step == 0:
+            producers.adjust(step)
+        if (step + 1) % FLAGS.telemetry_step == 0 or (step + 1) == max_steps:
+          telemetry.emit(step)
       sess.run(model.FIFOQueue.close(cancel_pending_enqueues=True))
       coord.request_stop()
       coord.join(threads)
+      if checkpointer is not None:
+        checkpointer.close()
+      # the next phase of the resolution schedule builds a new graph
+      if producers is not None:
+        producers.join()
+      sess.close()
     except KeyboardInterrupt:
       print("Keyboard interrupt caught ! Terminating..")
       sess.run(model.FIFOQueue.close(cancel_pending_enqueues=True))
       coord.request_stop()
       coord.join(threads)
+      if checkpointer is not None:
+        last_step = sess.run(model.global_step)
+        print("Writing the last checkpoint at", last_step)
+        checkpointer.save(sess, os.path.join(FLAGS.train_dir, 'model.ckpt'),
+                          global_step=last_step)
+        checkpointer.close()
       sys.exit(0)
     except:
       print("Unexpected error:", sys.exc_info()[0])
       sess.run(model.FIFOQueue.close(cancel_pending_enqueues=True))
       coord.request_stop()
       coord.join(threads)
+      if checkpointer is not None:
+        checkpointer.close()
       sys.exit(0)
+    finally:
+      model.close()
+      telemetry.close()
+      if metrics_file is not None:
+        metrics_file.close()
 
 def main(argv=None):  # pylint: disable=unused-argument
   if not tf.gfile.Exists(FLAGS.train_dir):
     # tf.gfile.DeleteRecursively(FLAGS.train_dir)
     tf.gfile.MakeDirs(FLAGS.train_dir)
-  train()
+  phases = _resolution_phases()
+  assert len(phases) == 1 or not FLAGS.job_name, \
+      'Resolution schedule is not supported in distributed training'
+  # skip the phases that are already done when training is resumed
+  ckpt = tf.train.get_checkpoint_state(FLAGS.train_dir)
+  resets_global_step = FLAGS.mask_parameterization == 8 \
+      and FLAGS.bounding_box_checkpoint and FLAGS.warm_restart_lr != -1.0
+  done_steps = 0
+  if ckpt and ckpt.model_checkpoint_path and not resets_global_step:
+    done_steps = int(ckpt.model_checkpoint_path.split('-')[-1]) + 1
+  phases = [p for p in phases if p[1] > done_steps] or phases[-1:]
+  for i, (scale, max_steps) in enumerate(phases):
+    train(scale, max_steps, first_phase=(i == 0))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,132 @@
+"""Anchor generation.
+
+Anchors are laid out on the output feature map of a net: at every grid cell
+(h, w) one anchor of every shape is centered at (w*stride_x + offset_x,
+h*stride_y + offset_y). Grids are built once per process for every feature map
+size, stride, offset and shape set and shared by all callers, so that the
+returned arrays are read-only.
+"""
+
+import collections
+
+import numpy as np
+
+# anchor [width, height] in pixels
+ANCHOR_SHAPES = {
+    'kitti': [[  36.,  37.], [ 366., 174.], [ 115.,  59.],
+              [ 162.,  87.], [  38.,  90.], [ 258., 173.],
+              [ 224., 108.], [  78., 170.], [  72.,  43.]],
+    'kitti_res50': [[  94.,  49.], [ 225., 161.], [ 170.,  91.],
+                    [ 390., 181.], [  41.,  32.], [ 128.,  64.],
+                    [ 298., 164.], [ 232.,  99.], [  65.,  42.]],
+    # extracted in the linear and the log domain of the box size
+    'cityscape_linear': [[17.31, 18.20], [35.13, 39.49], [99.93, 66.42],
+                         [34.60, 73.31], [56.66, 125.19], [166.94, 114.14],
+                         [94.15, 203.37], [257.57, 187.70], [196.69, 312.63]],
+    'cityscape_log': [[8.01, 11.25], [11.45, 26.49], [18.02, 13.88],
+                      [21.40, 50.10], [31.07, 24.21], [42.67, 103.73],
+                      [55.73, 42.22], [107.92, 76.43], [171.29, 181.58]],
+}
+
+# (kernel size, stride, padding) of the layers of every net that change the
+# size of the feature map
+_NET_LAYERS = {
+    'squeezeDet': [(3, 2, 'SAME'), (3, 2, 'VALID'), (3, 2, 'VALID'),
+                   (3, 2, 'VALID')],
+    'squeezeDet+': [(7, 2, 'SAME'), (3, 2, 'VALID'), (3, 2, 'VALID'),
+                    (3, 2, 'VALID')],
+    'resnet50': [(7, 2, 'SAME'), (3, 2, 'VALID'), (1, 2, 'SAME'),
+                 (1, 2, 'SAME')],
+    'vgg16': [(2, 2, 'SAME'), (3, 1, 'VALID'), (2, 2, 'SAME'), (3, 1, 'VALID'),
+              (2, 2, 'SAME'), (3, 1, 'VALID'), (2, 2, 'SAME')],
+}
+
+Anchors = collections.namedtuple('Anchors', ['boxes', 'corners', 'diagonals'])
+
+_anchor_cache = {}
+
+def feature_map_size(net, image_height, image_width):
+  """Size of the output feature map of a net for an input resolution.
+
+  Args:
+    net: squeezeDet, squeezeDet+, resnet50 or vgg16.
+    image_height: input height.
+    image_width: input width.
+  Returns:
+    (H, W) of the feature map.
+  """
+  assert net in _NET_LAYERS, 'Net not supported: {}'.format(net)
+  H, W = image_height, image_width
+  for size, stride, padding in _NET_LAYERS[net]:
+    if padding == 'SAME':
+      H, W = -(-H // stride), -(-W // stride)
+    else:
+      H, W = (H - size) // stride + 1, (W - size) // stride + 1
+  return H, W
+
+def anchor_grid(H, W, shapes, stride=16, offset=16):
+  """Anchors of a feature map.
+
+  Args:
+    H, W: size of the feature map.
+    shapes: name of a shape set in ANCHOR_SHAPES, or a [B, 2] array of anchor
+        widths and heights.
+    stride: distance between the anchor centers of neighbouring cells, a
+        number or (x, y).
+    offset: center of the anchors of the top left cell, a number or (x, y).
+  Returns:
+    Anchors of H*W*B anchors, ordered by cell row, cell column and shape:
+      boxes: [cx, cy, w, h] of every anchor.
+      corners: [xmin, ymin, xmax, ymax] of every anchor.
+      diagonals: length of the diagonal of every anchor.
+  """
+  if isinstance(shapes, str):
+    shapes = ANCHOR_SHAPES[shapes]
+  stride_x, stride_y = np.broadcast_to(stride, 2)
+  offset_x, offset_y = np.broadcast_to(offset, 2)
+  shapes = np.asarray(shapes, dtype=np.float64).reshape(-1, 2)
+  key = (int(H), int(W), float(stride_x), float(stride_y), float(offset_x),
+         float(offset_y), tuple(shapes.ravel()))
+  if key in _anchor_cache:
+    return _anchor_cache[key]
+
+  B = len(shapes)
+  boxes = np.empty((H, W, B, 4))
+  boxes[:, :, :, 0] = (np.arange(W)*stride_x + offset_x)[None, :, None]
+  boxes[:, :, :, 1] = (np.arange(H)*stride_y + offset_y)[:, None, None]
+  boxes[:, :, :, 2:] = shapes
+  boxes = boxes.reshape(-1, 4)
+
+  corners = np.concatenate(
+      (boxes[:, :2] - boxes[:, 2:]/2, boxes[:, :2] + boxes[:, 2:]/2), axis=1)
+  diagonals = np.sqrt(boxes[:, 2]**2 + boxes[:, 3]**2)
+  for a in (boxes, corners, diagonals):
+    a.setflags(write=False)
+
+  anchors = Anchors(boxes, corners, diagonals)
+  _anchor_cache[key] = anchors
+  return anchors
+
+def confident_anchors(anchors, conf, top_k=0, thresh=0.0):
+  """Select the anchors to decode by their confidence, before the class
+  probabilities and boxes are computed.
+
+  The probability of a detection is at most the confidence of its anchor, so
+  that anchors with a confidence of at most the probability threshold of the
+  detections can be dropped without changing the result. Keeping only the
+  top_k most confident anchors is an approximation.
+
+  Args:
+    anchors: Anchors of anchor_grid.
+    conf: array of the confidence of every anchor.
+    top_k: keep at most this many anchors, 0 keeps all.
+    thresh: keep anchors with a confidence above this.
+  Returns:
+    idx: indices of the kept anchors, in the anchor order.
+    Anchors of the kept anchors.
+  """
+  idx = np.nonzero(conf > thresh)[0]
+  if 0 < top_k < len(idx):
+    idx = np.sort(idx[np.argpartition(-conf[idx], top_k-1)[:top_k]])
+  return idx, Anchors(
+      anchors.boxes[idx], anchors.corners[idx], anchors.diagonals[idx])
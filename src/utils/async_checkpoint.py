@@ -0,0 +1,119 @@
+"""Checkpoint saving in a background thread.
+
+tf.train.Saver.save blocks the training loop until the checkpoint is on
+disk. AsyncCheckpointer only reads the values of the variables in the
+training session, which is a single fast sess.run, and writes them from a
+copy of the variables in a separate CPU graph and session in a background
+thread. At most one checkpoint is written at a time: a save waits until the
+previous one is done. The checkpoint state file is replaced atomically once a
+checkpoint is complete, so that readers like eval.py never see a state file
+that points to a partially written checkpoint.
+"""
+
+import os
+import threading
+
+import tensorflow as tf
+from google.protobuf import text_format
+
+class AsyncCheckpointer(object):
+  def __init__(self, var_list, max_to_keep=5):
+    """
+    Args:
+      var_list: variables of the training graph to save.
+      max_to_keep: number of most recent checkpoints to keep.
+    """
+    self._var_list = list(var_list)
+    self._max_to_keep = max_to_keep
+    # seeded from the state file of the checkpoint directory at the first save
+    self._last_checkpoints = None
+    self._meta_graph_def = None
+    self._thread = None
+    self._error = None
+
+    # copy of the variables, saved under the names of the training graph
+    self._graph = tf.Graph()
+    with self._graph.as_default():
+      self._shadow_vars = []
+      for v in self._var_list:
+        with tf.device('/cpu:0'):
+          self._shadow_vars.append(tf.Variable(
+              tf.placeholder(v.dtype.base_dtype, v.get_shape()),
+              trainable=False, collections=[]))
+      self._saver = tf.train.Saver(
+          {v.op.name: s for v, s in zip(self._var_list, self._shadow_vars)},
+          max_to_keep=None)
+    self._sess = tf.Session(
+        graph=self._graph, config=tf.ConfigProto(device_count={'GPU': 0}))
+
+  def save(self, sess, save_path, global_step):
+    """Snapshot the variables and write them to save_path-global_step in the
+    background.
+
+    Args:
+      sess: session of the training graph.
+      save_path: path prefix of the checkpoint files.
+      global_step: step appended to save_path.
+    """
+    if self._meta_graph_def is None:
+      self._meta_graph_def = tf.train.export_meta_graph(
+          graph=sess.graph).SerializeToString()
+    self.wait()
+    if self._last_checkpoints is None:
+      # keep pruning the checkpoints of earlier runs and schedule phases
+      state = tf.train.get_checkpoint_state(os.path.dirname(save_path))
+      self._last_checkpoints = list(
+          state.all_model_checkpoint_paths) if state else []
+    values = sess.run(self._var_list)
+    self._thread = threading.Thread(
+        target=self._write, args=[values, save_path, global_step])
+    self._thread.start()
+
+  def wait(self):
+    """Block until the checkpoint in flight is written. Errors of the
+    background thread are raised here."""
+    if self._thread is not None:
+      self._thread.join()
+      self._thread = None
+    if self._error is not None:
+      error, self._error = self._error, None
+      raise error
+
+  def close(self):
+    """Write the checkpoint in flight and release the session."""
+    try:
+      self.wait()
+    finally:
+      self._sess.close()
+
+  def _write(self, values, save_path, global_step):
+    try:
+      for shadow_var, value in zip(self._shadow_vars, values):
+        shadow_var.load(value, self._sess)
+      checkpoint_path = self._saver.save(
+          self._sess, save_path, global_step=global_step,
+          write_meta_graph=False, write_state=False)
+      with tf.gfile.GFile(checkpoint_path+'.meta', 'wb') as f:
+        f.write(self._meta_graph_def)
+
+      self._last_checkpoints = [
+          p for p in self._last_checkpoints if p != checkpoint_path]
+      self._last_checkpoints.append(checkpoint_path)
+      stale = self._last_checkpoints[:-self._max_to_keep]
+      self._last_checkpoints = self._last_checkpoints[-self._max_to_keep:]
+      self._write_state(os.path.dirname(save_path), checkpoint_path)
+      for path in stale:
+        for f in tf.gfile.Glob(path+'.*'):
+          tf.gfile.Remove(f)
+    except Exception as e:
+      self._error = e
+
+  def _write_state(self, save_dir, checkpoint_path):
+    state = tf.train.generate_checkpoint_state_proto(
+        save_dir, checkpoint_path,
+        all_model_checkpoint_paths=self._last_checkpoints)
+    state_path = os.path.join(save_dir, 'checkpoint')
+    tmp_path = state_path+'.tmp'
+    with tf.gfile.GFile(tmp_path, 'w') as f:
+      f.write(text_format.MessageToString(state))
+    tf.gfile.Rename(tmp_path, state_path, overwrite=True)
@@ -0,0 +1,135 @@
+"""Dynamic batching of concurrent requests.
+
+A DynamicBatcher is shared by the threads serving requests. Every thread
+submits its input and blocks until the result is ready, while a worker thread
+collects the pending inputs into batches and runs them at once. A batch is
+run as soon as it holds max_batch_size inputs or max_wait_ms after its first
+input arrived, whichever comes first, which trades a bounded delay of single
+requests for the throughput of larger batches under load. The latency of the
+requests, the time they waited for their batch and the batch sizes are kept
+for the metrics.
+"""
+
+import collections
+import threading
+import time
+
+import numpy as np
+from six.moves import queue
+
+from utils.pipeline import PipelineStats
+
+class _Request(object):
+  def __init__(self, item):
+    self.item = item
+    self.arrival = time.time()
+    self.done = threading.Event()
+    self.result = None
+    self.error = None
+
+class DynamicBatcher(object):
+  def __init__(self, run_batch, max_batch_size=8, max_wait_ms=5.0):
+    """
+    Args:
+      run_batch: function of a list of inputs returning the list of their
+          results, in order.
+      max_batch_size: maximum number of inputs per batch.
+      max_wait_ms: maximum time in ms a batch waits for more inputs after its
+          first one.
+    """
+    assert max_batch_size >= 1, 'The batch size must be positive'
+    self.stats = PipelineStats(max_samples=10000)
+    self._run_batch = run_batch
+    self._max_batch_size = max_batch_size
+    self._max_wait = max_wait_ms/1000.0
+    self._queue = queue.Queue()
+    self._lock = threading.Lock()
+    self._batch_sizes = collections.Counter()
+    self._stop_event = threading.Event()
+    self._thread = threading.Thread(target=self._run)
+    self._thread.daemon = True
+    self._thread.start()
+
+  def submit(self, item):
+    """Run item in the next batch and return its result, blocks the calling
+    thread until then. Errors of run_batch are raised in every thread of the
+    batch."""
+    request = _Request(item)
+    self._queue.put(request)
+    request.done.wait()
+    self.stats.frame_done(request.arrival)
+    if request.error is not None:
+      raise request.error
+    return request.result
+
+  def stop(self):
+    self._stop_event.set()
+    self._thread.join()
+
+  def _next_batch(self):
+    """Pending requests of the next batch, empty if stopped."""
+    while not self._stop_event.is_set():
+      try:
+        batch = [self._queue.get(timeout=0.1)]
+        break
+      except queue.Empty:
+        pass
+    else:
+      return []
+    deadline = batch[0].arrival + self._max_wait
+    while len(batch) < self._max_batch_size:
+      timeout = deadline - time.time()
+      try:
+        if timeout > 0:
+          batch.append(self._queue.get(timeout=timeout))
+        else:
+          batch.append(self._queue.get_nowait())
+      except queue.Empty:
+        break
+    return batch
+
+  def _run(self):
+    while True:
+      batch = self._next_batch()
+      if not batch:
+        return
+      start = time.time()
+      for request in batch:
+        self.stats.add('queue', start-request.arrival)
+      try:
+        results = self._run_batch([request.item for request in batch])
+        for request, result in zip(batch, results):
+          request.result = result
+      except Exception as e:
+        for request in batch:
+          request.error = e
+      self.stats.add('batch', time.time()-start)
+      with self._lock:
+        self._batch_sizes[len(batch)] += 1
+      for request in batch:
+        request.done.set()
+
+  def metrics(self):
+    """dict of the number of requests, their rate since the start, the mean, median, 90th and
+    99th percentile of the request latency, the time waiting for a batch and
+    the run time of a batch in ms over the last 10000 of each, and the
+    histogram and mean of the batch sizes."""
+    with self._lock:
+      batch_sizes = dict(self._batch_sizes)
+    num_batches = sum(batch_sizes.values())
+    num_requests = sum(size*n for size, n in batch_sizes.items())
+    latencies = self.stats.latencies()
+    percentiles = {}
+    for stage, name in [('end-to-end', 'request'), ('queue', 'queue'),
+                        ('batch', 'batch')]:
+      values = latencies.get(stage)
+      if values:
+        percentiles[name] = dict(
+            [('mean', 1000*float(np.mean(values)))]
+            + [('p{}'.format(p), 1000*float(np.percentile(values, p)))
+               for p in [50, 90, 99]])
+    return {'requests': num_requests,
+            'requests_per_sec': self.stats.fps(),
+            'latency_ms': percentiles,
+            'batch_sizes': dict((str(size), n) for size, n in sorted(batch_sizes.items())),
+            'mean_batch_size': float(num_requests)/max(num_batches, 1)}
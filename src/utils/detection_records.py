@@ -0,0 +1,197 @@
+"""Record files of the detections of frame sequences.
+
+A DetectionRecordWriter streams the detections of every frame, its frame id,
+name, the classes, scores and boxes or octagonal masks, to a file from a
+background thread, so that headless inference never waits for the disk and
+never renders. Files ending in .jsonl get one line of JSON per frame, any
+other file a compact binary format. Both start with a header holding the
+class names, the number of mask parameters and how the frames were cropped
+and resized before the network, so that read_records, e.g. in
+render_detections.py, can draw the overlays later.
+
+Boxes are the [cx, cy, w, h] or [cx, cy, w, h, of1, of2, of3, of4] vectors of
+the network, in the coordinates of the network input. The JSONL records also
+hold the eight vertices of octagonal masks.
+
+The binary format is little endian: the magic b'SQDR', the uint32 length of
+the JSON header and the header, followed by one block per frame of the uint32
+frame id, uint16 length of the name, uint32 number of detections, the UTF-8
+name, uint8 classes, float32 scores and float32 boxes.
+"""
+
+import json
+import struct
+import threading
+import time
+
+import numpy as np
+from six.moves import queue
+
+from utils.polygon import octagons
+
+MAGIC = b'SQDR'
+_FRAME = struct.Struct('<IHI')
+
+def detection_dicts(boxes, scores, classes, class_names):
+  """JSON serializable dicts of the class name, score and box of detections,
+  and the vertices of octagonal masks.
+
+  Args:
+    boxes: [N, 4] or [N, 8] array of boxes or masks.
+    scores: [N] array of scores.
+    classes: [N] array of class indices.
+    class_names: names of the class indices.
+  """
+  boxes = np.asarray(boxes, dtype=np.float32)
+  detections = []
+  for box, score, cls in zip(boxes.tolist(), np.asarray(scores).tolist(),
+                             np.asarray(classes).tolist()):
+    detections.append({'class': class_names[cls], 'score': score, 'box': box})
+  if boxes.ndim == 2 and boxes.shape[1] == 8 and len(boxes) > 0:
+    for det, points in zip(detections, octagons(boxes).tolist()):
+      det['points'] = points
+  return detections
+
+class DetectionRecordWriter(object):
+  def __init__(self, path, class_names, num_params=4, image_size=None,
+               crop=None, flush_secs=10):
+    """
+    Args:
+      path: file to write, JSONL if it ends in .jsonl, binary otherwise.
+      class_names: names of the class indices.
+      num_params: 4 for boxes, 8 for octagonal masks.
+      image_size: (width, height) the frames were resized to, None if they
+          were not.
+      crop: [top, bottom, left, right] slice bounds the frames were cropped
+          with before resizing, None if they were not.
+      flush_secs: seconds between flushes of the file.
+    """
+    assert num_params in [4, 8], \
+        'Mask parameterization not supported: {}'.format(num_params)
+    self._jsonl = path.endswith('.jsonl')
+    self._class_names = list(class_names)
+    self._num_params = num_params
+    self._file = open(path, 'w' if self._jsonl else 'wb')
+    self._queue = queue.Queue()
+    self._flush_secs = flush_secs
+    self.num_frames = 0
+
+    header = {'class_names': self._class_names, 'num_params': num_params,
+              'image_size': list(image_size) if image_size else None,
+              'crop': list(crop) if crop else None}
+    if self._jsonl:
+      self._file.write(json.dumps(header, sort_keys=True)+'\n')
+    else:
+      header = json.dumps(header, sort_keys=True).encode('utf-8')
+      self._file.write(MAGIC + struct.pack('<I', len(header)) + header)
+
+    self._thread = threading.Thread(target=self._run)
+    self._thread.daemon = True
+    self._thread.start()
+
+  def write(self, frame_id, name, boxes, scores, classes):
+    """Queue the detections of a frame, encoded in the writer thread.
+
+    Args:
+      frame_id: index of the frame in its sequence.
+      name: name of the frame, e.g. its image or output file.
+      boxes: list or [N, num_params] array of boxes or masks.
+      scores: list or [N] array of scores.
+      classes: list or [N] array of class indices.
+    """
+    self.num_frames += 1
+    self._queue.put((frame_id, name, boxes, scores, classes))
+
+  def close(self):
+    """Write all pending frames and close the file."""
+    self._queue.put(None)
+    self._thread.join()
+    self._file.close()
+
+  def _encode(self, frame_id, name, boxes, scores, classes):
+    boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, self._num_params)
+    scores = np.asarray(scores, dtype=np.float32).reshape(-1)
+    classes = np.asarray(classes, dtype=np.uint8).reshape(-1)
+    if not self._jsonl:
+      name = name.encode('utf-8')
+      return (_FRAME.pack(frame_id, len(name), len(scores)) + name
+              + classes.tobytes() + scores.astype('<f4').tobytes()
+              + boxes.astype('<f4').tobytes())
+    return json.dumps({'frame': frame_id, 'name': name,
+                       'detections': detection_dicts(boxes, scores, classes,
+                                                     self._class_names)},
+                      sort_keys=True)+'\n'
+
+  def _run(self):
+    last_flush = time.time()
+    while True:
+      try:
+        frame = self._queue.get(timeout=self._flush_secs)
+      except queue.Empty:
+        frame = False
+      if frame is None:
+        break
+      if frame:
+        self._file.write(self._encode(*frame))
+      if time.time()-last_flush >= self._flush_secs:
+        self._file.flush()
+        last_flush = time.time()
+    self._file.flush()
+
+def _read_jsonl(f):
+  header = json.loads(f.readline())
+  class_idx = dict((c, i) for i, c in enumerate(header['class_names']))
+  def _records():
+    for line in f:
+      record = json.loads(line)
+      dets = record['detections']
+      yield {'frame': record['frame'], 'name': record['name'],
+             'boxes': np.array([d['box'] for d in dets],
+                               dtype=np.float32).reshape(-1, header['num_params']),
+             'scores': np.array([d['score'] for d in dets], dtype=np.float32),
+             'classes': np.array([class_idx[d['class']] for d in dets],
+                                 dtype=np.int64)}
+  return header, _records()
+
+def _read_binary(f):
+  length, = struct.unpack('<I', f.read(4))
+  header = json.loads(f.read(length).decode('utf-8'))
+  num_params = header['num_params']
+  def _records():
+    while True:
+      block = f.read(_FRAME.size)
+      if len(block) < _FRAME.size:
+        return
+      frame_id, name_length, n = _FRAME.unpack(block)
+      name = f.read(name_length).decode('utf-8')
+      classes = np.frombuffer(f.read(n), dtype=np.uint8).astype(np.int64)
+      scores = np.frombuffer(f.read(4*n), dtype='<f4')
+      boxes = np.frombuffer(f.read(4*n*num_params), dtype='<f4')
+      yield {'frame': frame_id, 'name': name,
+             'boxes': boxes.reshape(n, num_params), 'scores': scores,
+             'classes': classes}
+  return header, _records()
+
+def read_records(path):
+  """Read a record file of either format.
+
+  Returns:
+    header: dict of the class_names, num_params, image_size and crop.
+    records: iterator of dicts of the frame id, name, [N, num_params] boxes,
+        [N] scores and [N] class indices of every frame, in the order written.
+        The file is closed once it is exhausted.
+  """
+  f = open(path, 'rb')
+  if f.read(len(MAGIC)) == MAGIC:
+    header, records = _read_binary(f)
+  else:
+    f.close()
+    f = open(path, 'r')
+    header, records = _read_jsonl(f)
+  def _closing():
+    try:
+      for record in records:
+        yield record
+    finally:
+      f.close()
+  return header, _closing()
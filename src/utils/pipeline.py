@@ -0,0 +1,233 @@
+"""Staged processing of frame streams.
+
+A Pipeline reads frames from a source in a capture thread and passes them
+through a chain of stages, each in its own thread, joined by bounded queues.
+The output of the last stage is consumed by iterating the pipeline in the
+calling thread, which is where display code has to run. While one frame is
+rendered the next is already in the network and the one after is decoded.
+
+With the 'lossless' policy a full queue blocks its producer, so that every
+frame is processed, which suits files. With the 'latest' policy a full queue
+drops its oldest frame instead, so that a live source is never slowed down
+and the consumer always gets the most recent frames. PipelineStats keeps the
+latency of every stage, the end-to-end latency from capture to the end of
+rendering, the frame rate and the number of dropped frames.
+"""
+
+import collections
+import threading
+import time
+
+import numpy as np
+from six.moves import queue
+
+# marks the end of the stream in the queues
+_END = object()
+
+class FrameQueue(object):
+  def __init__(self, maxsize, policy='lossless'):
+    """
+    Args:
+      maxsize: capacity of the queue.
+      policy: 'lossless' blocks a put into a full queue, 'latest' drops the
+          oldest frame of the queue instead.
+    """
+    assert policy in ['lossless', 'latest'], \
+        'Frame drop policy not supported: {}'.format(policy)
+    self._queue = queue.Queue(max(maxsize, 1))
+    self._policy = policy
+    self.num_dropped = 0
+
+  def put(self, item, stop_event):
+    """Put an item, returns False if stop_event was set while blocking."""
+    while not stop_event.is_set():
+      try:
+        if self._policy == 'lossless' or item is _END:
+          self._queue.put(item, timeout=0.1)
+        else:
+          self._queue.put_nowait(item)
+        return True
+      except queue.Full:
+        if self._policy == 'latest':
+          try:
+            if self._queue.get_nowait() is not _END:
+              self.num_dropped += 1
+          except queue.Empty:
+            pass
+    return False
+
+  def get(self, stop_event):
+    """Get an item, returns _END if stop_event was set while blocking."""
+    while not stop_event.is_set():
+      try:
+        return self._queue.get(timeout=0.1)
+      except queue.Empty:
+        pass
+    return _END
+
+  def full(self):
+    """True if a put would block, never with the 'latest' policy."""
+    return self._policy == 'lossless' and self._queue.full()
+
+  def get_nowait(self):
+    """Get an item, raises queue.Empty if there is none."""
+    return self._queue.get_nowait()
+
+class PipelineStats(object):
+  """Latencies of the stages and the frame rate of a pipeline, over the whole
+  run and over the window since the last report."""
+  def __init__(self, max_samples=None):
+    """
+    Args:
+      max_samples: number of the most recent latencies kept per stage, all
+          of them if None.
+    """
+    self._lock = threading.Lock()
+    self._latencies = collections.defaultdict(
+        lambda: collections.deque(maxlen=max_samples))
+    self._num_frames = 0
+    self._start = time.time()
+    self._window_frames = 0
+    self._window_start = self._start
+
+  def add(self, stage, seconds):
+    with self._lock:
+      self._latencies[stage].append(seconds)
+
+  def frame_done(self, capture_time, num_frames=1):
+    """Count num_frames finished frames captured at capture_time."""
+    self.add('end-to-end', time.time()-capture_time)
+    with self._lock:
+      self._num_frames += num_frames
+      self._window_frames += num_frames
+
+  def fps(self):
+    """Frame rate over the whole run."""
+    return self._num_frames/max(time.time()-self._start, 1e-9)
+
+  def window_fps(self):
+    """Frame rate since the last call, which starts a new window."""
+    with self._lock:
+      now = time.time()
+      fps = self._window_frames/max(now-self._window_start, 1e-9)
+      self._window_frames = 0
+      self._window_start = now
+    return fps
+
+  def latencies(self):
+    """dict of stage name to the list of its latencies in seconds."""
+    with self._lock:
+      return dict((stage, list(values))
+                  for stage, values in self._latencies.items())
+
+  def summary(self):
+    """dict of stage name to the mean, median and 90th percentile of its
+    latency in ms."""
+    latencies = self.latencies()
+    return dict(
+        (stage, [1000*float(f(values)) for f in [
+            np.mean, np.median, lambda v: np.percentile(v, 90)]])
+        for stage, values in latencies.items() if values)
+
+  def report(self, num_dropped=0):
+    lines = ['{} frames, {:.2f} fps, {} dropped'.format(
+        self._num_frames, self.fps(), num_dropped)]
+    for stage, (mean, p50, p90) in sorted(self.summary().items()):
+      lines.append('  {:<12s} mean {:8.2f} ms  p50 {:8.2f} ms  p90 {:8.2f} ms'
+                   .format(stage, mean, p50, p90))
+    return '\n'.join(lines)
+
+class Pipeline(object):
+  def __init__(self, source, stages, queue_size=2, policy='lossless',
+               frame_count=None):
+    """
+    Args:
+      source: iterable of frames, read in the capture thread.
+      stages: list of (name, function) that are applied to every frame in
+          order, each in its own thread.
+      queue_size: capacity of the queues between the threads.
+      policy: frame drop policy of the queues, 'lossless' or 'latest'.
+      frame_count: function returning the number of frames of an output, for
+          stages working on batches of frames. By default every output is
+          one frame.
+    """
+    self.stats = PipelineStats()
+    self._source = source
+    self._frame_count = frame_count
+    self._stages = stages
+    self._stop_event = threading.Event()
+    self._queues = [FrameQueue(queue_size, policy)
+                    for _ in range(len(stages)+1)]
+    self._threads = [threading.Thread(target=self._capture)]
+    for i, (name, fn) in enumerate(stages):
+      self._threads.append(threading.Thread(
+          target=self._run_stage, args=[name, fn, self._queues[i],
+                                        self._queues[i+1]]))
+    for thread in self._threads:
+      thread.daemon = True
+    self._error = None
+
+  @property
+  def num_dropped(self):
+    return sum(q.num_dropped for q in self._queues)
+
+  def _capture(self):
+    try:
+      frames = iter(self._source)
+      while not self._stop_event.is_set():
+        start = time.time()
+        try:
+          frame = next(frames)
+        except StopIteration:
+          break
+        self.stats.add('capture', time.time()-start)
+        if not self._queues[0].put((start, frame), self._stop_event):
+          return
+    except Exception as e:
+      self._error = e
+    self._queues[0].put(_END, self._stop_event)
+
+  def _run_stage(self, name, fn, in_queue, out_queue):
+    try:
+      while True:
+        item = in_queue.get(self._stop_event)
+        if item is _END:
+          break
+        capture_time, frame = item
+        start = time.time()
+        output = fn(frame)
+        self.stats.add(name, time.time()-start)
+        if not out_queue.put((capture_time, output), self._stop_event):
+          return
+    except Exception as e:
+      self._error = e
+    out_queue.put(_END, self._stop_event)
+
+  def __iter__(self):
+    """Start the threads and yield the output of the last stage for every
+    frame. The time until the next frame is requested is recorded as the
+    'render' stage. Stops the threads when the loop is left."""
+    for thread in self._threads:
+      thread.start()
+    try:
+      while True:
+        item = self._queues[-1].get(self._stop_event)
+        if item is _END:
+          break
+        capture_time, output = item
+        start = time.time()
+        yield output
+        self.stats.add('render', time.time()-start)
+        self.stats.frame_done(
+            capture_time, self._frame_count(output) if self._frame_count else 1)
+    finally:
+      self.stop()
+    if self._error is not None:
+      raise self._error
+
+  def stop(self):
+    """Stop all threads, frames in the queues are discarded."""
+    self._stop_event.set()
+    for thread in self._threads:
+      if thread.is_alive() and thread is not threading.current_thread():
+        thread.join()
@@ -0,0 +1,182 @@
+"""IOU of batches of polygons, for the octagonal masks of the eight point
+regression.
+
+Polygons are arrays of shape [N, V, 2] of (x, y) vertices, where polygons with
+fewer vertices are padded by repeating their last vertex. The intersection of
+two polygons is computed by clipping one polygon with every edge of the other
+(Sutherland-Hodgman) for the whole batch at once, which needs the clipping
+polygon to be convex, like the octagons. The clipped polygon may be any simple
+polygon, like a ground truth instance outline.
+"""
+
+import math
+
+import numpy as np
+
+EPSILON = 1e-8
+
+def pad_polygons(polygons):
+  """Stack polygons with different numbers of vertices.
+
+  Args:
+    polygons: list of [V_i, 2] arrays of vertices.
+  Returns:
+    [N, max V_i, 2] array, shorter polygons padded with their last vertex.
+  """
+  num_vertices = max([len(p) for p in polygons] + [1])
+  padded = np.zeros((len(polygons), num_vertices, 2))
+  for i, p in enumerate(polygons):
+    if len(p) > 0:
+      padded[i, :len(p)] = p
+      padded[i, len(p):] = p[-1]
+  return padded
+
+def octagons(mask_vectors):
+  """Vertices of octagonal masks, the same points as decode_parameterization
+  of inference.py for a batch of masks.
+
+  Args:
+    mask_vectors: [N, 8] array of [cx, cy, w, h, of1, of2, of3, of4].
+  Returns:
+    [N, 8, 2] array of the vertices, where the octagon meets its bounding box.
+  """
+  mask_vectors = np.asarray(mask_vectors, dtype=np.float64).reshape(-1, 8)
+  cx, cy, w, h, of1, of2, of3, of4 = mask_vectors.T
+  cos = sin = math.cos(math.radians(45))
+  # points on the four diagonal edges
+  p0 = (cx-of1*cos, cy-of1*sin)
+  p1 = (cx-of2*cos, cy+of2*sin)
+  p2 = (cx+of3*cos, cy+of3*sin)
+  p3 = (cx+of4*cos, cy-of4*sin)
+  xmin, xmax = cx-0.5*w, cx+0.5*w
+  ymin, ymax = cy-0.5*h, cy+0.5*h
+
+  dr1 = p2[0]-p0[0]
+  dr1 = np.where(dr1 == 0, EPSILON, dr1)
+  dr2 = p3[0]-p1[0]
+  dr2 = np.where(dr2 == 0, EPSILON, dr2)
+  m1 = (p2[1]-p0[1])/dr1
+  m1 = np.where(m1 == 0, EPSILON, m1)
+  m2 = (p3[1]-p1[1])/dr2
+  m2 = np.where(m2 == 0, EPSILON, m2)
+
+  # every vertex is the intersection of a diagonal edge with a box edge,
+  # x = eq for a vertical and y = eq for a horizontal box edge
+  points = [p0, p1, p1, p2, p2, p3, p3, p0]
+  eqs = [xmin, xmin, ymax, ymax, xmax, xmax, ymin, ymin]
+  slopes = [-1/m1, -1/m2, -1/m2, -1/m1, -1/m1, -1/m2, -1/m2, -1/m1]
+  vertices = np.empty((len(mask_vectors), 8, 2))
+  for i, (pt, eq, m) in enumerate(zip(points, eqs, slopes)):
+    c = pt[1] - m*pt[0]
+    if i in [0, 1, 4, 5]:
+      x, y = eq, m*eq + c
+      y = np.minimum(y, cy) if i in [0, 5] else np.maximum(y, cy)
+    else:
+      x, y = (eq - c)/m, eq
+      x = np.minimum(x, cx) if i in [2, 7] else np.maximum(x, cx)
+    vertices[:, i, 0] = np.minimum(np.maximum(xmin, x), xmax)
+    vertices[:, i, 1] = np.minimum(np.maximum(ymin, y), ymax)
+  return vertices
+
+def polygon_areas(polygons):
+  """Areas of a batch of [N, V, 2] polygons."""
+  x, y = polygons[..., 0], polygons[..., 1]
+  return 0.5*np.abs(np.sum(
+      x*np.roll(y, -1, axis=-1) - np.roll(x, -1, axis=-1)*y, axis=-1))
+
+def _signed_areas(polygons):
+  x, y = polygons[..., 0], polygons[..., 1]
+  return np.sum(x*np.roll(y, -1, axis=-1) - np.roll(x, -1, axis=-1)*y, axis=-1)
+
+def clip_polygons(polygons, convex_polygons):
+  """Intersection of every polygon with the convex polygon of the same index.
+
+  Args:
+    polygons: [N, V, 2] array of polygons.
+    convex_polygons: [N, K, 2] array of convex polygons of either orientation.
+  Returns:
+    [N, W, 2] array of the intersections, empty ones collapsed to a point.
+  """
+  polygons = np.asarray(polygons, dtype=np.float64)
+  convex_polygons = np.asarray(convex_polygons, dtype=np.float64)
+  n = len(polygons)
+  if n == 0:
+    return polygons
+  rows = np.arange(n)[:, None]
+  # inside of an edge is on the side of the polygon interior
+  orientation = np.where(_signed_areas(convex_polygons) >= 0, 1.0, -1.0)
+  num_clip = convex_polygons.shape[1]
+  for k in range(num_clip):
+    a = convex_polygons[:, k, None, :]
+    edge = convex_polygons[:, (k+1) % num_clip, None, :] - a
+    cur = polygons
+    nxt = np.roll(polygons, -1, axis=1)
+    d_cur = orientation[:, None]*(
+        edge[..., 0]*(cur[..., 1]-a[..., 1]) - edge[..., 1]*(cur[..., 0]-a[..., 0]))
+    d_nxt = np.roll(d_cur, -1, axis=1)
+    in_cur, in_nxt = d_cur >= 0, d_nxt >= 0
+
+    # every edge cur -> nxt of the polygon contributes its crossing with the
+    # clipping edge, if any, followed by nxt if it is inside
+    crossing = in_cur != in_nxt
+    t = d_cur/np.where(crossing, d_cur-d_nxt, 1.0)
+    cross_pts = cur + (nxt-cur)*t[..., None]
+    candidates = np.stack([cross_pts, nxt], axis=2).reshape(n, -1, 2)
+    valid = np.stack([crossing, in_nxt], axis=2).reshape(n, -1)
+
+    # move the valid vertices to the front, in order, and pad with the last
+    counts = valid.sum(axis=1)
+    width = max(int(counts.max()), 1)
+    order = np.argsort(~valid, axis=1, kind='mergesort')[:, :width]
+    polygons = candidates[rows, order]
+    last = polygons[np.arange(n), np.maximum(counts-1, 0)]
+    last[counts == 0] = 0.0
+    pad = np.arange(width)[None, :] >= counts[:, None]
+    polygons = np.where(pad[..., None], last[:, None, :], polygons)
+  return polygons
+
+def polygon_iou(polygons, convex_polygons):
+  """IOU of every polygon with the convex polygon of the same index.
+
+  Args:
+    polygons: [N, V, 2] array of polygons.
+    convex_polygons: [N, K, 2] array of convex polygons.
+  Returns:
+    [N] array of IOUs.
+  """
+  polygons = np.asarray(polygons, dtype=np.float64)
+  convex_polygons = np.asarray(convex_polygons, dtype=np.float64)
+  inter = polygon_areas(clip_polygons(polygons, convex_polygons))
+  union = polygon_areas(polygons) + polygon_areas(convex_polygons) - inter
+  return inter/np.maximum(union, EPSILON)
+
+def pairwise_polygon_iou(polygons, convex_polygons, max_pairs=1<<16):
+  """IOU of every polygon with every convex polygon.
+
+  Args:
+    polygons: [N, V, 2] array of polygons.
+    convex_polygons: [M, K, 2] array of convex polygons.
+    max_pairs: maximum number of pairs clipped at once.
+  Returns:
+    [N, M] array of IOUs.
+  """
+  polygons = np.asarray(polygons, dtype=np.float64)
+  convex_polygons = np.asarray(convex_polygons, dtype=np.float64)
+  n, m = len(polygons), len(convex_polygons)
+  ious = np.zeros(n*m)
+  first, second = np.divmod(np.arange(n*m), max(m, 1))
+  for start in range(0, n*m, max_pairs):
+    pairs = slice(start, start+max_pairs)
+    ious[pairs] = polygon_iou(
+        polygons[first[pairs]], convex_polygons[second[pairs]])
+  return ious.reshape(n, m)
+
+def octagon_iou(mask_vectors1, mask_vectors2):
+  """IOU of the octagonal masks of the same index, for the iou_fn of
+  util.sweep_nms."""
+  return polygon_iou(octagons(mask_vectors1), octagons(mask_vectors2))
+
+def pairwise_octagon_iou(mask_vectors1, mask_vectors2):
+  """IOU of every octagonal mask of mask_vectors1 with every one of
+  mask_vectors2, for the iou_fn of util.soft_nms."""
+  return pairwise_polygon_iou(octagons(mask_vectors1), octagons(mask_vectors2))
@@ -0,0 +1,280 @@
+"""Post-processing of the raw output of frozen inference graphs on the host.
+
+Decoder turns the output volume of the last convolution (conv12) into boxes,
+probabilities and classes for every anchor, for all encoding types and both
+mask parameterizations. It keeps the anchors of every feature map size and
+reuses its output and scratch buffers between calls of the same shape, so
+that decoding a stream of frames allocates no new arrays. filter_prediction
+then applies the probability threshold and NMS or soft-NMS.
+"""
+
+import numpy as np
+from scipy import special as sp
+
+from utils.anchors import anchor_grid, confident_anchors
+from utils.polygon import octagons
+from utils.util import multiclass_nms, soft_nms, sweep_nms
+
+def safe_exp(w, thresh, out=None, tmp=None):
+  """exp(w) for w <= thresh, continued linearly with the slope exp(thresh)
+  above.
+
+  Args:
+    w: array of values.
+    thresh: start of the linear part.
+    out, tmp: optional arrays of the shape of w for the result and for
+        scratch.
+  """
+  out = np.minimum(w, thresh, out=out)
+  np.exp(out, out=out)
+  tmp = np.subtract(w, thresh, out=tmp)
+  np.maximum(tmp, 0.0, out=tmp)
+  tmp += 1.0
+  out *= tmp
+  return out
+
+class Decoder(object):
+  def __init__(self, anchor_shapes, num_classes, mask_parameterization=4,
+               encoding_type='normal', image_size=(1024, 512),
+               anchor_per_grid=9):
+    """
+    Args:
+      anchor_shapes: name of a shape set of utils.anchors.ANCHOR_SHAPES.
+      num_classes: number of classes.
+      mask_parameterization: 4 for bounding boxes, 8 for octagonal masks.
+      encoding_type: 'normal', 'asymmetric_log' or 'asymmetric_linear'.
+      image_size: (width, height) of the input images, boxes are clipped to
+          it.
+      anchor_per_grid: number of anchors of every grid cell.
+    """
+    assert mask_parameterization in [4, 8], \
+        'Mask parameterization not supported: {}'.format(mask_parameterization)
+    assert encoding_type in ['normal', 'asymmetric_log', 'asymmetric_linear'], \
+        'Encoding type not supported: {}'.format(encoding_type)
+    self._anchor_shapes = anchor_shapes
+    self.num_classes = num_classes
+    self.mask_parameterization = mask_parameterization
+    self.encoding_type = encoding_type
+    self.image_size = image_size
+    self.anchor_per_grid = anchor_per_grid
+    self._anchors = {}
+    self._buffers = None
+
+  def anchors(self, H, W):
+    """Anchors of a feature map of H x W, as dict of arrays of
+    [H*W, anchor_per_grid] that broadcast against the grid of the output
+    volume."""
+    if (H, W) not in self._anchors:
+      anchors = anchor_grid(H, W, self._anchor_shapes)
+      shape = (H*W, self.anchor_per_grid)
+      self._anchors[(H, W)] = dict(
+          (name, values.reshape(shape)) for name, values in [
+              ('x', anchors.boxes[:, 0]), ('y', anchors.boxes[:, 1]),
+              ('w', anchors.boxes[:, 2]), ('h', anchors.boxes[:, 3]),
+              ('xmin', anchors.corners[:, 0]), ('ymin', anchors.corners[:, 1]),
+              ('xmax', anchors.corners[:, 2]), ('ymax', anchors.corners[:, 3]),
+              ('diag', anchors.diagonals)])
+    return self._anchors[(H, W)]
+
+  def _get_buffers(self, shape, dtype):
+    """Output and scratch buffers for a grid of the given shape, reused as
+    long as the shape does not change. Probabilities are computed in the type
+    of the output volume and boxes in float64, like the anchors."""
+    if self._buffers is None or self._buffers['key'] != (shape, dtype):
+      self._buffers = {
+          'key': (shape, dtype),
+          'probs': np.empty(shape+(self.num_classes,), dtype=dtype),
+          'boxes': np.empty(shape+(self.mask_parameterization,)),
+          'det_probs': np.empty(shape, dtype=dtype),
+          'det_class': np.empty(shape, dtype=np.intp),
+          'conf': np.empty(shape, dtype=dtype),
+          'max': np.empty(shape+(1,), dtype=dtype),
+          'tmp': [np.empty(shape) for _ in range(5)],
+      }
+    return self._buffers
+
+  def __call__(self, output_volume, conf_top_k=0, conf_thresh=0.0):
+    """Decode the output of a batch of images.
+
+    Args:
+      output_volume: [batch, H, W, channels] output of the last convolution.
+      conf_top_k: only decode this many anchors of highest confidence per
+          image, 0 decodes all.
+      conf_thresh: only decode anchors with a confidence above this, which
+          does not change the detections above this probability. Needs a
+          batch of one image.
+    Returns:
+      det_boxes: [batch, anchors, mask_parameterization] boxes in center
+          format, followed by the octagon offsets.
+      det_probs: [batch, anchors] probability of the most probable class.
+      det_class: [batch, anchors] index of the most probable class.
+      The arrays are buffers of the decoder, which are overwritten by the next
+      call of the same shape.
+    """
+    C = self.num_classes
+    P = self.mask_parameterization
+    B, H, W, num_channels = np.shape(output_volume)
+    assert num_channels == self.anchor_per_grid*(C+1+P), \
+        'Output volume of {} channels does not match {} classes and {} ' \
+        'parameters'.format(num_channels, C, P)
+    anchors = self.anchors(H, W)
+
+    # views of the output volume on the grid of [batch, H*W, anchor_per_grid]
+    output_volume = np.reshape(output_volume, [B, H*W, num_channels])
+    num_class_probs = self.anchor_per_grid*C
+    num_confidence_scores = num_class_probs+self.anchor_per_grid
+    class_logits = output_volume[:, :, :num_class_probs].reshape(
+        B, H*W, self.anchor_per_grid, C)
+    conf_logits = output_volume[:, :, num_class_probs:num_confidence_scores]
+    box_deltas = output_volume[:, :, num_confidence_scores:].reshape(
+        B, H*W, self.anchor_per_grid, P)
+
+    if conf_top_k > 0 or conf_thresh > 0:
+      # only decode the most confident anchors, the class probabilities and
+      # boxes of the others are never computed
+      conf = sp.expit(conf_logits.reshape(B, -1))
+      if B == 1:
+        idx = confident_anchors(anchor_grid(H, W, self._anchor_shapes),
+                                conf[0], conf_top_k, conf_thresh)[0][None]
+      else:
+        assert conf_thresh == 0, \
+            'Confidence thresholding needs a batch of one image'
+        top_k = min(conf_top_k, conf.shape[1])
+        idx = np.sort(
+            np.argpartition(-conf, top_k-1, axis=1)[:, :top_k], axis=1)
+      rows = np.arange(B)[:, None]
+      class_logits = class_logits.reshape(B, -1, C)[rows, idx]
+      conf_logits = conf_logits.reshape(B, -1)[rows, idx]
+      box_deltas = box_deltas.reshape(B, -1, P)[rows, idx]
+      anchors = dict((name, values.reshape(-1)[idx])
+                     for name, values in anchors.items())
+
+    buffers = self._get_buffers(conf_logits.shape, conf_logits.dtype)
+    self._decode_probs(class_logits, conf_logits, buffers)
+    self._decode_boxes(box_deltas, anchors, buffers)
+    return (buffers['boxes'].reshape(B, -1, P),
+            buffers['det_probs'].reshape(B, -1),
+            buffers['det_class'].reshape(B, -1))
+
+  def _decode_probs(self, class_logits, conf_logits, buffers):
+    probs, max_logits = buffers['probs'], buffers['max']
+    # softmax over the classes, times the confidence of the anchor
+    np.max(class_logits, axis=-1, keepdims=True, out=max_logits)
+    np.subtract(class_logits, max_logits, out=probs)
+    np.exp(probs, out=probs)
+    np.sum(probs, axis=-1, keepdims=True, out=max_logits)
+    probs /= max_logits
+    conf = sp.expit(conf_logits, out=buffers['conf'])
+    probs *= conf[..., None]
+    np.max(probs, axis=-1, out=buffers['det_probs'])
+    np.argmax(probs, axis=-1, out=buffers['det_class'])
+
+  def _decode_boxes(self, box_deltas, anchors, buffers):
+    boxes = buffers['boxes']
+    xmins, ymins, xmaxs, ymaxs, tmp = buffers['tmp']
+    delta_x, delta_y, delta_w, delta_h = [box_deltas[..., i] for i in range(4)]
+    anchor_w, anchor_h = anchors['w'], anchors['h']
+
+    if self.encoding_type == 'normal':
+      for mins, maxs, delta_c, delta_s, anchor_c, anchor_s in [
+          (xmins, xmaxs, delta_x, delta_w, anchors['x'], anchor_w),
+          (ymins, ymaxs, delta_y, delta_h, anchors['y'], anchor_h)]:
+        # center and half size into mins and maxs
+        np.multiply(delta_c, anchor_s, out=mins)
+        mins += anchor_c
+        safe_exp(delta_s, 1.0, out=maxs, tmp=tmp)
+        maxs *= anchor_s
+        maxs /= 2
+        np.add(mins, maxs, out=tmp)
+        np.subtract(mins, maxs, out=mins)
+        maxs[...] = tmp
+    elif self.encoding_type == 'asymmetric_log':
+      EPSILON = 0.5
+      for out, delta, anchor_c, anchor_s, sign in [
+          (xmins, delta_x, anchors['x'], anchor_w, -1),
+          (ymins, delta_y, anchors['y'], anchor_h, -1),
+          (xmaxs, delta_w, anchors['x'], anchor_w, 1),
+          (ymaxs, delta_h, anchors['y'], anchor_h, 1)]:
+        np.exp(delta, out=out)
+        out -= EPSILON
+        out *= anchor_s
+        if sign < 0:
+          np.subtract(anchor_c, out, out=out)
+        else:
+          out += anchor_c
+    else:
+      for out, delta, anchor_e, anchor_s in [
+          (xmins, delta_x, anchors['xmin'], anchor_w),
+          (ymins, delta_y, anchors['ymin'], anchor_h),
+          (xmaxs, delta_w, anchors['xmax'], anchor_w),
+          (ymaxs, delta_h, anchors['ymax'], anchor_h)]:
+        np.multiply(delta, anchor_s, out=out)
+        out += anchor_e
+
+    # trim to the image and transform back to the center format
+    width, height = self.image_size
+    np.clip(xmins, 0.0, width-1.0, out=xmins)
+    np.clip(ymins, 0.0, height-1.0, out=ymins)
+    np.clip(xmaxs, 0.0, width-1.0, out=xmaxs)
+    np.clip(ymaxs, 0.0, height-1.0, out=ymaxs)
+    for i, (mins, maxs) in enumerate([(xmins, xmaxs), (ymins, ymaxs)]):
+      np.subtract(maxs, mins, out=boxes[..., 2+i])
+      np.multiply(boxes[..., 2+i], 0.5, out=boxes[..., i])
+      boxes[..., i] += mins
+
+    if self.mask_parameterization == 8:
+      EPSILON = 1e-8
+      for i in range(4):
+        offset = boxes[..., 4+i]
+        safe_exp(box_deltas[..., 4+i], 1.0, out=offset, tmp=tmp)
+        offset *= anchors['diag']
+        offset -= EPSILON
+
+def filter_prediction(boxes, probs, cls_idx, prob_thresh, nms_thresh=0.4,
+                      softnms=False, sigma=0.5, method='gaussian',
+                      per_class=True):
+  """Filter the decoded detections of an image.
+
+  Args:
+    boxes: [anchors, mask_parameterization] array of boxes.
+    probs: [anchors] array of probabilities.
+    cls_idx: [anchors] array of class indices.
+    prob_thresh: detections up to this probability are dropped.
+    nms_thresh: IOU threshold of the per-class NMS.
+    softnms: decay the probabilities of overlapping boxes with soft-NMS
+        instead of removing them.
+    sigma: width of the gaussian decay of soft-NMS.
+    method: 'gaussian' or 'linear' decay of soft-NMS, the linear one decays
+        probabilities of boxes overlapping more than nms_thresh.
+    per_class: only boxes of the same class decay each other with soft-NMS.
+  Returns:
+    final_boxes, final_probs, final_cls_idx: arrays of the kept detections,
+    ordered by class for NMS and in anchor order for soft-NMS, where the
+    probabilities of removed detections are 0.
+  """
+  filtered_idx = np.nonzero(probs > prob_thresh)[0]
+  probs = probs[filtered_idx]
+  boxes = boxes[filtered_idx]
+  cls_idx = cls_idx[filtered_idx]
+
+  if softnms:
+    return boxes, soft_nms(boxes, probs, sigma, method, nms_thresh,
+                           score_thresh=prob_thresh,
+                           cls_idx=cls_idx if per_class else None), cls_idx
+  # the class offsets keep the classes apart along x, so the sweep only
+  # compares boxes of the same class
+  keep = multiclass_nms(boxes, probs, cls_idx, nms_thresh, nms_fn=sweep_nms)
+  # stable sort by class keeps the anchor order within a class
+  order = np.argsort(cls_idx[keep], kind='mergesort')
+  return boxes[keep][order], probs[keep][order], cls_idx[keep][order]
+
+def decode_parameterization(mask_vector):
+  """Decodes the octagonal parameterization of the mask to get
+     the 8 points approximation of the polygon.
+  Args:
+    mask vector: [cx, cy, w, h, of1, of2, of3, of4]
+  Returns:
+    intersecting_pts: list of points where the octagonal mask
+                      intersects the bounding box
+  """
+  return [tuple(pt) for pt in octagons(mask_vector)[0]]
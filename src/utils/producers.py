@@ -0,0 +1,134 @@
+"""Producer threads that fill the input queue of the training graph.
+
+ProducerPool runs a number of threads that each call a produce function in a
+loop, which loads one batch and enqueues it. With a range of producers, the
+pool adapts their number to keep the fill level of the queue in a target
+band: the training loop reports the queue size and the step time with
+observe() and calls adjust() every few steps. A starving queue gets as many
+producers as needed to deliver one batch per step, estimated from the median
+time a producer needs for a batch. A queue above the band loses one producer
+at a time. Every decision is printed and passed to an optional log function.
+"""
+
+import math
+import threading
+import time
+
+import numpy as np
+import tensorflow as tf
+
+class ProducerPool(object):
+  def __init__(self, produce, coord, num_producers, min_producers=None,
+               max_producers=None, queue_capacity=100, fill_band=(0.3, 0.8),
+               log_fn=None):
+    """
+    Args:
+      produce: function that loads and enqueues one batch.
+      coord: tf.train.Coordinator of the training loop.
+      num_producers: number of producers to start with.
+      min_producers, max_producers: bounds of the number of producers,
+          default to num_producers, which keeps the number fixed.
+      queue_capacity: capacity of the input queue.
+      fill_band: (low, high) target fill level of the queue.
+      log_fn: optional function called with a dict for every decision.
+    """
+    self._produce = produce
+    self._coord = coord
+    self._min = num_producers if min_producers is None else min_producers
+    self._max = num_producers if max_producers is None else max_producers
+    assert 0 < self._min <= num_producers <= self._max, \
+        'Need 0 < min producers <= {} <= max producers'.format(num_producers)
+    self._queue_capacity = queue_capacity
+    self._low, self._high = fill_band
+    self._log_fn = log_fn
+
+    self._lock = threading.Lock()
+    self._latencies = []
+    self._queue_sizes = []
+    self._step_times = []
+    # running producers and their stop events, and stopped ones to join
+    self._producers = []
+    self._stopped = []
+    for _ in range(num_producers):
+      self._add_producer()
+
+  @property
+  def num_producers(self):
+    return len(self._producers)
+
+  def _run(self, stop_event):
+    try:
+      while not self._coord.should_stop() and not stop_event.is_set():
+        start = time.time()
+        self._produce()
+        with self._lock:
+          self._latencies.append(time.time()-start)
+    except tf.errors.CancelledError:
+      self._coord.request_stop()
+
+  def _add_producer(self):
+    stop_event = threading.Event()
+    thread = threading.Thread(target=self._run, args=[stop_event])
+    thread.start()
+    self._producers.append((thread, stop_event))
+
+  def _remove_producer(self):
+    # a producer stops after enqueueing the batch it is working on
+    thread, stop_event = self._producers.pop()
+    stop_event.set()
+    self._stopped.append(thread)
+
+  def observe(self, queue_size, step_time):
+    """Report the queue size before a step and the time of the step."""
+    self._queue_sizes.append(queue_size)
+    self._step_times.append(step_time)
+
+  def adjust(self, step):
+    """Add or remove producers according to the observations since the last
+    call."""
+    with self._lock:
+      latencies, self._latencies = self._latencies, []
+    queue_sizes, self._queue_sizes = self._queue_sizes, []
+    step_times, self._step_times = self._step_times, []
+    self._stopped = [t for t in self._stopped if t.is_alive()]
+    if self._min == self._max or not queue_sizes or not latencies:
+      return
+
+    fill = np.mean(queue_sizes)/self._queue_capacity
+    latency = np.median(latencies)
+    step_time = np.mean(step_times)
+    # producers needed to deliver one batch per step
+    needed = int(math.ceil(latency/max(step_time, 1e-6)))
+    num_producers = self.num_producers
+    if fill < self._low:
+      target = min(self._max, max(num_producers+1, needed))
+    elif fill > self._high:
+      target = max(self._min, num_producers-1)
+    else:
+      target = num_producers
+
+    decision = {
+        'event': 'producers', 'step': step, 'queue_fill': float(fill),
+        'producer_ms_p50': 1000*float(latency),
+        'step_ms': 1000*float(step_time), 'needed': needed,
+        'from': num_producers, 'to': target,
+    }
+    print('Producers at step {}: queue fill {:.2f}, {:.1f} ms per batch, '
+          '{:.1f} ms per step, {} -> {}'.format(
+              step, fill, 1000*latency, 1000*step_time, num_producers, target))
+    if self._log_fn is not None:
+      self._log_fn(decision)
+
+    while self.num_producers < target:
+      self._add_producer()
+    while self.num_producers > target:
+      self._remove_producer()
+
+  def join(self):
+    """Wait for all producers, once the coordinator is stopped or the queue
+    is closed."""
+    for thread, stop_event in self._producers:
+      stop_event.set()
+    for thread in [p[0] for p in self._producers] + self._stopped:
+      thread.join()
+    self._producers, self._stopped = [], []
@@ -0,0 +1,193 @@
+"""Scheduling of several frame streams onto one network.
+
+A MultiStreamScheduler reads every stream in its own capture thread into a
+bounded FrameQueue and forms batches across the streams for one shared
+session, so that a single copy of the model serves all of them and the
+memory grows with the queued frames only. Every round takes at most one
+frame of each stream, starting after the last stream served in the previous
+round, so that no stream waits for more than one batch when there are more
+streams than frames per batch, and a fast stream cannot crowd out a slow
+one. The outputs are handed to the sink of their stream in a thread of the
+stream, so that a slow sink only holds up its own stream.
+
+Like in a Pipeline, the 'lossless' policy blocks a stream that is not served
+fast enough and the 'latest' policy drops its oldest frame instead, per
+stream. PipelineStats are kept for every stream and for all of them.
+"""
+
+import collections
+import threading
+import time
+
+from six.moves import queue
+
+from utils.pipeline import _END, FrameQueue, PipelineStats
+
+class _Stream(object):
+  def __init__(self, index, source, sink, queue_size, policy):
+    self.index = index
+    self.source = source
+    self.sink = sink
+    self.frames = FrameQueue(queue_size, policy)
+    self.outputs = FrameQueue(queue_size, policy)
+    self.stats = PipelineStats(max_samples=10000)
+    self.finished = False
+
+class MultiStreamScheduler(object):
+  def __init__(self, sources, sinks, run_batch, max_batch_size=None,
+               queue_size=2, policies=None):
+    """
+    Args:
+      sources: list of iterables of frames, one per stream, read in the
+          capture thread of the stream.
+      sinks: list of functions, one per stream, called with every output of
+          the stream in order.
+      run_batch: function of a list of frames, of any streams, returning the
+          list of their outputs, in order.
+      max_batch_size: maximum number of frames per batch, the number of
+          streams by default.
+      queue_size: capacity of the queues of every stream.
+      policies: list of the frame drop policy of every stream, 'lossless' by
+          default.
+    """
+    assert len(sources) == len(sinks), 'Every stream needs a sink'
+    policies = policies or ['lossless']*len(sources)
+    self._streams = [_Stream(i, source, sink, queue_size, policy)
+                     for i, (source, sink, policy)
+                     in enumerate(zip(sources, sinks, policies))]
+    self._run_batch = run_batch
+    self._max_batch_size = max_batch_size or len(sources)
+    self.stats = PipelineStats(max_samples=10000)
+    self._batch_sizes = collections.Counter()
+    self._stop_event = threading.Event()
+    # set whenever a capture thread queues a frame or a sink takes an output
+    self._frame_ready = threading.Event()
+    self._error = None
+
+  @property
+  def stream_stats(self):
+    return [stream.stats for stream in self._streams]
+
+  @property
+  def num_dropped(self):
+    return sum(stream.frames.num_dropped + stream.outputs.num_dropped
+               for stream in self._streams)
+
+  def _capture(self, stream):
+    try:
+      frames = iter(stream.source)
+      while not self._stop_event.is_set():
+        start = time.time()
+        try:
+          frame = next(frames)
+        except StopIteration:
+          break
+        stream.stats.add('capture', time.time()-start)
+        if not stream.frames.put((start, frame), self._stop_event):
+          return
+        self._frame_ready.set()
+    except Exception as e:
+      self._error = e
+      self._stop_event.set()
+    stream.frames.put(_END, self._stop_event)
+    self._frame_ready.set()
+
+  def _sink(self, stream):
+    try:
+      while True:
+        item = stream.outputs.get(self._stop_event)
+        if item is _END:
+          break
+        # the stream may be scheduled again
+        self._frame_ready.set()
+        capture_time, output = item
+        start = time.time()
+        stream.sink(output)
+        stream.stats.add('sink', time.time()-start)
+        stream.stats.frame_done(capture_time)
+        self.stats.frame_done(capture_time)
+    except Exception as e:
+      self._error = e
+      self._stop_event.set()
+
+  def _next_batch(self, first):
+    """Frames of the next round, at most one per stream, starting at stream
+    index first. Streams whose output queue is full are skipped, so that the
+    puts of the outputs never block and a slow sink only holds up its own
+    stream. Returns the batch and the index to start the next round at."""
+    batch = []
+    streams = self._streams[first:] + self._streams[:first]
+    for stream in streams:
+      if len(batch) == self._max_batch_size:
+        break
+      first = (stream.index+1) % len(self._streams)
+      if stream.finished or stream.outputs.full():
+        continue
+      try:
+        item = stream.frames.get_nowait()
+      except queue.Empty:
+        continue
+      if item is _END:
+        stream.finished = True
+        stream.outputs.put(_END, self._stop_event)
+      else:
+        batch.append((stream, item))
+    return batch, first
+
+  def _schedule(self):
+    first = 0
+    while not self._stop_event.is_set():
+      if all(stream.finished for stream in self._streams):
+        return
+      self._frame_ready.clear()
+      batch, first = self._next_batch(first)
+      if not batch:
+        self._frame_ready.wait(0.1)
+        continue
+      start = time.time()
+      for stream, (capture_time, _) in batch:
+        stream.stats.add('queue', start-capture_time)
+      outputs = self._run_batch([frame for _, (_, frame) in batch])
+      self.stats.add('batch', time.time()-start)
+      self._batch_sizes[len(batch)] += 1
+      for (stream, (capture_time, _)), output in zip(batch, outputs):
+        stream.outputs.put((capture_time, output), self._stop_event)
+
+  def run(self):
+    """Run all streams to their end, batches are run in the calling thread.
+    Errors of any thread are raised here."""
+    threads = []
+    for stream in self._streams:
+      for target in [self._capture, self._sink]:
+        thread = threading.Thread(target=target, args=[stream])
+        thread.daemon = True
+        threads.append(thread)
+    for thread in threads:
+      thread.start()
+    try:
+      self._schedule()
+    except BaseException:
+      self._stop_event.set()
+      raise
+    finally:
+      if self._error is not None:
+        self._stop_event.set()
+      for thread in threads:
+        thread.join()
+    if self._error is not None:
+      raise self._error
+
+  def stop(self):
+    """Stop all streams, frames in the queues are discarded."""
+    self._stop_event.set()
+
+  def report(self):
+    num_batches = sum(self._batch_sizes.values())
+    num_frames = sum(size*n for size, n in self._batch_sizes.items())
+    lines = ['all streams: ' + self.stats.report(self.num_dropped),
+             '  mean batch size {:.2f} over {} batches'.format(
+                 float(num_frames)/max(num_batches, 1), num_batches)]
+    for stream in self._streams:
+      dropped = stream.frames.num_dropped + stream.outputs.num_dropped
+      lines.append('stream {}: '.format(stream.index) + stream.stats.report(dropped))
+    return '\n'.join(lines)
@@ -0,0 +1,182 @@
+"""Training step telemetry.
+
+StepTelemetry collects the timings of the training steps and of the data
+producers and emits one record per window of steps, as a line of JSON through
+a JsonlWriter and as TensorBoard scalars. A record breaks the mean step time
+into the time spent waiting for data, computing, writing summaries and
+checkpointing, and reports the fill level of the input queue, percentiles of
+the time a producer needs for one batch and the resident memory of the
+process. With queued input, the time waiting for data is measured on sampled
+steps that are traced.
+"""
+
+import json
+import os
+import threading
+import time
+
+import numpy as np
+import tensorflow as tf
+from six.moves import queue
+
+class JsonlWriter(object):
+  """Appends records as lines of JSON to a file from a background thread, so
+  that writing never blocks the caller. The file is kept open and flushed
+  every flush_secs."""
+  def __init__(self, path, flush_secs=10):
+    self._file = open(path, 'a')
+    self._queue = queue.Queue()
+    self._flush_secs = flush_secs
+    self._thread = threading.Thread(target=self._run)
+    self._thread.daemon = True
+    self._thread.start()
+
+  def write(self, record):
+    self._queue.put(record)
+
+  def close(self):
+    """Write all pending records and close the file."""
+    self._queue.put(None)
+    self._thread.join()
+    self._file.close()
+
+  def _run(self):
+    last_flush = time.time()
+    while True:
+      try:
+        record = self._queue.get(timeout=self._flush_secs)
+      except queue.Empty:
+        record = False
+      if record is None:
+        break
+      if record:
+        self._file.write(json.dumps(record, sort_keys=True)+'\n')
+      if time.time()-last_flush >= self._flush_secs:
+        self._file.flush()
+        last_flush = time.time()
+    self._file.flush()
+
+def resident_memory():
+  """Resident memory of the process in bytes, None where /proc is not
+  available."""
+  try:
+    with open('/proc/self/statm') as f:
+      return int(f.read().split()[1])*os.sysconf('SC_PAGE_SIZE')
+  except (IOError, OSError, ValueError):
+    return None
+
+def queue_wait_time(run_metadata, dequeue_op_name):
+  """Time in seconds the dequeue op of a traced step waited for data."""
+  for dev_stats in run_metadata.step_stats.dev_stats:
+    for node_stats in dev_stats.node_stats:
+      if node_stats.node_name == dequeue_op_name:
+        return node_stats.all_end_rel_micros/1e6
+  return 0.0
+
+class StepTelemetry(object):
+  def __init__(self, path, batch_size, queue_capacity, summary_writer=None):
+    """
+    Args:
+      path: JSONL file to append the records to.
+      batch_size: number of images per step.
+      queue_capacity: capacity of the input queue.
+      summary_writer: optional tf.summary.FileWriter for the scalars.
+    """
+    self._writer = JsonlWriter(path)
+    self._batch_size = batch_size
+    self._queue_capacity = queue_capacity
+    self._summary_writer = summary_writer
+    self._producer_times = []
+    self._lock = threading.Lock()
+    self._reset()
+
+  def _reset(self):
+    self._num_steps = 0
+    self._times = {'step': 0.0, 'summary': 0.0, 'checkpoint': 0.0}
+    # steps whose data wait is measured and their total step time
+    self._num_measured = 0
+    self._measured_step_time = 0.0
+    self._measured_wait = 0.0
+    self._queue_sizes = []
+
+  def add_producer_time(self, seconds):
+    """Time a producer thread needed to load and enqueue one batch."""
+    with self._lock:
+      self._producer_times.append(seconds)
+
+  def add_step(self, step_time, data_wait=None, summary_time=0.0,
+               checkpoint_time=0.0, queue_size=None):
+    """Record a training step.
+
+    Args:
+      step_time: wall time of the step in seconds, including summaries and
+          checkpoints.
+      data_wait: time in seconds the step waited for data, if it was measured.
+      summary_time: time spent on summaries and visualization.
+      checkpoint_time: time spent on checkpointing.
+      queue_size: number of examples in the input queue before the step.
+    """
+    self._num_steps += 1
+    self._times['step'] += step_time
+    self._times['summary'] += summary_time
+    self._times['checkpoint'] += checkpoint_time
+    if data_wait is not None:
+      self._num_measured += 1
+      self._measured_wait += data_wait
+      self._measured_step_time += step_time - summary_time - checkpoint_time
+    if queue_size is not None:
+      self._queue_sizes.append(queue_size)
+
+  def emit(self, step):
+    """Write the record of the steps since the last one."""
+    if self._num_steps == 0:
+      return
+    n = float(self._num_steps)
+    step_time = self._times['step']/n
+    summary_time = self._times['summary']/n
+    checkpoint_time = self._times['checkpoint']/n
+    record = {
+        'step': step,
+        'time': time.time(),
+        'num_steps': self._num_steps,
+        'images_per_sec': self._batch_size/max(step_time, 1e-9),
+        'step_ms': 1000*step_time,
+        'summary_ms': 1000*summary_time,
+        'checkpoint_ms': 1000*checkpoint_time,
+    }
+    if self._num_measured > 0:
+      # share of the training time spent waiting, from the measured steps
+      wait_share = self._measured_wait/max(self._measured_step_time, 1e-9)
+      train_time = step_time - summary_time - checkpoint_time
+      record['data_wait_ms'] = 1000*wait_share*train_time
+      record['compute_ms'] = 1000*(1-wait_share)*train_time
+    if self._queue_sizes:
+      record['queue_size'] = float(np.mean(self._queue_sizes))
+      record['queue_fill'] = record['queue_size']/self._queue_capacity
+    with self._lock:
+      producer_times, self._producer_times = self._producer_times, []
+    if producer_times:
+      for p in [50, 90, 99]:
+        record['producer_ms_p{}'.format(p)] = \
+            1000*float(np.percentile(producer_times, p))
+    rss = resident_memory()
+    if rss is not None:
+      record['rss_mb'] = rss/(1024.0*1024.0)
+
+    self._writer.write(record)
+    if self._summary_writer is not None:
+      summary = tf.Summary(value=[
+          tf.Summary.Value(tag='telemetry/'+k, simple_value=v)
+          for k, v in sorted(record.items())
+          if k not in ['step', 'time', 'num_steps']])
+      self._summary_writer.add_summary(summary, step)
+    self._reset()
+
+  def add_event(self, record):
+    """Write a record of an event, like a change of the number of
+    producers."""
+    record = dict(record, time=time.time())
+    self._writer.write(record)
+
+  def close(self):
+    self._writer.close()
@@ -2,7 +2,9 @@
 
 """Utility functions."""
 
+import json
 import numpy as np
+import os
 import time
 import tensorflow as tf
 import math
@@ -57,88 +59,196 @@ def batch_iou(boxes, box):
   assert not condition, "Error in IOU: "+ str(inter)+" "+str(union)
   return inter/union
 
-def nms(boxes, probs, threshold):
-  """Non-Maximum supression.
+def pairwise_iou(boxes1, boxes2):
+  """Compute the Intersection-Over-Union of every box of boxes1 with every box
+  of boxes2, with the same arithmetic as batch_iou.
+
+  Args:
+    boxes1: 2D array of N [cx, cy, width, height].
+    boxes2: 2D array of M [cx, cy, width, height].
+  Returns:
+    ious: [N, M] array of float numbers in range [0, 1].
+  """
+  EPSILON = 1e-8
+  box = boxes1.T[:, :, None]
+  lr = np.maximum(
+      np.minimum(boxes2[:,0]+0.5*boxes2[:,2], box[0]+0.5*box[2]) - \
+      np.maximum(boxes2[:,0]-0.5*boxes2[:,2], box[0]-0.5*box[2]),
+      0
+  )
+  tb = np.maximum(
+      np.minimum(boxes2[:,1]+0.5*boxes2[:,3], box[1]+0.5*box[3]) - \
+      np.maximum(boxes2[:,1]-0.5*boxes2[:,3], box[1]-0.5*box[3]),
+      0
+  )
+  inter = lr*tb
+  union = (boxes2[:,2]*boxes2[:,3] + box[2]*box[3] - inter) + EPSILON
+  return inter/union
+
+def _suppressed(boxes, threshold, chunk_size=1024):
+  """Mask of the boxes that overlap a preceding box by more than threshold.
+  The IOU matrix is computed in blocks of chunk_size rows."""
+  suppressed = np.zeros(len(boxes), dtype=bool)
+  for start in range(0, len(boxes)-1, chunk_size):
+    stop = min(start+chunk_size, len(boxes)-1)
+    overlaps = pairwise_iou(boxes[start:stop], boxes[start+1:]) > threshold
+    # row i of the block is box start+i and column j is box start+1+j, so the
+    # upper triangle pairs every box with the following ones
+    suppressed[start+1:] |= np.any(np.triu(overlaps), axis=0)
+  return suppressed
+
+def nms(boxes, probs, threshold, chunk_size=1024):
+  """Non-Maximum supression. A box is removed if it overlaps any more
+  probable box, whether that box is kept or not.
   Args:
     boxes: array of [cx, cy, w, h] (center format)
     probs: array of probabilities
     threshold: two boxes are considered overlapping if their IOU is largher than
         this threshold
-    form: 'center' or 'diagonal'
+    chunk_size: number of rows of the IOU matrix computed at once
   Returns:
     keep: array of True or False.
   """
 
   order = probs.argsort()[::-1]
-  keep = [True]*len(order)
-
-  for i in range(len(order)-1):
-    ovps = batch_iou(boxes[order[i+1:]], boxes[order[i]])
-    for j, ov in enumerate(ovps):
-      if ov > threshold:
-        keep[order[j+i+1]] = False
+  keep = np.ones(len(order), dtype=bool)
+  keep[order] = ~_suppressed(np.asarray(boxes)[order], threshold, chunk_size)
   return keep
 
-# TODO(bichen): this is not equivalent with full NMS. Need to improve it.
-def recursive_nms(boxes, probs, threshold, form='center'):
-  """Recursive Non-Maximum supression.
+def multiclass_nms(boxes, probs, cls_idx, threshold, nms_fn=None):
+  """Non-Maximum supression of the boxes of all classes in one call, where only
+  boxes of the same class suppress each other. The boxes of class c are moved
+  along x by c times an offset larger than the extent of all boxes, so that
+  boxes of different classes never overlap. Same as nms on the boxes of every
+  class, up to the order of boxes with equal probabilities.
   Args:
-    boxes: array of [cx, cy, w, h] (center format) or [xmin, ymin, xmax, ymax]
+    boxes: array of [cx, cy, w, h] (center format)
     probs: array of probabilities
+    cls_idx: array of class indices
     threshold: two boxes are considered overlapping if their IOU is largher than
         this threshold
-    form: 'center' or 'diagonal'
+    nms_fn: NMS of the moved boxes, a function of boxes, probs and threshold,
+        nms by default
   Returns:
     keep: array of True or False.
   """
-
-  assert form == 'center' or form == 'diagonal', \
-      'bounding box format not accepted: {}.'.format(form)
-
-  if form == 'center':
-    # convert to diagonal format
-    boxes = np.array([bbox_transform(b) for b in boxes])
-
-  areas = (boxes[:, 2]-boxes[:, 0])*(boxes[:, 3]-boxes[:, 1])
-  hidx = boxes[:, 0].argsort()
-  keep = [True]*len(hidx)
-
-  def _nms(hidx):
-    order = probs[hidx].argsort()[::-1]
-
-    for idx in range(len(order)):
-      if not keep[hidx[order[idx]]]:
-        continue
-      xx2 = boxes[hidx[order[idx]], 2]
-      for jdx in range(idx+1, len(order)):
-        if not keep[hidx[order[jdx]]]:
-          continue
-        xx1 = boxes[hidx[order[jdx]], 0]
-        if xx2 < xx1:
-          break
-        w = xx2 - xx1
-        yy1 = max(boxes[hidx[order[idx]], 1], boxes[hidx[order[jdx]], 1])
-        yy2 = min(boxes[hidx[order[idx]], 3], boxes[hidx[order[jdx]], 3])
-        if yy2 <= yy1:
-          continue
-        h = yy2-yy1
-        inter = w*h
-        iou = inter/(areas[hidx[order[idx]]]+areas[hidx[order[jdx]]]-inter)
-        if iou > threshold:
-          keep[hidx[order[jdx]]] = False
-
-  def _recur(hidx):
-    if len(hidx) <= 20:
-      _nms(hidx)
+  nms_fn = nms_fn or nms
+  # float64, where moving float32 coordinates by a power of two is exact
+  boxes = np.array(boxes, dtype=np.float64)
+  if len(boxes) == 0:
+    return np.ones(0, dtype=bool)
+  extent = np.max(boxes[:,0]+0.5*boxes[:,2]) - np.min(boxes[:,0]-0.5*boxes[:,2])
+  offset = 2.0**np.ceil(np.log2(extent+1))
+  boxes[:,0] += offset*np.asarray(cls_idx)
+  return nms_fn(boxes, probs, threshold)
+
+def sweep_nms(boxes, probs, threshold, cls_idx=None, max_pairs=1<<20,
+              iou_fn=None):
+  """Non-Maximum supression that only compares boxes which overlap along x.
+  Boxes are sorted by their left edge, so that the boxes overlapping a box
+  along x are the ones that start before it ends, found by a binary search.
+  Same result as nms for threshold >= 0, as boxes that do not overlap along x
+  have an IOU of 0, but the number of compared pairs grows with the overlap
+  of the boxes rather than quadratically with their number.
+  Args:
+    boxes: array of [cx, cy, w, h] (center format)
+    probs: array of probabilities
+    threshold: two boxes are considered overlapping if their IOU is largher than
+        this threshold
+    cls_idx: if given, array of class indices, and only boxes of the same class
+        suppress each other like in multiclass_nms
+    max_pairs: maximum number of pairs compared at once
+    iou_fn: if given, function of two arrays of boxes that returns the IOUs of
+        the boxes of the same index, e.g. polygon.octagon_iou for octagonal
+        masks, which lie within their bounding boxes
+  Returns:
+    keep: array of True or False.
+  """
+  assert threshold >= 0, 'NMS threshold must not be negative'
+  boxes = np.asarray(boxes)
+  n = len(boxes)
+  suppressed = np.zeros(n, dtype=bool)
+  if n < 2:
+    return ~suppressed
+
+  rank = np.empty(n, dtype=np.int64)
+  rank[probs.argsort()[::-1]] = np.arange(n)
+  xmins = boxes[:,0]-0.5*boxes[:,2]
+  xmaxs = boxes[:,0]+0.5*boxes[:,2]
+  order = np.argsort(xmins, kind='mergesort')
+  # box order[i] overlaps the boxes order[i+1:ends[i]] along x
+  ends = np.searchsorted(xmins[order], xmaxs[order], side='left')
+  counts = np.maximum(ends, np.arange(1, n+1)) - np.arange(1, n+1)
+  cum_counts = np.cumsum(counts)
+
+  start = 0
+  while start < n:
+    done = cum_counts[start-1] if start > 0 else 0
+    stop = max(start+1, np.searchsorted(cum_counts, done+max_pairs, side='right'))
+    c = counts[start:stop]
+    first = np.repeat(np.arange(start, stop), c)
+    second = first + 1 + np.arange(len(first)) - np.repeat(np.cumsum(c)-c, c)
+    a, b = order[first], order[second]
+    if cls_idx is not None:
+      same_class = cls_idx[a] == cls_idx[b]
+      a, b = a[same_class], b[same_class]
+    # the less probable box of an overlapping pair is suppressed
+    higher = np.where(rank[a] < rank[b], a, b)
+    lower = np.where(rank[a] < rank[b], b, a)
+    if len(lower) > 0:
+      if iou_fn is None:
+        ious = batch_iou(boxes[lower], boxes[higher].T)
+      else:
+        ious = iou_fn(boxes[lower], boxes[higher])
+      suppressed[lower[ious > threshold]] = True
+    start = stop
+
+  return ~suppressed
+
+def soft_nms(boxes, probs, sigma=0.5, method='gaussian', iou_thresh=0.3,
+             score_thresh=0.001, cls_idx=None, iou_fn=None):
+  """Soft Non-Maximum supression. Repeatedly selects the most probable
+  remaining box and decays the probabilities of the remaining boxes by their
+  overlap with it: by exp(-iou^2/sigma) for the gaussian method, and by 1-iou
+  for IOUs above iou_thresh for the linear one. Stops once no remaining box is
+  more probable than score_thresh.
+  Args:
+    boxes: array of [cx, cy, w, h] (center format)
+    probs: array of probabilities
+    sigma: width of the gaussian decay
+    method: 'gaussian' or 'linear'
+    iou_thresh: IOU above which the linear method decays a probability
+    score_thresh: boxes not more probable than this are removed
+    cls_idx: if given, array of class indices, and only boxes of the same class
+        decay each other
+    iou_fn: if given, function of two arrays of boxes that returns the matrix
+        of their IOUs, e.g. polygon.pairwise_octagon_iou for octagonal masks
+  Returns:
+    new_probs: array of the decayed probabilities, 0 for removed boxes.
+  """
+  assert method == 'gaussian' or method == 'linear', \
+      'soft-NMS method not supported: {}.'.format(method)
+
+  boxes = np.asarray(boxes)
+  new_probs = np.array(probs, dtype=np.float64)
+  ious = pairwise_iou(boxes, boxes) if iou_fn is None else iou_fn(boxes, boxes)
+  if cls_idx is not None:
+    ious *= cls_idx[:, None] == cls_idx[None, :]
+
+  remaining = np.ones(len(new_probs), dtype=bool)
+  while remaining.any():
+    best = np.argmax(np.where(remaining, new_probs, -1.0))
+    if new_probs[best] <= score_thresh:
+      break
+    remaining[best] = False
+    ovps = ious[best, remaining]
+    if method == 'gaussian':
+      new_probs[remaining] *= np.exp(-ovps**2/sigma)
     else:
-      mid = len(hidx)/2
-      _recur(hidx[:mid])
-      _recur(hidx[mid:])
-      _nms([idx for idx in hidx if keep[idx]])
+      new_probs[remaining] *= np.where(ovps > iou_thresh, 1.0-ovps, 1.0)
 
-  _recur(hidx)
-
-  return keep
+  new_probs[new_probs <= score_thresh] = 0.0
+  return new_probs
 
 def sparse_to_dense(sp_indices, output_shape, values, default_value=0):
   """Build a dense matrix from sparse representations.
@@ -228,6 +338,51 @@ def bbox_transform_inv2(bbox):
     out_box[3]  = height
   return out_box
 
+def tensor_pairwise_iou(boxes):
+  """Compute the IOU between every pair of boxes, separately for every batch
+  element.
+
+  Args:
+    boxes: tensor of shape [batch, N, 4] with boxes in [cx, cy, w, h] format.
+  Returns:
+    ious: tensor of shape [batch, N, N].
+  """
+  with tf.variable_scope('pairwise_iou') as scope:
+    cx, cy, w, h = tf.unstack(boxes, axis=2)
+    xmin, ymin, xmax, ymax = bbox_transform([cx, cy, w, h])
+
+    lr = tf.maximum(
+        tf.minimum(tf.expand_dims(xmax, 2), tf.expand_dims(xmax, 1)) \
+        - tf.maximum(tf.expand_dims(xmin, 2), tf.expand_dims(xmin, 1)),
+        0.0
+    )
+    tb = tf.maximum(
+        tf.minimum(tf.expand_dims(ymax, 2), tf.expand_dims(ymax, 1)) \
+        - tf.maximum(tf.expand_dims(ymin, 2), tf.expand_dims(ymin, 1)),
+        0.0
+    )
+    inter = lr*tb
+    area = w*h
+    union = tf.expand_dims(area, 2) + tf.expand_dims(area, 1) - inter
+    return inter/(union+1e-8)
+
+def batch_gather(params, indices):
+  """Gather slices of params along the second axis, separately for every batch
+  element.
+
+  Args:
+    params: tensor of shape [batch, N, ...].
+    indices: int32 tensor of shape [batch, K] with indices in range [0, N).
+  Returns:
+    tensor of shape [batch, K, ...].
+  """
+  with tf.variable_scope('batch_gather') as scope:
+    params_shape = tf.shape(params)
+    offsets = tf.expand_dims(tf.range(params_shape[0])*params_shape[1], 1)
+    flat_params = tf.reshape(
+        params, tf.concat([[-1], params_shape[2:]], axis=0))
+    return tf.gather(flat_params, indices + offsets)
+
 class Timer(object):
   def __init__(self):
     self.total_time   = 0.0
@@ -263,4 +418,24 @@ def safe_exp(w, thresh):
     out = lin_region*lin_out + (1.-lin_region)*exp_out
   return out
 
+def _graph_nodes_path(graph_path):
+  return os.path.splitext(graph_path)[0] + '.nodes.json'
+
+def write_graph_nodes(graph_path, input_node_names, output_node_names):
+  """Write the input and output node names of a frozen inference graph to a
+  JSON file next to it, e.g. frozen_inference_graph.nodes.json."""
+  with open(_graph_nodes_path(graph_path), 'w') as f:
+    json.dump({'inputs': list(input_node_names),
+               'outputs': list(output_node_names)}, f, indent=2)
+
+def read_graph_nodes(graph_path):
+  """Input and output node names of a frozen inference graph, as written by
+  write_graph_nodes, or None for graphs exported without them."""
+  path = _graph_nodes_path(graph_path)
+  if not tf.gfile.Exists(path):
+    return None
+  with tf.gfile.GFile(path) as f:
+    nodes = json.load(f)
+  return nodes['inputs'], nodes['outputs']
+
 
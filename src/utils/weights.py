@@ -0,0 +1,99 @@
+"""Pretrained weights in a memory-mapped format.
+
+The pickled weight dicts written by caffemodel2pkl.py have to be unpickled as a
+whole before a net is built, and their kernels are in the caffe layout. The
+mapped format is a directory with one uncompressed .npy file per blob and an
+index.json that lists the blobs of every layer. Kernels are stored in the
+tensorflow layout: [h, w, in, out] for convolutions and [in, out] for fully
+connected layers. The blobs are memory-mapped when they are read, so that a
+net only reads the layers it uses. Convert a pickled weight dict with
+
+  python ./src/utils/weights.py --pkl_path=./data/SqueezeNet/squeezenet_v1.1.pkl \\
+      --out_dir=./data/SqueezeNet/squeezenet_v1.1
+"""
+
+import argparse
+import json
+import os
+
+import numpy as np
+
+INDEX_FILE = 'index.json'
+
+def to_tf_layout(blob):
+  """Re-order a caffe kernel with shape [out, in, h, w] to [h, w, in, out] and
+  one with shape [out, in] to [in, out]. Other blobs are returned as they are."""
+  blob = np.asarray(blob)
+  if blob.ndim == 4:
+    return np.ascontiguousarray(np.transpose(blob, [2, 3, 1, 0]))
+  if blob.ndim == 2:
+    return np.ascontiguousarray(np.transpose(blob, [1, 0]))
+  return blob
+
+class MappedWeights(object):
+  """Read-only dict of layer name to the list of its blobs, which are memory-
+  mapped on first access."""
+  def __init__(self, weight_dir):
+    self._weight_dir = weight_dir
+    with open(os.path.join(weight_dir, INDEX_FILE)) as f:
+      self._index = json.load(f)
+    self._cache = {}
+
+  def __contains__(self, layer_name):
+    return layer_name in self._index
+
+  def __getitem__(self, layer_name):
+    if layer_name not in self._cache:
+      self._cache[layer_name] = [
+          np.load(os.path.join(self._weight_dir, f), mmap_mode='r')
+          for f in self._index[layer_name]]
+    return self._cache[layer_name]
+
+  def keys(self):
+    return self._index.keys()
+
+def load_pretrained_weights(path):
+  """Pretrained weights of a net, with kernels in the tensorflow layout.
+
+  Args:
+    path: directory of mapped weights, or a pickled weight dict of
+        caffemodel2pkl.py which is converted in memory.
+  Returns:
+    dict-like of layer name to the list of its blobs.
+  """
+  if os.path.isdir(path):
+    return MappedWeights(path)
+  # pickled weight dicts are only supported for backward compatibility
+  import joblib
+  return {layer_name: [to_tf_layout(b) for b in blobs]
+          for layer_name, blobs in joblib.load(path).items()}
+
+def save_mapped_weights(weights, out_dir):
+  """Write a weight dict with kernels in the caffe layout as mapped weights.
+
+  Args:
+    weights: dict of layer name to the list of its blobs.
+    out_dir: directory to write to.
+  """
+  if not os.path.exists(out_dir):
+    os.makedirs(out_dir)
+  index = {}
+  for i, layer_name in enumerate(sorted(weights)):
+    index[layer_name] = []
+    for j, blob in enumerate(weights[layer_name]):
+      file_name = '{:04d}_{}.npy'.format(i, j)
+      np.save(os.path.join(out_dir, file_name), to_tf_layout(blob))
+      index[layer_name].append(file_name)
+  # the index is written last, an interrupted conversion cannot be loaded
+  with open(os.path.join(out_dir, INDEX_FILE), 'w') as f:
+    json.dump(index, f, indent=2, sort_keys=True)
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='')
+  parser.add_argument('--pkl_path', help='Pickled weight dict of caffemodel2pkl.py.')
+  parser.add_argument('--out_dir', help='Directory to write the mapped weights to.')
+  args = parser.parse_args()
+
+  import joblib
+  save_mapped_weights(joblib.load(args.pkl_path), args.out_dir)
+  print('Mapped weights saved to {}'.format(args.out_dir))